@@ -1,10 +1,76 @@
-from app.schema import Schema
+from __future__ import annotations
+import argparse
+import os
+import sys
+from app import artifact
+from app.dump import Dumper, FORMATS, DEFAULT_CHUNK_SIZE
 
-PATH = '/home/ksergey/dev/pysbe/resources/FixBinary.xml'
+def parseCondition(text: str) -> tuple:
+    # Field=value or Field=value,value for membership; values stay text and are encoded by the projection
+    # per field type: chars as text, numbers parsed, enum values by name or raw value
+    path, separator, values = text.partition('=')
+    if not separator or not path:
+        raise argparse.ArgumentTypeError(f'condition {text} is not FIELD=VALUE')
+    values = values.split(',')
+    return path, values[0] if len(values) == 1 else set(values)
+
+def templateIds(layout, keys: list) -> list:
+    result = []
+    for key in keys:
+        message = layout.messages.get(int(key)) if key.isdigit() else layout.messagesByName.get(key)
+        if message is None:
+            raise Exception(f'unknown template {key}')
+        result.append(message.id)
+    return result
 
 def main() -> None:
-    schema = Schema.loadFromFile(PATH)
-    print(schema)
+    parser = argparse.ArgumentParser(prog='python -m app', description='dump SBE messages of a capture as JSON lines or aligned text')
+    parser.add_argument('schema', help='path to SBE XML schema')
+    parser.add_argument('capture', nargs='?', default='-', help='path to capture file, stdin when omitted or -')
+    parser.add_argument('--format', choices=FORMATS, default='json', help='output format (default: json)')
+    parser.add_argument('-t', '--template', action='append', default=[], help='template id or message name to dump, repeatable')
+    parser.add_argument('-f', '--field', action='append', default=[], help='Message.Field(.Member) to output, repeatable')
+    parser.add_argument('-w', '--where', action='append', default=[], type=parseCondition, help='FIELD=VALUE[,VALUE] filter, enum values by name or raw value, repeatable')
+    parser.add_argument('--raw', action='store_true', help='enum and set values as raw numbers')
+    parser.add_argument('--raw-nulls', action='store_true', help='null values as their raw encoding')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='formatting worker processes, output order is kept')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='messages per worker task')
+    parser.add_argument('--start', type=int, default=0, help='first capture position')
+    parser.add_argument('--stop', type=int, default=None, help='capture position to stop at')
+    parser.add_argument('--no-packet-header', action='store_true', help='capture records carry no MDP3 packet header')
+    parser.add_argument('--info', action='store_true', help='print the schema summary and exit')
+    args = parser.parse_args()
+
+    layout = artifact.load(args.schema)
+    if args.info:
+        print(layout.schema)
+        for templateId, message in sorted(layout.messages.items()):
+            print(f'{templateId:>6} {message.name} blockLength={message.blockLength}')
+        return
+
+    try:
+        options = {
+            'fields': args.field,
+            'templateIds': templateIds(layout, args.template) or None,
+            'where': dict(args.where),
+            'format': args.format,
+            'enums': not args.raw,
+            'nulls': not args.raw_nulls
+        }
+        dumper = Dumper(layout, options, not args.no_packet_header, args.workers, args.chunk_size)
+    except Exception as error:
+        # unknown templates or fields and filter values that do not fit their field
+        parser.error(str(error))
+    try:
+        if args.capture == '-':
+            dumper.dumpStream(sys.stdin.buffer, sys.stdout)
+        else:
+            dumper.dumpCapture(args.capture, sys.stdout, args.start, args.stop)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # output closed early (e.g. piped into head), remaining output is discarded
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,72 @@
+from __future__ import annotations
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+from typing import Optional
+from app.schema import Schema
+from app.layout import SchemaLayout
+from app.codegen import defaultCacheDir
+
+# compiled schema artifact: header followed by the pickled SchemaLayout
+ARTIFACT_MAGIC = b'PYSBEART'
+ARTIFACT_VERSION = 4
+ARTIFACT_HEADER = struct.Struct('<8sI32s')
+
+def sourceDigest(path: str) -> bytes:
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).digest()
+
+def artifactPath(path: str, digest: bytes, cacheDir: Optional[str] = None) -> str:
+    name = f'{os.path.basename(path)}.{digest.hex()[:24]}.sbec'
+    return os.path.join(cacheDir or defaultCacheDir(), name)
+
+def compile(path: str) -> SchemaLayout:
+    return SchemaLayout(Schema.loadFromFile(path))
+
+def save(layout: SchemaLayout, path: str, digest: bytes) -> None:
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as file:
+        file.write(ARTIFACT_HEADER.pack(ARTIFACT_MAGIC, ARTIFACT_VERSION, digest))
+        pickle.dump(layout, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+
+def read(path: str, digest: Optional[bytes] = None) -> Optional[SchemaLayout]:
+    # None when the artifact is missing, stale, written by another format version or damaged (e.g. truncated
+    # by a crashed writer or a full disk), so that load rebuilds it
+    if not os.path.exists(path) or os.path.getsize(path) < ARTIFACT_HEADER.size:
+        return None
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        magic, version, storedDigest = ARTIFACT_HEADER.unpack_from(mapped, 0)
+        if magic != ARTIFACT_MAGIC or version != ARTIFACT_VERSION:
+            return None
+        if digest is not None and digest != storedDigest:
+            return None
+        with memoryview(mapped) as view:
+            try:
+                layout = pickle.loads(view[ARTIFACT_HEADER.size:])
+            except Exception:
+                # damaged pickles fail in many ways: UnpicklingError, EOFError, ValueError, TypeError, ...
+                return None
+    return layout if isinstance(layout, SchemaLayout) else None
+
+def load(path: str, artifact: Optional[str] = None, cacheDir: Optional[str] = None) -> SchemaLayout:
+    # compiled layout of the schema at path, the XML is parsed only when its digest changed;
+    # an explicit artifact is used as is when the XML is not deployed next to it
+    if artifact is not None and not os.path.exists(path):
+        layout = read(artifact)
+        if layout is None:
+            raise Exception(f'artifact {artifact} is not valid and schema {path} not found')
+        return layout
+
+    digest = sourceDigest(path)
+    artifact = artifact or artifactPath(path, digest, cacheDir)
+    layout = read(artifact, digest)
+    if layout is None:
+        layout = compile(path)
+        save(layout, artifact, digest)
+    return layout
@@ -0,0 +1,39 @@
+from __future__ import annotations
+import argparse
+import json
+import sys
+from app.bench.runner import Benchmark, DEFAULT_SCHEMA, compare
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m app.bench', description='benchmark schema load, encode, decode and capture scan')
+    parser.add_argument('--schema', default=DEFAULT_SCHEMA, help='path to SBE XML schema (default: FixBinary.xml)')
+    parser.add_argument('--count', type=int, default=200, help='messages per template for encode/decode')
+    parser.add_argument('--corpus', type=int, default=100000, help='messages in the bulk scan corpus')
+    parser.add_argument('--synthetic', type=int, default=500, help='messages in the synthetic schema')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement, the best is reported')
+    parser.add_argument('--only', nargs='+', choices=['load', 'encode', 'groups', 'scan'], help='suites to run')
+    parser.add_argument('-o', '--output', help='write JSON results to file, stdout if omitted')
+    parser.add_argument('--baseline', help='JSON results to compare with, exits with 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change reported as regression')
+    args = parser.parse_args()
+
+    benchmark = Benchmark(args.schema, args.count, args.corpus, args.seed, args.repeat, args.synthetic)
+    results = benchmark.run(args.only)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for name, template, before, after, change in regressions:
+            sys.stderr.write(f'regression: {name} {template or ""} {before} -> {after} ({change:+.1%})\n')
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+from __future__ import annotations
+import random
+from typing import Iterable, Optional, Union
+from app.schema import Schema, Type, Enum, Set, Presence
+from app.layout import SchemaLayout, schemaLayout, BlockLayout, GroupLayout, parseValue, isCharArray, nullValue
+from app.encoder import Encoder
+from app.capture import CaptureWriter
+
+# valid ranges of primitive types, the SBE null value is kept outside of them
+RANGES = {
+    'char': (0x20, 0x7e),
+    'int8': (-2 ** 7 + 1, 2 ** 7 - 1),
+    'int16': (-2 ** 15 + 1, 2 ** 15 - 1),
+    'int32': (-2 ** 31 + 1, 2 ** 31 - 1),
+    'int64': (-2 ** 63 + 1, 2 ** 63 - 1),
+    'uint8': (0, 2 ** 8 - 2),
+    'uint16': (0, 2 ** 16 - 2),
+    'uint32': (0, 2 ** 32 - 2),
+    'uint64': (0, 2 ** 64 - 2),
+    'float': (-1e6, 1e6),
+    'double': (-1e9, 1e9)
+}
+
+def valueRange(element: Type) -> tuple:
+    # min/max of the schema when given as numbers, symbolic defaults fall back to the primitive range
+    primitive = element.primitiveType
+    low, high = RANGES[primitive.name]
+    if element.minValue is not None and element.minValue != primitive.minValue:
+        low = parseValue(primitive.name, element.minValue)
+    if element.maxValue is not None and element.maxValue != primitive.maxValue:
+        high = parseValue(primitive.name, element.maxValue)
+    if primitive.name == 'char':
+        return (low[0] if isinstance(low, bytes) else low), (high[0] if isinstance(high, bytes) else high)
+    return low, high
+
+class Sample:
+    # one generated message: values of the root block in layout order, group entries and var data
+    __slots__ = ('templateId', 'values', 'groups', 'data')
+
+    def __init__(self, templateId: int, values: tuple, groups: list, data: list) -> None:
+        self.templateId = templateId
+        self.values = values
+        self.groups = groups
+        self.data = data
+
+    def __str__(self) -> str:
+        return f'Sample(templateId={self.templateId}, values={len(self.values)}, groups={[len(entries) for entries in self.groups]})'
+
+class Generator:
+    # randomized valid messages of any schema, reproducible for a given seed
+    def __init__(self, schema: Union[Schema, SchemaLayout], seed: int = 0, maxGroupSize: int = 4, maxDataLength: int = 32, nullRate: float = 0.1) -> None:
+        self.layout = schemaLayout(schema)
+        self.random = random.Random(seed)
+        self.maxGroupSize = maxGroupSize
+        self.maxDataLength = maxDataLength
+        self.nullRate = nullRate
+        self.encoder = Encoder(self.layout)
+        self._buffer = bytearray(1 << 16)
+
+    def __str__(self) -> str:
+        return f'Generator(messages={len(self.layout.messages)}, maxGroupSize={self.maxGroupSize})'
+
+    def leafValues(self, element: Union[Type, Enum, Set]) -> list:
+        # struct arguments of one leaf: one per array element, a single bytes value for char arrays
+        generate = self.random
+        if isinstance(element, Enum):
+            if not element.validValues:
+                return [nullValue(element)]
+            return [parseValue(element.encodingType.name, generate.choice(element.validValues)['value'])]
+        if isinstance(element, Set):
+            value = 0
+            for choice in element.choices:
+                if generate.random() < 0.5:
+                    value |= 1 << choice['value']
+            return [value]
+        if element.presence == Presence.OPTIONAL and generate.random() < self.nullRate:
+            value = nullValue(element)
+            return list(value) if isinstance(value, tuple) else [value]
+        low, high = valueRange(element)
+        name = element.primitiveType.name
+        if isCharArray(element):
+            length = generate.randint(1, element.length)
+            return [bytes(generate.randint(low, high) for _ in range(length))]
+        if name in ('float', 'double'):
+            return [generate.uniform(low, high) for _ in range(element.length)]
+        values = [generate.randint(low, high) for _ in range(element.length)]
+        if element.presence == Presence.OPTIONAL:
+            # the range may still hold a nullValue set by the schema (e.g. Int8NULL 127), present values avoid it
+            null = nullValue(element)
+            null = null[0] if isinstance(null, (tuple, bytes)) else null
+            values = [value if value != null else value + 1 if value < high else value - 1 for value in values]
+        if name == 'char':
+            return [bytes(values)]
+        return values
+
+    def blockValues(self, block: BlockLayout) -> tuple:
+        values = []
+        for leaf in block.leaves:
+            values.extend(self.leafValues(leaf.element))
+        return tuple(values)
+
+    def groupSize(self, group: GroupLayout) -> int:
+        # bounded by maxGroupSize and by min/max of the numInGroup type of the dimension
+        low, high = 0, self.maxGroupSize
+        for element in group.dimension.composite.elements:
+            if element.name == 'numInGroup':
+                minValue, maxValue = valueRange(element)
+                low, high = max(low, minValue), min(high, maxValue)
+        return self.random.randint(low, max(low, high))
+
+    def entries(self, block: BlockLayout) -> tuple:
+        groups = [[self.entries(group) for _ in range(self.groupSize(group))] for group in block.groups]
+        data = [bytes(self.random.getrandbits(8) for _ in range(self.random.randint(0, self.maxDataLength))) for _ in block.data]
+        return self.blockValues(block), groups, data
+
+    def sample(self, templateId: int) -> Sample:
+        values, groups, data = self.entries(self.layout.messages[templateId])
+        return Sample(templateId, values, groups, data)
+
+    def samples(self, count: int, templateIds: Optional[Iterable[int]] = None) -> list:
+        templateIds = list(templateIds or self.layout.messages)
+        return [self.sample(self.random.choice(templateIds)) for _ in range(count)]
+
+    def encode(self, sample: Sample, buffer=None, offset: int = 0) -> int:
+        # encodes into buffer at offset and returns the encoded length
+        message = self.encoder.wrap(sample.templateId, self._buffer if buffer is None else buffer, offset)
+        message.pack(*sample.values)
+        self._encodeTail(message, self.layout.messages[sample.templateId], sample.groups, sample.data)
+        return message.encodedLength
+
+    def _encodeTail(self, encoder, block: BlockLayout, groups: list, data: list) -> None:
+        for group, entries in zip(block.groups, groups):
+            groupEncoder = getattr(encoder, group.name).begin(len(entries))
+            for values, nestedGroups, nestedData in entries:
+                groupEncoder.next().pack(*values)
+                self._encodeTail(groupEncoder, group, nestedGroups, nestedData)
+        for entry, value in zip(block.data, data):
+            getattr(encoder, entry.name).put(value)
+
+    def message(self, templateId: int) -> bytes:
+        length = self.encode(self.sample(templateId))
+        return bytes(self._buffer[:length])
+
+    def corpus(self, path: str, count: int, templateIds: Optional[Iterable[int]] = None, messagesPerPacket: int = 1, packetHeader: bool = True) -> int:
+        # writes a capture of count random messages, returns the number of bytes written
+        templateIds = list(templateIds or self.layout.messages)
+        written = 0
+        with CaptureWriter(path, packetHeader) as writer:
+            sequence = 1
+            for start in range(0, count, messagesPerPacket):
+                messages = [self.message(self.random.choice(templateIds)) for _ in range(min(messagesPerPacket, count - start))]
+                writer.writePacket(messages, sequence, sequence * 1000)
+                written += sum(len(message) for message in messages)
+                sequence += 1
+        return written
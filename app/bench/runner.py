@@ -0,0 +1,204 @@
+from __future__ import annotations
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Optional
+import numpy as np
+from app.schema import Schema
+from app.layout import SchemaLayout
+from app.decoder import Decoder
+from app.dtypes import Dtypes
+from app.capture import CaptureReader
+from app import artifact
+from app.bench.generator import Generator
+from app.bench.synthetic import writeSyntheticSchema
+
+RESULTS_VERSION = 1
+DEFAULT_SCHEMA = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'resources', 'FixBinary.xml')
+
+def measure(function: Callable, number: int = 1, repeat: int = 5) -> float:
+    # best of repeat runs in nanoseconds per call of function(), which itself performs number operations
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        function()
+        elapsed = time.perf_counter_ns() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / number
+
+def result(name: str, value: float, unit: str, template: Optional[str] = None, **extra) -> dict:
+    entry = {'name': name, 'template': template, 'value': round(value, 3), 'unit': unit}
+    entry.update(extra)
+    return entry
+
+def environment() -> dict:
+    commit = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return {
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'numpy': np.__version__,
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    }
+
+class Benchmark:
+    def __init__(self, schemaPath: str = DEFAULT_SCHEMA, count: int = 200, corpusSize: int = 100000, seed: int = 0, repeat: int = 5, syntheticMessages: int = 500, workdir: Optional[str] = None) -> None:
+        self.schemaPath = schemaPath
+        self.count = count
+        self.corpusSize = corpusSize
+        self.seed = seed
+        self.repeat = repeat
+        self.syntheticMessages = syntheticMessages
+        self.workdir = workdir
+        self.results = []
+
+    def run(self, only: Optional[list] = None) -> dict:
+        with tempfile.TemporaryDirectory(dir=self.workdir) as workdir:
+            schema = Schema.loadFromFile(self.schemaPath)
+            layout = SchemaLayout(schema)
+            suites = {
+                'load': lambda: self.loadTime(workdir),
+                'encode': lambda: self.encodeDecode(layout),
+                'groups': lambda: self.groupIteration(layout),
+                'scan': lambda: self.bulkScan(layout, workdir)
+            }
+            for name, suite in suites.items():
+                if only is None or name in only:
+                    suite()
+        return {
+            'version': RESULTS_VERSION,
+            'environment': environment(),
+            'parameters': {'schema': os.path.basename(self.schemaPath), 'count': self.count, 'corpusSize': self.corpusSize, 'seed': self.seed, 'repeat': self.repeat},
+            'results': self.results
+        }
+
+    def loadTime(self, workdir: str) -> None:
+        synthetic = os.path.join(workdir, 'synthetic.xml')
+        writeSyntheticSchema(synthetic, messages=self.syntheticMessages, seed=self.seed)
+        for label, path in ((os.path.basename(self.schemaPath), self.schemaPath), (f'synthetic-{self.syntheticMessages}', synthetic)):
+            self.results.append(result('loadSchema', measure(lambda: Schema.loadFromFile(path), 1, self.repeat) / 1e6, 'ms', label))
+            self.results.append(result('compileLayout', measure(lambda: SchemaLayout(Schema.loadFromFile(path)), 1, self.repeat) / 1e6, 'ms', label))
+            cache = os.path.join(workdir, 'cache')
+            artifact.load(path, cacheDir=cache)
+            self.results.append(result('loadArtifact', measure(lambda: artifact.load(path, cacheDir=cache), 1, self.repeat) / 1e6, 'ms', label))
+
+    def _encoded(self, generator: Generator, templateId: int) -> tuple:
+        samples = [generator.sample(templateId) for _ in range(self.count)]
+        buffer = bytearray(sum(generator.encode(sample) for sample in samples))
+        offsets = []
+        offset = 0
+        for sample in samples:
+            offsets.append(offset)
+            offset += generator.encode(sample, buffer, offset)
+        return samples, memoryview(buffer), offsets
+
+    def encodeDecode(self, layout: SchemaLayout) -> None:
+        generator = Generator(layout, self.seed)
+        decoder = Decoder(layout)
+        for templateId, message in sorted(layout.messages.items()):
+            samples, buffer, offsets = self._encoded(generator, templateId)
+            target = bytearray(len(buffer))
+            encode = generator.encode
+            decode = decoder.decode
+            names = [field.name for field in message.fields]
+
+            def encodeAll():
+                offset = 0
+                for sample in samples:
+                    offset += encode(sample, target, offset)
+
+            def decodeAll():
+                for offset in offsets:
+                    decode(buffer, offset)
+
+            def decodeFields():
+                for offset in offsets:
+                    flyweight = decode(buffer, offset)
+                    for name in names:
+                        getattr(flyweight, name)
+
+            size = len(buffer) / len(offsets)
+            self.results.append(result('encode', measure(encodeAll, len(samples), self.repeat), 'ns/msg', message.name, bytes=size))
+            self.results.append(result('decode', measure(decodeAll, len(offsets), self.repeat), 'ns/msg', message.name, bytes=size))
+            self.results.append(result('decodeFields', measure(decodeFields, len(offsets), self.repeat), 'ns/msg', message.name, bytes=size))
+
+    def groupIteration(self, layout: SchemaLayout) -> None:
+        generator = Generator(layout, self.seed, maxGroupSize=8)
+        decoder = Decoder(layout)
+        for templateId, message in sorted(layout.messages.items()):
+            if not message.groups:
+                continue
+            _, buffer, offsets = self._encoded(generator, templateId)
+            groups = [(group.name, [field.name for field in group.fields]) for group in message.groups]
+            decode = decoder.decode
+            entries = 0
+            for offset in offsets:
+                flyweight = decode(buffer, offset)
+                entries += sum(len(getattr(flyweight, name)) for name, _ in groups)
+            if not entries:
+                continue
+
+            def iterate():
+                for offset in offsets:
+                    flyweight = decode(buffer, offset)
+                    for name, fields in groups:
+                        for entry in getattr(flyweight, name):
+                            for field in fields:
+                                getattr(entry, field)
+
+            self.results.append(result('groupIteration', measure(iterate, entries, self.repeat), 'ns/entry', message.name, entries=entries))
+
+    def bulkScan(self, layout: SchemaLayout, workdir: str) -> None:
+        path = os.path.join(workdir, 'corpus.bin')
+        size = Generator(layout, self.seed).corpus(path, self.corpusSize, messagesPerPacket=4)
+        decoder = Decoder(layout)
+        dtypes = Dtypes(layout)
+        start = time.perf_counter_ns()
+        reader = CaptureReader(path, layout)
+        self.results.append(result('indexCapture', size / (time.perf_counter_ns() - start), 'GB/s', messages=len(reader)))
+
+        buffer = reader.buffer
+        offsets = reader.index['offset'].tolist()
+        skip = decoder.skip
+        templateIds = reader.index['templateId']
+        selections = [(templateId, reader.index['offset'][templateIds == templateId]) for templateId in np.unique(templateIds).tolist()]
+
+        def skipAll():
+            for offset in offsets:
+                skip(buffer, offset)
+
+        def columnar():
+            for templateId, selected in selections:
+                dtypes.decodeMessages(buffer, selected, templateId)
+
+        self.results.append(result('scanSkip', size / measure(skipAll, 1, self.repeat), 'GB/s', messages=len(offsets)))
+        self.results.append(result('scanColumnar', size / measure(columnar, 1, self.repeat), 'GB/s', messages=len(offsets)))
+        reader.close()
+
+def key(entry: dict) -> tuple:
+    return entry['name'], entry['template']
+
+def compare(current: dict, baseline: dict, threshold: float = 0.1) -> list:
+    # (name, template, baseline, current, change) of every result that got worse by more than threshold;
+    # GB/s is better when higher, every other unit when lower
+    previous = {key(entry): entry for entry in baseline['results']}
+    regressions = []
+    for entry in current['results']:
+        before = previous.get(key(entry))
+        if before is None or not before['value']:
+            continue
+        change = entry['value'] / before['value'] - 1
+        worse = -change if entry['unit'] == 'GB/s' else change
+        if worse > threshold:
+            regressions.append((entry['name'], entry['template'], before['value'], entry['value'], change))
+    return regressions
@@ -0,0 +1,81 @@
+from __future__ import annotations
+import random
+
+# scaled up schema to measure load time of large schemas; every message mixes primitive types,
+# enums, sets, composites and repeating groups in the shape of a market data schema
+PRIMITIVES = ['int8', 'int16', 'int32', 'int64', 'uint8', 'uint16', 'uint32', 'uint64', 'float', 'double']
+
+HEADER = '''<?xml version="1.0" encoding="UTF-8"?>
+<sbe:messageSchema xmlns:sbe="http://fixprotocol.io/2016/sbe" package="synthetic" id="{id}" version="{version}" semanticVersion="1.0" byteOrder="littleEndian">
+    <types>
+        <composite name="messageHeader">
+            <type name="blockLength" primitiveType="uint16"/>
+            <type name="templateId" primitiveType="uint16"/>
+            <type name="schemaId" primitiveType="uint16"/>
+            <type name="version" primitiveType="uint16"/>
+        </composite>
+        <composite name="groupSizeEncoding">
+            <type name="blockLength" primitiveType="uint16"/>
+            <type name="numInGroup" primitiveType="uint16"/>
+        </composite>
+        <composite name="varDataEncoding">
+            <type name="length" primitiveType="uint16"/>
+            <type name="varData" primitiveType="uint8" length="0"/>
+        </composite>
+        <composite name="PRICE9">
+            <type name="mantissa" primitiveType="int64"/>
+            <type name="exponent" primitiveType="int8" presence="constant">-9</type>
+        </composite>
+        <type name="Symbol" primitiveType="char" length="20"/>
+'''
+
+def syntheticSchema(messages: int = 500, fields: int = 16, groups: int = 1, types: int = 200, seed: int = 0, id: int = 900, version: int = 1) -> str:
+    generate = random.Random(seed)
+    lines = [HEADER.format(id=id, version=version)]
+    typeNames = []
+    for number in range(types):
+        kind = number % 4
+        name = f'T{number}'
+        if kind == 0:
+            primitive = generate.choice(PRIMITIVES)
+            presence = ' presence="optional"' if generate.random() < 0.3 else ''
+            lines.append(f'        <type name="{name}" primitiveType="{primitive}"{presence}/>')
+        elif kind == 1:
+            lines.append(f'        <enum name="{name}" encodingType="uint8">')
+            for value in range(generate.randint(2, 12)):
+                lines.append(f'            <validValue name="V{value}">{value}</validValue>')
+            lines.append('        </enum>')
+        elif kind == 2:
+            lines.append(f'        <set name="{name}" encodingType="uint16">')
+            for bit in range(generate.randint(2, 16)):
+                lines.append(f'            <choice name="C{bit}">{bit}</choice>')
+            lines.append('        </set>')
+        else:
+            lines.append(f'        <composite name="{name}">')
+            for member in range(generate.randint(2, 4)):
+                lines.append(f'            <type name="m{member}" primitiveType="{generate.choice(PRIMITIVES)}"/>')
+            lines.append('        </composite>')
+        typeNames.append(name)
+    lines.append('    </types>')
+
+    fieldTypes = typeNames + ['PRICE9', 'Symbol']
+    for number in range(messages):
+        lines.append(f'    <sbe:message name="Message{number}" id="{number + 1}">')
+        fieldId = 1
+        for field in range(fields):
+            lines.append(f'        <field name="F{field}" id="{fieldId}" type="{generate.choice(fieldTypes)}"/>')
+            fieldId += 1
+        for group in range(groups):
+            lines.append(f'        <group name="G{group}" id="{fieldId}" dimensionType="groupSizeEncoding">')
+            fieldId += 1
+            for field in range(max(1, fields // 4)):
+                lines.append(f'            <field name="E{field}" id="{fieldId}" type="{generate.choice(fieldTypes)}"/>')
+                fieldId += 1
+            lines.append('        </group>')
+        lines.append('    </sbe:message>')
+    lines.append('</sbe:messageSchema>')
+    return '\n'.join(lines) + '\n'
+
+def writeSyntheticSchema(path: str, **options) -> None:
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(syntheticSchema(**options))
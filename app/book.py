@@ -0,0 +1,298 @@
+from __future__ import annotations
+from typing import Callable, Iterable, Optional, Union
+import numpy as np
+from app.schema import Schema
+from app.layout import SchemaLayout, schemaLayout, nullValue
+from app.lookup import LookupTables
+
+# market by price book of the MDP3 schema: MDIncrementalRefreshBook46 updates levels by MDPriceLevel,
+# SnapshotFullRefresh52 replaces the book of one instrument
+INCREMENTAL = 'MDIncrementalRefreshBook46'
+SNAPSHOT = 'SnapshotFullRefresh52'
+DEFAULT_DEPTH = 10
+BID, OFFER, IMPLIED_BID, IMPLIED_OFFER = range(4)
+SIDE_NAMES = ('Bid', 'Offer', 'ImpliedBid', 'ImpliedOffer')
+
+def leafIndex(block, name: str) -> int:
+    # value index of a field, the mantissa for price composites
+    for leaf in block.leaves:
+        if leaf.path[0] == name:
+            return leaf.index
+    raise Exception(f'field {name} not found (block: "{block.name}")')
+
+class Book:
+    # price levels of one instrument in arrays indexed by [side, level - 1]; prices are raw mantissas
+    __slots__ = ('securityId', 'depth', 'prices', 'sizes', 'orders', 'levels', 'rptSeq', 'transactTime', 'stale')
+
+    def __init__(self, securityId: int, depth: int = DEFAULT_DEPTH) -> None:
+        self.securityId = securityId
+        self.depth = depth
+        self.prices = np.zeros((len(SIDE_NAMES), depth), dtype=np.int64)
+        self.sizes = np.zeros((len(SIDE_NAMES), depth), dtype=np.int32)
+        self.orders = np.zeros((len(SIDE_NAMES), depth), dtype=np.int32)
+        self.levels = [0] * len(SIDE_NAMES)
+        self.rptSeq = 0
+        self.transactTime = 0
+        # set on a RptSeq gap, updates are ignored until a snapshot recovers the book
+        self.stale = False
+
+    def __str__(self) -> str:
+        return f'Book(securityId={self.securityId}, bid={self.best(BID)}, offer={self.best(OFFER)}, rptSeq={self.rptSeq}, stale={self.stale})'
+
+    def clear(self, side: Optional[int] = None) -> None:
+        sides = range(len(SIDE_NAMES)) if side is None else (side,)
+        for side in sides:
+            self.prices[side] = 0
+            self.sizes[side] = 0
+            self.orders[side] = 0
+            self.levels[side] = 0
+
+    def insert(self, side: int, level: int, price: int, size: int, orders: int) -> None:
+        # levels at and below the new one move down, the last one falls off the book
+        if not 0 < level <= self.depth:
+            return
+        index = level - 1
+        for array in (self.prices, self.sizes, self.orders):
+            array[side, index + 1:] = array[side, index:-1]
+        self.prices[side, index] = price
+        self.sizes[side, index] = size
+        self.orders[side, index] = orders
+        self.levels[side] = min(max(self.levels[side], index) + 1, self.depth)
+
+    def change(self, side: int, level: int, price: int, size: int, orders: int) -> None:
+        if not 0 < level <= self.depth:
+            return
+        index = level - 1
+        self.prices[side, index] = price
+        self.sizes[side, index] = size
+        self.orders[side, index] = orders
+        self.levels[side] = max(self.levels[side], level)
+
+    def delete(self, side: int, level: int, count: int = 1) -> None:
+        # removes count levels starting at level, the ones below move up
+        if not 0 < level <= self.depth:
+            return
+        index = level - 1
+        count = min(count, self.depth - index)
+        for array in (self.prices, self.sizes, self.orders):
+            array[side, index:self.depth - count] = array[side, index + count:]
+            array[side, self.depth - count:] = 0
+        self.levels[side] = max(self.levels[side] - min(count, max(self.levels[side] - index, 0)), 0)
+
+    def best(self, side: int) -> Optional[tuple]:
+        # (price, size, orders) of the top level
+        if not self.levels[side]:
+            return None
+        return int(self.prices[side, 0]), int(self.sizes[side, 0]), int(self.orders[side, 0])
+
+    def side(self, side: int) -> tuple:
+        # views of the occupied levels: prices, sizes, orders
+        levels = self.levels[side]
+        return self.prices[side, :levels], self.sizes[side, :levels], self.orders[side, :levels]
+
+class BookBuilder:
+    # applies book messages given at their header offsets; books changed during a match event are
+    # handed to the listeners once when a message flagged EndOfEvent completes it
+    def __init__(self, schema: Union[Schema, SchemaLayout], depth: int = DEFAULT_DEPTH, securityIds: Optional[Iterable[int]] = None) -> None:
+        self.layout = schemaLayout(schema)
+        self.depth = depth
+        self.securityIds = None if securityIds is None else frozenset(securityIds)
+        self.books = {}
+        self.listeners = []
+        self._changed = {}
+        self.events = 0
+        self.entries = 0
+        self.gaps = 0
+        self.duplicates = 0
+
+        header = self.layout.header
+        self._headerStruct = header.struct
+        self._headerLength = header.blockLength
+        self._templateIdIndex = header.index('templateId')
+        self._blockLengthIndex = header.index('blockLength')
+        tables = LookupTables(self.layout)
+
+        incremental = self.layout.messagesByName.get(INCREMENTAL)
+        snapshot = self.layout.messagesByName.get(SNAPSHOT)
+        if incremental is None or snapshot is None:
+            raise Exception(f'schema has no {INCREMENTAL} or {SNAPSHOT} message')
+        self.incrementalId = incremental.id
+        self.snapshotId = snapshot.id
+        self._endOfEvent = tables.sets[incremental.field('MatchEventIndicator').encoding.name].masks['EndOfEvent']
+
+        self._incremental = self._compile(incremental, ('TransactTime', 'MatchEventIndicator'),
+            ('MDEntryPx', 'MDEntrySize', 'SecurityID', 'RptSeq', 'NumberOfOrders', 'MDPriceLevel', 'MDUpdateAction', 'MDEntryType'))
+        self._snapshot = self._compile(snapshot, ('SecurityID', 'RptSeq', 'TransactTime'),
+            ('MDEntryPx', 'MDEntrySize', 'NumberOfOrders', 'MDPriceLevel', 'MDEntryType'))
+
+        entries = incremental.groups[0]
+        actions = tables.enums[entries.field('MDUpdateAction').encoding.name]
+        self._actions = {actions.encode(name): name for name in ('New', 'Change', 'Delete', 'DeleteThru', 'DeleteFrom', 'Overlay')}
+        self._sides = {}
+        self._reset = None
+        for group in (entries, snapshot.groups[0]):
+            types = tables.enums[group.field('MDEntryType').encoding.name]
+            for side, name in enumerate(SIDE_NAMES):
+                if name in types.byName:
+                    self._sides[types.encode(name)] = side
+            if 'BookReset' in types.byName:
+                self._reset = types.encode('BookReset')
+        self._sizeNull = nullValue(entries.leaf(('MDEntrySize',)).element)
+        self._ordersNull = nullValue(entries.leaf(('NumberOfOrders',)).element)
+
+    def __str__(self) -> str:
+        return f'BookBuilder(books={len(self.books)}, events={self.events}, entries={self.entries}, gaps={self.gaps})'
+
+    def _compile(self, message, fields: tuple, entryFields: tuple) -> tuple:
+        # structs and value indexes of the root block and the first group
+        group = message.groups[0]
+        root = tuple(leafIndex(message, name) for name in fields)
+        entry = tuple(leafIndex(group, name) for name in entryFields)
+        dimension = group.dimension
+        return message.struct, root, dimension.struct, dimension.blockLength, group.blockLengthIndex, group.numInGroupIndex, group.struct, entry
+
+    def addListener(self, listener: Callable) -> None:
+        # listener(books) with the list of books changed by a completed event or a snapshot
+        self.listeners.append(listener)
+
+    def book(self, securityId: int) -> Book:
+        book = self.books.get(securityId)
+        if book is None:
+            book = self.books[securityId] = Book(securityId, self.depth)
+        return book
+
+    def attach(self, router) -> None:
+        # registers as batch handler of both templates on an app.router.Router
+        router.register(self.incrementalId, self.applyAll, batch=True)
+        router.register(self.snapshotId, self.applyAll, batch=True)
+
+    def applyAll(self, buffer, offsets: Iterable[int]) -> None:
+        for offset in offsets:
+            self.apply(buffer, offset)
+
+    def apply(self, buffer, offset: int = 0) -> None:
+        # message at header offset, other templates are ignored
+        header = self._headerStruct.unpack_from(buffer, offset)
+        templateId = header[self._templateIdIndex]
+        offset += self._headerLength
+        if templateId == self.incrementalId:
+            self._applyIncremental(buffer, offset, header[self._blockLengthIndex])
+        elif templateId == self.snapshotId:
+            self._applySnapshot(buffer, offset, header[self._blockLengthIndex])
+
+    def _applyIncremental(self, buffer, offset: int, blockLength: int) -> None:
+        rootStruct, root, dimensionStruct, dimensionLength, blockLengthIndex, numInGroupIndex, entryStruct, entry = self._incremental
+        values = rootStruct.unpack_from(buffer, offset)
+        transactTime, matchEventIndicator = values[root[0]], values[root[1]]
+        offset += blockLength
+        dimension = dimensionStruct.unpack_from(buffer, offset)
+        entryLength = dimension[blockLengthIndex]
+        offset += dimensionLength
+        priceIndex, sizeIndex, securityIdIndex, rptSeqIndex, ordersIndex, levelIndex, actionIndex, typeIndex = entry
+        unpack = entryStruct.unpack_from
+        books = self.books
+        securityIds = self.securityIds
+        changed = self._changed
+        sides = self._sides
+        actions = self._actions
+
+        for _ in range(dimension[numInGroupIndex]):
+            values = unpack(buffer, offset)
+            offset += entryLength
+            securityId = values[securityIdIndex]
+            if securityIds is not None and securityId not in securityIds:
+                continue
+            book = books.get(securityId)
+            if book is None:
+                book = self.book(securityId)
+            rptSeq = values[rptSeqIndex]
+            if rptSeq <= book.rptSeq:
+                self.duplicates += 1
+                continue
+            if book.stale:
+                continue
+            if rptSeq != book.rptSeq + 1:
+                # a missed update makes the book unusable until the next snapshot
+                book.stale = True
+                self.gaps += 1
+                changed[securityId] = book
+                continue
+            book.rptSeq = rptSeq
+            book.transactTime = transactTime
+            self.entries += 1
+            changed[securityId] = book
+            entryType = values[typeIndex]
+            if entryType == self._reset:
+                book.clear()
+                continue
+            side = sides.get(entryType)
+            if side is None:
+                continue
+            level = values[levelIndex]
+            action = actions.get(values[actionIndex])
+            if action == 'New':
+                book.insert(side, level, values[priceIndex], self._size(values[sizeIndex]), self._orders(values[ordersIndex]))
+            elif action == 'Change' or action == 'Overlay':
+                book.change(side, level, values[priceIndex], self._size(values[sizeIndex]), self._orders(values[ordersIndex]))
+            elif action == 'Delete':
+                book.delete(side, level)
+            elif action == 'DeleteThru':
+                book.clear(side)
+            elif action == 'DeleteFrom':
+                # levels 1 through MDPriceLevel are removed
+                book.delete(side, 1, level)
+
+        if matchEventIndicator & self._endOfEvent:
+            self.endOfEvent()
+
+    def _applySnapshot(self, buffer, offset: int, blockLength: int) -> None:
+        rootStruct, root, dimensionStruct, dimensionLength, blockLengthIndex, numInGroupIndex, entryStruct, entry = self._snapshot
+        values = rootStruct.unpack_from(buffer, offset)
+        securityId, rptSeq, transactTime = values[root[0]], values[root[1]], values[root[2]]
+        if self.securityIds is not None and securityId not in self.securityIds:
+            return
+        book = self.book(securityId)
+        if not book.stale and rptSeq <= book.rptSeq:
+            # the incremental feed is already ahead of this snapshot
+            return
+        offset += blockLength
+        dimension = dimensionStruct.unpack_from(buffer, offset)
+        entryLength = dimension[blockLengthIndex]
+        offset += dimensionLength
+        priceIndex, sizeIndex, ordersIndex, levelIndex, typeIndex = entry
+        unpack = entryStruct.unpack_from
+
+        book.clear()
+        for _ in range(dimension[numInGroupIndex]):
+            values = unpack(buffer, offset)
+            offset += entryLength
+            side = self._sides.get(values[typeIndex])
+            if side is not None:
+                book.change(side, values[levelIndex], values[priceIndex], self._size(values[sizeIndex]), self._orders(values[ordersIndex]))
+        book.rptSeq = rptSeq
+        book.transactTime = transactTime
+        book.stale = False
+        # only the snapshotted book is published, other books changed by an incremental event that has not
+        # ended yet wait for its EndOfEvent
+        self._changed.pop(securityId, None)
+        self._publish([book])
+
+    def _size(self, value: int) -> int:
+        return 0 if value == self._sizeNull else value
+
+    def _orders(self, value: int) -> int:
+        return 0 if value == self._ordersNull else value
+
+    def endOfEvent(self) -> None:
+        # notifies listeners of the books changed since the last event, also usable for events ended
+        # by messages of other templates
+        if not self._changed:
+            return
+        books = list(self._changed.values())
+        self._changed.clear()
+        self._publish(books)
+
+    def _publish(self, books: list) -> None:
+        self.events += 1
+        for listener in self.listeners:
+            listener(books)
@@ -0,0 +1,241 @@
+from __future__ import annotations
+import mmap
+import os
+import struct
+import zlib
+from typing import Iterator, Optional, Union
+import numpy as np
+from app.schema import Schema
+from app.layout import SchemaLayout, schemaLayout
+
+# capture file: sequence of records, each is uint32 length followed by one packet;
+# packet is an optional MDP3 binary packet header (MsgSeqNum uint32, SendingTime uint64)
+# followed by messages, each prefixed with uint16 size that includes the size field itself
+RECORD_HEADER = struct.Struct('<I')
+PACKET_HEADER = struct.Struct('<IQ')
+MESSAGE_HEADER = struct.Struct('<H')
+
+# the index header identifies the capture it was built from by inode and a checksum of the first and the
+# last indexed bytes, so a capture that was rewritten or replaced is indexed again
+INDEX_MAGIC = b'SBEIDX02'
+INDEX_HEADER = struct.Struct('<8sQQB3xIQ')
+FINGERPRINT_SIZE = 4096
+INDEX_ROW = struct.Struct('<QIH2xQQ')
+INDEX_DTYPE = np.dtype({
+    'names': ['offset', 'length', 'templateId', 'sequence', 'timestamp'],
+    'formats': ['<u8', '<u4', '<u2', '<u8', '<u8'],
+    'offsets': [0, 8, 12, 16, 24],
+    'itemsize': INDEX_ROW.size
+})
+
+class CaptureWriter:
+    def __init__(self, path: str, packetHeader: bool = True, append: bool = False) -> None:
+        self.path = path
+        self.packetHeader = packetHeader
+        self._file = open(path, 'ab' if append else 'wb')
+
+    def __enter__(self) -> CaptureWriter:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def writePacket(self, messages: list, sequence: int = 0, sendingTime: int = 0) -> None:
+        length = sum(len(message) for message in messages) + MESSAGE_HEADER.size * len(messages)
+        if self.packetHeader:
+            length += PACKET_HEADER.size
+        write = self._file.write
+        write(RECORD_HEADER.pack(length))
+        if self.packetHeader:
+            write(PACKET_HEADER.pack(sequence, sendingTime))
+        for message in messages:
+            write(MESSAGE_HEADER.pack(len(message) + MESSAGE_HEADER.size))
+            write(message)
+
+    def close(self) -> None:
+        self._file.close()
+
+class CaptureReader:
+    def __init__(self, path: str, schema: Union[Schema, SchemaLayout], packetHeader: bool = True, indexPath: Optional[str] = None, timeField: str = 'TransactTime') -> None:
+        self.path = path
+        self.packetHeader = packetHeader
+        self.indexPath = indexPath or path + '.idx'
+        self.layout = schemaLayout(schema)
+        header = self.layout.header
+        self._headerStruct = header.struct
+        self._templateIdIndex = header.index('templateId')
+        self._headerLength = header.blockLength
+
+        # root block position of the timestamp used when packets carry no header
+        self._timeFields = {}
+        for templateId, message in self.layout.messages.items():
+            leaf = message.leaf((timeField,))
+            if leaf is not None:
+                self._timeFields[templateId] = struct.Struct(message.format[0] + 'Q'), leaf.offset
+
+        self._file = open(path, 'rb')
+        stat = os.fstat(self._file.fileno())
+        self.size = stat.st_size
+        self._inode = stat.st_ino
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+        self.buffer = memoryview(self._mmap) if self._mmap is not None else memoryview(b'')
+        self.index = self._loadIndex()
+        self._sequenceMap = None
+        self._sequenceOrder = None
+        self._sortedSequences = None
+
+    def __enter__(self) -> CaptureReader:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __str__(self) -> str:
+        return f'CaptureReader(path="{self.path}", size={self.size}, messages={len(self.index)})'
+
+    def close(self) -> None:
+        self.index = None
+        self.buffer.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def _loadIndex(self) -> np.ndarray:
+        indexedSize = 0
+        if os.path.exists(self.indexPath):
+            with open(self.indexPath, 'rb') as file:
+                magic, indexedSize, count, packetHeader, fingerprint, inode = INDEX_HEADER.unpack(file.read(INDEX_HEADER.size))
+            if (magic != INDEX_MAGIC or bool(packetHeader) != self.packetHeader or indexedSize > self.size
+                    or inode != self._inode or fingerprint != self._fingerprint(indexedSize)):
+                indexedSize = 0
+        if indexedSize == 0:
+            with open(self.indexPath, 'wb') as file:
+                file.write(INDEX_HEADER.pack(INDEX_MAGIC, 0, 0, self.packetHeader, self._fingerprint(0), self._inode))
+        if indexedSize < self.size:
+            # index the new tail only, captures are append-only
+            self._scan(indexedSize)
+        count = self._indexCount()
+        if count == 0:
+            return np.empty(0, dtype=INDEX_DTYPE)
+        return np.memmap(self.indexPath, dtype=INDEX_DTYPE, mode='r', offset=INDEX_HEADER.size, shape=(count,))
+
+    def _fingerprint(self, indexedSize: int) -> int:
+        # appends leave the indexed bytes as they are, a rewrite most likely changes its start or end
+        buffer = self.buffer
+        checksum = zlib.crc32(buffer[:min(FINGERPRINT_SIZE, indexedSize)])
+        return zlib.crc32(buffer[max(0, indexedSize - FINGERPRINT_SIZE):indexedSize], checksum)
+
+    def _indexCount(self) -> int:
+        with open(self.indexPath, 'rb') as file:
+            return INDEX_HEADER.unpack(file.read(INDEX_HEADER.size))[2]
+
+    def _scan(self, start: int) -> None:
+        buffer = self.buffer
+        size = self.size
+        packetHeader = self.packetHeader
+        headerStruct = self._headerStruct
+        templateIdIndex = self._templateIdIndex
+        timeFields = self._timeFields
+        pack = INDEX_ROW.pack
+        count = self._indexCount() if start else 0
+        sequence = count
+        rows = []
+
+        with open(self.indexPath, 'r+b') as file:
+            # without packet headers, messages lacking the time field keep the timestamp of the message
+            # before, also across an appended tail, so that the timestamp column stays monotonic
+            timestamp = 0
+            if count and not packetHeader:
+                file.seek(INDEX_HEADER.size + (count - 1) * INDEX_ROW.size)
+                timestamp = INDEX_ROW.unpack(file.read(INDEX_ROW.size))[4]
+            file.seek(INDEX_HEADER.size + count * INDEX_ROW.size)
+            position = start
+            while position + RECORD_HEADER.size <= size:
+                length, = RECORD_HEADER.unpack_from(buffer, position)
+                end = position + RECORD_HEADER.size + length
+                if end > size:
+                    break
+                offset = position + RECORD_HEADER.size
+                if packetHeader:
+                    sequence, timestamp = PACKET_HEADER.unpack_from(buffer, offset)
+                    offset += PACKET_HEADER.size
+                while offset < end:
+                    messageSize, = MESSAGE_HEADER.unpack_from(buffer, offset)
+                    if messageSize <= MESSAGE_HEADER.size:
+                        raise Exception(f'invalid message size {messageSize} at offset {offset} (capture: "{self.path}")')
+                    messageOffset = offset + MESSAGE_HEADER.size
+                    templateId = headerStruct.unpack_from(buffer, messageOffset)[templateIdIndex]
+                    if not packetHeader:
+                        timeField = timeFields.get(templateId)
+                        if timeField is not None:
+                            timestamp, = timeField[0].unpack_from(buffer, messageOffset + self._headerLength + timeField[1])
+                    rows.append(pack(messageOffset, messageSize - MESSAGE_HEADER.size, templateId, sequence, timestamp))
+                    if not packetHeader:
+                        sequence += 1
+                    count += 1
+                    offset += messageSize
+                position = end
+                if len(rows) >= 65536:
+                    file.write(b''.join(rows))
+                    rows.clear()
+            file.write(b''.join(rows))
+            file.seek(0)
+            file.write(INDEX_HEADER.pack(INDEX_MAGIC, position, count, packetHeader, self._fingerprint(position), self._inode))
+
+    def frame(self, position: int) -> memoryview:
+        row = self.index[position]
+        offset = int(row['offset'])
+        return self.buffer[offset:offset + int(row['length'])]
+
+    def frames(self, start: int = 0, stop: Optional[int] = None) -> Iterator[memoryview]:
+        # zero-copy slices of the mapped file, one per message (header and body)
+        buffer = self.buffer
+        index = self.index[start:stop]
+        for offset, length in zip(index['offset'].tolist(), index['length'].tolist()):
+            yield buffer[offset:offset + length]
+
+    def messages(self, decoder, start: int = 0, stop: Optional[int] = None) -> Iterator:
+        # decoder flyweights wrapped in place over the mapped file
+        buffer = self.buffer
+        decode = decoder.decode
+        for offset in self.index['offset'][start:stop].tolist():
+            yield decode(buffer, offset)
+
+    def seekSequence(self, sequence: int) -> int:
+        # position of the first message with the given sequence number, -1 if absent
+        index = self.index
+        if not len(index):
+            return -1
+        if self._sequenceMap is None:
+            self._sequenceMap = self._buildSequenceMap()
+        if self._sequenceMap is not False:
+            slot = sequence - self._firstSequence
+            if 0 <= slot < len(self._sequenceMap):
+                return int(self._sequenceMap[slot])
+            return -1
+        # gaps, interleaved A/B packets or a sequence reset: the column is searched through a stable sort, so
+        # the first match in sort order is the lowest position
+        if self._sequenceOrder is None:
+            self._sequenceOrder = np.argsort(index['sequence'], kind='stable')
+            self._sortedSequences = index['sequence'][self._sequenceOrder]
+        position = int(np.searchsorted(self._sortedSequences, sequence, side='left'))
+        if position < len(index) and int(self._sortedSequences[position]) == sequence:
+            return int(self._sequenceOrder[position])
+        return -1
+
+    def _buildSequenceMap(self):
+        sequences = self.index['sequence'].astype(np.int64)
+        starts = np.flatnonzero(np.diff(sequences, prepend=sequences[0] - 1) != 0)
+        values = sequences[starts]
+        self._firstSequence = int(values[0])
+        if np.all(np.diff(values) == 1):
+            # gapless feed: sequence maps to the packet's first message by direct offset
+            return starts
+        return False
+
+    def seekTime(self, timestamp: int) -> int:
+        # position of the first message at or after timestamp
+        return int(np.searchsorted(self.index['timestamp'], timestamp, side='left'))
@@ -0,0 +1,377 @@
+from __future__ import annotations
+import argparse
+import hashlib
+import importlib.util
+import keyword
+import os
+import sys
+import tempfile
+from types import ModuleType
+from typing import Optional
+from app.schema import Schema, Type, Composite, Enum, Set
+from app.layout import SchemaLayout, BlockLayout, MessageLayout, GroupLayout, DataLayout, CompositeLayout, parseValue, isCharArray, isArray, isConstant
+
+# bump when the generated code changes so cached modules are regenerated
+GENERATOR_VERSION = 1
+
+def identifier(name: str) -> str:
+    return name + '_' if keyword.iskeyword(name) else name
+
+def defaultValue(element) -> str:
+    if isinstance(element, Composite):
+        return f'{identifier(element.name)}()'
+    if isCharArray(element):
+        return "b''"
+    primitive = element.primitiveType.name if isinstance(element, Type) else element.encodingType.name
+    if primitive == 'char':
+        return "b'\\x00'"
+    if isArray(element):
+        return repr((0,) * element.length)
+    if primitive in ('float', 'double'):
+        return '0.0'
+    return '0'
+
+class Writer:
+    def __init__(self) -> None:
+        self.lines = []
+        self.depth = 0
+
+    def line(self, text: str = '') -> None:
+        self.lines.append('    ' * self.depth + text if text else '')
+
+    def indent(self) -> None:
+        self.depth += 1
+
+    def dedent(self) -> None:
+        self.depth -= 1
+
+    def text(self) -> str:
+        return '\n'.join(self.lines) + '\n'
+
+class Generator:
+    def __init__(self, schema: Schema, source: str = '', digest: str = '') -> None:
+        self.schema = schema
+        self.layout = SchemaLayout(schema)
+        self.source = source
+        self.digest = digest
+        self.out = Writer()
+        self._structs = {}
+        self._composites = {}
+
+    def generate(self) -> str:
+        out = self.out
+        body = Writer()
+        self.out = body
+        for entry in self.schema.types.values():
+            if isinstance(entry, Enum):
+                self._enum(entry)
+            elif isinstance(entry, Set):
+                self._set(entry)
+            elif isinstance(entry, Composite):
+                self._collectComposite(entry)
+        for composite in self._composites.values():
+            self._composite(composite)
+        for message in self.layout.messages.values():
+            self._block(message, identifier(message.name))
+        self._dispatch()
+
+        self.out = out
+        out.line(f'# generated by app.codegen from {os.path.basename(self.source)}, do not edit')
+        out.line(f'# source digest: {self.digest}')
+        out.line('import struct')
+        out.line()
+        header = self.layout.header
+        out.line(f'_HEADER = struct.Struct({header.format!r})')
+        for name, format in self._structs.items():
+            out.line(f'{name} = struct.Struct({format!r})')
+        out.line()
+        out.lines.extend(body.lines)
+        return out.text()
+
+    def _struct(self, name: str, format: str) -> str:
+        key = f'_S_{name}'
+        self._structs[key] = format
+        return key
+
+    def _enum(self, enum: Enum) -> None:
+        out = self.out
+        out.line()
+        out.line(f'class {identifier(enum.name)}:')
+        out.indent()
+        out.line('__slots__ = ()')
+        names = {}
+        for entry in enum.validValues:
+            value = parseValue(enum.encodingType.name, entry['value'])
+            names[value] = entry['name']
+            out.line(f'{identifier(entry["name"])} = {value!r}')
+        out.line(f'NAMES = {names!r}')
+        out.dedent()
+
+    def _set(self, choiceSet: Set) -> None:
+        out = self.out
+        out.line()
+        out.line(f'class {identifier(choiceSet.name)}:')
+        out.indent()
+        out.line("__slots__ = ('value',)")
+        for choice in choiceSet.choices:
+            out.line(f'{identifier(choice["name"])} = {1 << choice["value"]}')
+        out.line()
+        out.line('def __init__(self, value=0):')
+        out.line('    self.value = value')
+        out.line()
+        out.line('def __contains__(self, mask):')
+        out.line('    return self.value & mask == mask')
+        out.dedent()
+
+    def _collectComposite(self, composite: Composite) -> None:
+        for element in composite.elements:
+            if isinstance(element, Composite):
+                self._collectComposite(element)
+        self._composites.setdefault(composite.name, composite)
+
+    def _composite(self, composite: Composite) -> None:
+        out = self.out
+        layout = CompositeLayout(self.schema, composite)
+        members = [element for element in composite.elements if not isConstant(element) and not (isinstance(element, Type) and element.length == 0)]
+        name = identifier(composite.name)
+        out.line()
+        out.line(f'class {name}:')
+        out.indent()
+        out.line(f'__slots__ = {tuple(identifier(element.name) for element in members)!r}')
+        out.line(f'encodedLength = {layout.blockLength}')
+        for path, value in layout.constants.items():
+            if len(path) == 1:
+                out.line(f'{identifier(path[0])} = {value!r}')
+        out.line()
+        arguments = ''.join(f', {identifier(element.name)}=None' for element in members)
+        out.line(f'def __init__(self{arguments}):')
+        out.indent()
+        for element in members:
+            member = identifier(element.name)
+            out.line(f'self.{member} = {defaultValue(element)} if {member} is None else {member}')
+        if not members:
+            out.line('pass')
+        out.dedent()
+        if layout.leaves:
+            packer = self._struct(name, layout.format)
+            out.line()
+            out.line('def decode(self, buffer, offset=0):')
+            out.indent()
+            out.line(f'_v = {packer}.unpack_from(buffer, offset)')
+            for element in members:
+                out.line(f'self.{identifier(element.name)} = {self._valueExpr(layout, (element.name,), element)}')
+            out.line(f'return offset + {layout.blockLength}')
+            out.dedent()
+            out.line()
+            out.line('def encode(self, buffer, offset=0):')
+            out.indent()
+            out.line(f'{packer}.pack_into(buffer, offset, {self._packArgs(layout, "self")})')
+            out.line(f'return offset + {layout.blockLength}')
+            out.dedent()
+        out.dedent()
+
+    def _valueExpr(self, block: BlockLayout, path: tuple, element) -> str:
+        # expression building the decoded value of element at path from the unpacked tuple _v
+        if isinstance(element, Composite):
+            arguments = []
+            for child in element.elements:
+                if isConstant(child) or (isinstance(child, Type) and child.length == 0):
+                    continue
+                arguments.append(self._valueExpr(block, path + (child.name,), child))
+            return f'{identifier(element.name)}({", ".join(arguments)})'
+        leaf = block.leaf(path)
+        if leaf.count > 1:
+            return f'_v[{leaf.index}:{leaf.index + leaf.count}]'
+        return f'_v[{leaf.index}]'
+
+    def _packArgs(self, block: BlockLayout, owner: str) -> str:
+        arguments = []
+        for leaf in block.leaves:
+            expression = owner + ''.join(f'.{identifier(name)}' for name in leaf.path)
+            arguments.append(f'*{expression}' if leaf.count > 1 else expression)
+        return ', '.join(arguments)
+
+    def _block(self, block: BlockLayout, name: str) -> None:
+        for group in block.groups:
+            self._block(group, f'{name}_{identifier(group.name)}')
+
+        out = self.out
+        fields = [field for field in block.fields if not field.isConstant]
+        members = [identifier(field.name) for field in fields] + [identifier(group.name) for group in block.groups] + [identifier(data.name) for data in block.data]
+        out.line()
+        out.line(f'class {name}:')
+        out.indent()
+        out.line(f'__slots__ = {tuple(members)!r}')
+        if isinstance(block, MessageLayout):
+            out.line(f'TEMPLATE_ID = {block.id}')
+        out.line(f'BLOCK_LENGTH = {block.blockLength}')
+        for field in block.fields:
+            if field.isConstant:
+                value = field.constValue if field.constValue is not None else block.constants.get((field.name,))
+                out.line(f'{identifier(field.name)} = {value!r}')
+        out.line()
+        out.line('def __init__(self):')
+        out.indent()
+        for field in fields:
+            out.line(f'self.{identifier(field.name)} = {defaultValue(field.encoding)}')
+        for group in block.groups:
+            out.line(f'self.{identifier(group.name)} = []')
+        for data in block.data:
+            out.line(f"self.{identifier(data.name)} = b''")
+        if not members:
+            out.line('pass')
+        out.dedent()
+
+        packer = self._struct(name, block.format)
+        out.line()
+        out.line(f'def decode(self, buffer, offset=0, blockLength={block.blockLength}):')
+        out.indent()
+        if block.leaves:
+            out.line(f'_v = {packer}.unpack_from(buffer, offset)')
+            for field in fields:
+                out.line(f'self.{identifier(field.name)} = {self._valueExpr(block, (field.name,), field.encoding)}')
+        out.line('offset += blockLength')
+        for group in block.groups:
+            self._decodeGroup(group, f'{name}_{identifier(group.name)}')
+        for data in block.data:
+            self._decodeData(data)
+        out.line('return offset')
+        out.dedent()
+
+        out.line()
+        out.line('def encode(self, buffer, offset=0):')
+        out.indent()
+        if block.leaves:
+            out.line(f'{packer}.pack_into(buffer, offset, {self._packArgs(block, "self")})')
+        out.line(f'offset += {block.blockLength}')
+        for group in block.groups:
+            self._encodeGroup(group)
+        for data in block.data:
+            self._encodeData(data)
+        out.line('return offset')
+        out.dedent()
+        out.dedent()
+
+    def _dimension(self, group: GroupLayout) -> tuple:
+        return self._struct(f'{group.dimension.name}', group.dimension.format), group.dimension.blockLength
+
+    def _decodeGroup(self, group: GroupLayout, cls: str) -> None:
+        out = self.out
+        packer, length = self._dimension(group)
+        member = identifier(group.name)
+        out.line(f'_d = {packer}.unpack_from(buffer, offset)')
+        out.line(f'offset += {length}')
+        out.line(f'_entries = self.{member} = []')
+        out.line(f'for _ in range(_d[{group.numInGroupIndex}]):')
+        out.line(f'    _entry = {cls}()')
+        out.line(f'    offset = _entry.decode(buffer, offset, _d[{group.blockLengthIndex}])')
+        out.line(f'    _entries.append(_entry)')
+
+    def _encodeGroup(self, group: GroupLayout) -> None:
+        out = self.out
+        packer, length = self._dimension(group)
+        member = identifier(group.name)
+        values = [None] * group.dimension.valueCount
+        values[group.blockLengthIndex] = str(group.blockLength)
+        values[group.numInGroupIndex] = f'len(self.{member})'
+        out.line(f'{packer}.pack_into(buffer, offset, {", ".join(values)})')
+        out.line(f'offset += {length}')
+        out.line(f'for _entry in self.{member}:')
+        out.line(f'    offset = _entry.encode(buffer, offset)')
+
+    def _decodeData(self, data: DataLayout) -> None:
+        out = self.out
+        packer = self._struct(data.encoding.name, data.header.format)
+        out.line(f'_n = {packer}.unpack_from(buffer, offset)[{data.lengthIndex}]')
+        out.line(f'offset += {data.headerLength}')
+        out.line(f'self.{identifier(data.name)} = bytes(buffer[offset:offset + _n])')
+        out.line('offset += _n')
+
+    def _encodeData(self, data: DataLayout) -> None:
+        out = self.out
+        packer = self._struct(data.encoding.name, data.header.format)
+        member = identifier(data.name)
+        out.line(f'_n = len(self.{member})')
+        out.line(f'{packer}.pack_into(buffer, offset, _n)')
+        out.line(f'offset += {data.headerLength}')
+        out.line(f'buffer[offset:offset + _n] = self.{member}')
+        out.line('offset += _n')
+
+    def _dispatch(self) -> None:
+        out = self.out
+        header = self.layout.header
+        index = {leaf.path[0]: leaf.index for leaf in header.leaves}
+        messages = ', '.join(f'{message.id}: {identifier(message.name)}' for message in self.layout.messages.values())
+        values = {
+            'blockLength': 'message.BLOCK_LENGTH',
+            'templateId': 'message.TEMPLATE_ID',
+            'schemaId': str(self.schema.id),
+            'version': str(self.schema.version)
+        }
+        out.line()
+        out.line(f'MESSAGES = {{{messages}}}')
+        out.line(f'HEADER_LENGTH = {header.blockLength}')
+        out.line()
+        out.line('def decode(buffer, offset=0):')
+        out.indent()
+        out.line('_h = _HEADER.unpack_from(buffer, offset)')
+        out.line(f'message = MESSAGES[_h[{index["templateId"]}]]()')
+        out.line(f'return message, message.decode(buffer, offset + {header.blockLength}, _h[{index["blockLength"]}])')
+        out.dedent()
+        out.line()
+        out.line('def encode(message, buffer, offset=0):')
+        out.indent()
+        arguments = ', '.join(values.get(leaf.path[0], '0') for leaf in header.leaves)
+        out.line(f'_HEADER.pack_into(buffer, offset, {arguments})')
+        out.line(f'return message.encode(buffer, offset + {header.blockLength})')
+        out.dedent()
+
+def sourceDigest(path: str) -> str:
+    digest = hashlib.sha256(f'pysbe-codegen-{GENERATOR_VERSION}'.encode())
+    with open(path, 'rb') as file:
+        digest.update(file.read())
+    return digest.hexdigest()
+
+def generate(path: str) -> str:
+    schema = Schema.loadFromFile(path)
+    return Generator(schema, path, sourceDigest(path)).generate()
+
+def defaultCacheDir() -> str:
+    return os.environ.get('PYSBE_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'pysbe'))
+
+def load(path: str, cacheDir: Optional[str] = None) -> ModuleType:
+    # generated module for the schema at path, regenerated only when the XML changes
+    cacheDir = cacheDir or defaultCacheDir()
+    digest = sourceDigest(path)
+    name = f'sbe_{digest[:24]}'
+    target = os.path.join(cacheDir, name + '.py')
+    if not os.path.exists(target):
+        os.makedirs(cacheDir, exist_ok=True)
+        code = Generator(Schema.loadFromFile(path), path, digest).generate()
+        fd, temporary = tempfile.mkstemp(dir=cacheDir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(code)
+        os.replace(temporary, target)
+    module = sys.modules.get(name)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(name, target)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[name] = module
+    return module
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m app.codegen', description='generate python codec module from SBE schema')
+    parser.add_argument('schema', help='path to SBE XML schema')
+    parser.add_argument('-o', '--output', help='output module path, stdout if omitted')
+    args = parser.parse_args()
+
+    code = generate(args.schema)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(code)
+    else:
+        sys.stdout.write(code)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+from __future__ import annotations
+from typing import Optional, Union
+import numpy as np
+from app.schema import Schema
+from app.layout import SchemaLayout, schemaLayout, BlockLayout, nullValue
+from app.dtypes import Dtypes, scatter
+from app.convert import PARENT_COLUMN
+from app.transport import SOFH, sofhEncodingType
+from app.capture import MESSAGE_HEADER
+
+# framing written ahead of every message: none, the MDP3 uint16 size or the Simple Open Framing Header
+FRAMINGS = ('none', 'size', 'sofh')
+
+class ColumnEncoder:
+    # inverse of the columnar conversion: root columns are named by leaf path (Field or Field.member),
+    # group tables are keyed by group path (Group or Group.Nested, optionally prefixed with the message
+    # name) and carry the parent row in _parent, var data columns hold one bytes value per row;
+    # missing columns are written as null values
+    def __init__(self, schema: Union[Schema, SchemaLayout]) -> None:
+        self.layout = schemaLayout(schema)
+        self.dtypes = Dtypes(self.layout)
+        self.headerLength = self.layout.header.blockLength
+        self._headerDtype = self.dtypes.compositeDtype(self.layout.header.composite)
+        self._encodingType = sofhEncodingType(self.layout.byteOrder)
+        prefix = self.dtypes.prefix
+        self._frameDtypes = {
+            'size': np.dtype(prefix + 'u' + str(MESSAGE_HEADER.size)),
+            'sofh': np.dtype({'names': ['length', 'encodingType'], 'formats': ['>u4', '>u2'], 'offsets': [0, 4], 'itemsize': SOFH.size})
+        }
+
+    def __str__(self) -> str:
+        return f'ColumnEncoder(messages={len(self.layout.messages)}, headerLength={self.headerLength})'
+
+    def encode(self, key: Union[int, str], columns: dict, groups: Optional[dict] = None, framing: str = 'size', count: Optional[int] = None) -> tuple:
+        # returns the buffer of all messages back to back and the offsets of their message headers
+        if framing not in FRAMINGS:
+            raise Exception(f'unknown framing {framing}')
+        message = self.layout.messagesByName.get(key) if isinstance(key, str) else self.layout.messages.get(key)
+        if message is None:
+            raise Exception(f'unknown message {key}')
+        if count is None:
+            lengths = {len(column) for column in columns.values()}
+            if len(lengths) > 1:
+                raise Exception(f'columns of different lengths (message: "{message.name}")')
+            count = lengths.pop() if lengths else 0
+        groups = {name[len(message.name) + 1:] if name.startswith(message.name + '.') else name: table for name, table in (groups or {}).items()}
+
+        frameLength = 0 if framing == 'none' else self._frameDtypes[framing].itemsize
+        sizes = {}
+        messageSizes = self.headerLength + self._sizes(message, count, columns, groups, '', sizes)
+        totals = frameLength + messageSizes
+        ends = np.cumsum(totals)
+        starts = ends - totals
+        buffer = np.zeros(int(ends[-1]) if count else 0, dtype=np.uint8)
+        offsets = starts + frameLength
+
+        if framing == 'size':
+            if count and int(totals.max()) > np.iinfo(self._frameDtypes['size']).max:
+                raise Exception(f'message size {int(totals.max())} exceeds the size field (message: "{message.name}")')
+            scatter(buffer, starts, totals.astype(self._frameDtypes['size']))
+        elif framing == 'sofh':
+            frames = np.zeros(count, dtype=self._frameDtypes['sofh'])
+            frames['length'] = totals
+            frames['encodingType'] = self._encodingType
+            scatter(buffer, starts, frames)
+
+        headers = np.zeros(count, dtype=self._headerDtype)
+        headers['blockLength'] = message.blockLength
+        headers['templateId'] = message.id
+        headers['schemaId'] = self.layout.schema.id
+        headers['version'] = self.layout.schema.version
+        scatter(buffer, offsets, headers)
+        self._write(buffer, message, self.dtypes.messages[message.id], offsets + self.headerLength, columns, groups, message.id, '', sizes)
+        return buffer, offsets
+
+    def _rows(self, block: BlockLayout, dtype: np.dtype, columns: dict, count: int) -> np.ndarray:
+        rows = np.zeros(count, dtype=dtype)
+        for leaf in block.leaves:
+            target = rows
+            for name in leaf.path[:-1]:
+                target = target[name]
+            column = columns.get('.'.join(leaf.path))
+            target[leaf.path[-1]] = nullValue(leaf.element) if column is None else column
+        return rows
+
+    def _table(self, groups: dict, path: str) -> tuple:
+        table = groups.get(path, {})
+        parents = np.asarray(table.get(PARENT_COLUMN, ()), dtype=np.intp)
+        if len(parents) > 1 and np.any(parents[1:] < parents[:-1]):
+            raise Exception(f'rows of group {path} are not ordered by {PARENT_COLUMN}')
+        return table, parents
+
+    def _dataLengths(self, data, columns: dict, count: int) -> np.ndarray:
+        values = columns.get(data.name)
+        if values is None:
+            return np.zeros(count, dtype=np.int64)
+        return np.fromiter((len(value) for value in values), dtype=np.int64, count=count)
+
+    def _sizes(self, block: BlockLayout, count: int, columns: dict, groups: dict, prefix: str, sizes: dict) -> np.ndarray:
+        # encoded length of every row including its groups and var data, bottom up
+        result = np.full(count, block.blockLength, dtype=np.int64)
+        for group in block.groups:
+            path = prefix + group.name
+            table, parents = self._table(groups, path)
+            entrySizes = self._sizes(group, len(parents), table, groups, path + '.', sizes)
+            sizes[path] = entrySizes
+            result += group.dimension.blockLength + np.bincount(parents, weights=entrySizes, minlength=count).astype(np.int64)
+        for data in block.data:
+            result += data.headerLength + self._dataLengths(data, columns, count)
+        return result
+
+    def _write(self, buffer: np.ndarray, block: BlockLayout, dtype: np.dtype, starts: np.ndarray, columns: dict, groups: dict, templateId: int, prefix: str, sizes: dict) -> None:
+        # fixed blocks, dimensions and data headers are scattered per table, only var data bytes go one by one
+        count = len(starts)
+        scatter(buffer, starts, self._rows(block, dtype, columns, count))
+        cursor = starts + block.blockLength
+        for group in block.groups:
+            path = prefix + group.name
+            table, parents = self._table(groups, path)
+            entrySizes = sizes[path]
+            counts = np.bincount(parents, minlength=count)
+            dimensionDtype = self.dtypes.compositeDtype(group.dimension.composite)
+            limit = np.iinfo(dimensionDtype['numInGroup']).max
+            if count and int(counts.max()) > limit:
+                raise Exception(f'{int(counts.max())} entries exceed numInGroup of group {path}')
+            dimensions = np.zeros(count, dtype=dimensionDtype)
+            dimensions['blockLength'] = group.blockLength
+            dimensions['numInGroup'] = counts
+            scatter(buffer, cursor, dimensions)
+            entryStarts = cursor + group.dimension.blockLength
+            # entries of one parent follow each other, each starts after the sizes of its predecessors
+            before = np.cumsum(entrySizes) - entrySizes
+            runStarts = np.cumsum(counts) - counts
+            self._write(buffer, group, self.dtypes.groups[(templateId, path)], entryStarts[parents] + before - before[runStarts[parents]],
+                table, groups, templateId, path + '.', sizes)
+            cursor = entryStarts + np.bincount(parents, weights=entrySizes, minlength=count).astype(np.int64)
+        for data in block.data:
+            lengths = self._dataLengths(data, columns, count)
+            headerDtype = self.dtypes.compositeDtype(data.encoding)
+            headers = np.zeros(count, dtype=headerDtype)
+            headers['length'] = lengths
+            scatter(buffer, cursor, headers)
+            values = columns.get(data.name)
+            if values is not None:
+                for start, length, value in zip((cursor + data.headerLength).tolist(), lengths.tolist(), values):
+                    if length:
+                        buffer[start:start + length] = np.frombuffer(value if isinstance(value, (bytes, bytearray, memoryview)) else value.encode('latin-1'), dtype=np.uint8)
+            cursor = cursor + data.headerLength + lengths
@@ -0,0 +1,228 @@
+from __future__ import annotations
+import argparse
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Union
+import numpy as np
+from app.schema import Schema
+from app.layout import SchemaLayout, schemaLayout, GroupLayout
+from app.dtypes import Dtypes, gather, expand
+from app.capture import CaptureReader
+
+# columnar output: one directory per table with one .npy per leaf column;
+# root tables are named after the message and carry the capture position of each row in _position,
+# group tables are named Message.Group(.Nested) and carry the row of the parent table in _parent
+POSITION_COLUMN = '_position'
+PARENT_COLUMN = '_parent'
+
+def columns(rows: np.ndarray, prefix: str = '') -> dict:
+    # flattens a structured array, composite members become Field.member columns
+    result = {}
+    for name in rows.dtype.names:
+        column = rows[name]
+        if column.dtype.names:
+            result.update(columns(column, prefix + name + '.'))
+        else:
+            result[prefix + name] = np.ascontiguousarray(column)
+    return result
+
+def isFlat(group: GroupLayout) -> bool:
+    return not group.groups and not group.data
+
+def shardRanges(count: int, shards: int) -> list:
+    bounds = np.linspace(0, count, shards + 1).astype(np.int64).tolist()
+    return [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+class ShardDecoder:
+    # decodes a range of capture positions into tables of structured rows
+    def __init__(self, reader: CaptureReader) -> None:
+        self.reader = reader
+        self.layout = reader.layout
+        self.dtypes = Dtypes(self.layout)
+        self.headerLength = self.layout.header.blockLength
+        self._headerDtype = self.dtypes.compositeDtype(self.layout.header.composite)
+        self._dimensions = {}
+
+    def decode(self, start: int, stop: int) -> dict:
+        # {table name: {column name: array}}
+        index = self.reader.index[start:stop]
+        tables = {}
+        templateIds = index['templateId']
+        for templateId in np.unique(templateIds).tolist():
+            message = self.layout.messages.get(templateId)
+            if message is None:
+                continue
+            selected = np.flatnonzero(templateIds == templateId)
+            offsets = index['offset'][selected].astype(np.intp)
+            self._decodeMessages(tables, message, offsets, selected + start)
+        return tables
+
+    def _decodeMessages(self, tables: dict, message, offsets: np.ndarray, positions: np.ndarray) -> None:
+        buffer = self.reader.buffer
+        table = columns(self.dtypes.decodeMessages(buffer, offsets, message.id))
+        table[POSITION_COLUMN] = positions.astype(np.int64)
+        tables[message.name] = table
+        if not message.groups:
+            return
+        blockLengths = gather(buffer, offsets, self._headerDtype)['blockLength'].astype(np.intp)
+        starts = offsets + self.headerLength + blockLengths
+        rows = np.arange(len(offsets), dtype=np.int64)
+        if all(isFlat(group) for group in message.groups):
+            self._decodeFlat(tables, message, starts, rows)
+        else:
+            self._decodeWalk(tables, message, starts.tolist())
+
+    def _dimension(self, group: GroupLayout) -> np.dtype:
+        dtype = self._dimensions.get(group.dimension.name)
+        if dtype is None:
+            dtype = self.dtypes.compositeDtype(group.dimension.composite)
+            self._dimensions[group.dimension.name] = dtype
+        return dtype
+
+    def _decodeFlat(self, tables: dict, message, starts: np.ndarray, parents: np.ndarray) -> None:
+        # every group is a run of fixed entries, so all messages advance through their groups at once
+        buffer = self.reader.buffer
+        for group in message.groups:
+            dimensionDtype = self._dimension(group)
+            dimensions = gather(buffer, starts, dimensionDtype)
+            counts = dimensions['numInGroup'].astype(np.intp)
+            entryLengths = dimensions['blockLength'].astype(np.intp)
+            entryStarts = starts + dimensionDtype.itemsize
+            dtype = self.dtypes.group(message.id, group.name)
+            table = columns(gather(buffer, expand(entryStarts, counts, entryLengths), dtype))
+            table[PARENT_COLUMN] = np.repeat(parents, counts)
+            tables[f'{message.name}.{group.name}'] = table
+            starts = entryStarts + counts * entryLengths
+
+    def _decodeWalk(self, tables: dict, message, starts: list) -> None:
+        # nested groups or var data make entries variable, entry offsets are found by walking dimensions
+        entries = {}
+        buffer = self.reader.buffer
+        for row, start in enumerate(starts):
+            for group in message.groups:
+                start = self._walk(buffer, group, message.name, start, row, entries)
+        for path, (offsets, parents) in entries.items():
+            dtype = self.dtypes.group(message.id, path.split('.', 1)[1])
+            table = columns(gather(buffer, np.asarray(offsets, dtype=np.intp), dtype))
+            table[PARENT_COLUMN] = np.asarray(parents, dtype=np.int64)
+            tables[path] = table
+
+    def _walk(self, buffer, group: GroupLayout, prefix: str, start: int, parent: int, entries: dict) -> int:
+        path = f'{prefix}.{group.name}'
+        offsets, parents = entries.setdefault(path, ([], []))
+        values = group.dimension.struct.unpack_from(buffer, start)
+        blockLength = values[group.blockLengthIndex]
+        position = start + group.dimension.blockLength
+        for _ in range(values[group.numInGroupIndex]):
+            row = len(offsets)
+            offsets.append(position)
+            parents.append(parent)
+            position += blockLength
+            for nested in group.groups:
+                position = self._walk(buffer, nested, path, position, row, entries)
+            for data in group.data:
+                position += data.headerLength + data.header.struct.unpack_from(buffer, position)[data.lengthIndex]
+        return position
+
+_shardDecoder = None
+
+def _initWorker(path: str, layout: SchemaLayout, packetHeader: bool) -> None:
+    # each worker maps the capture itself, pages are shared through the page cache
+    global _shardDecoder
+    _shardDecoder = ShardDecoder(CaptureReader(path, layout, packetHeader))
+
+def _convertShard(start: int, stop: int, directory: str) -> dict:
+    tables = _shardDecoder.decode(start, stop)
+    counts = {}
+    for name, table in tables.items():
+        tableDirectory = os.path.join(directory, name)
+        os.makedirs(tableDirectory, exist_ok=True)
+        for column, values in table.items():
+            np.save(os.path.join(tableDirectory, column + '.npy'), values)
+        counts[name] = len(next(iter(table.values())))
+    return counts
+
+class Converter:
+    def __init__(self, path: str, schema: Union[Schema, SchemaLayout], packetHeader: bool = True) -> None:
+        self.path = path
+        self.layout = schemaLayout(schema)
+        self.packetHeader = packetHeader
+        # builds or extends the frame index once, before workers open the capture
+        with CaptureReader(path, self.layout, packetHeader) as reader:
+            self.count = len(reader)
+
+    def __str__(self) -> str:
+        return f'Converter(path="{self.path}", messages={self.count})'
+
+    def convert(self, output: str, workers: Optional[int] = None, shards: Optional[int] = None) -> dict:
+        # decodes the capture into output/<table>/<column>.npy, returns rows per table
+        workers = workers or os.cpu_count() or 1
+        ranges = shardRanges(self.count, shards or workers * 4)
+        scratch = os.path.join(output, '.shards')
+        directories = [os.path.join(scratch, f'{number:06d}') for number in range(len(ranges))]
+
+        if workers == 1:
+            _initWorker(self.path, self.layout, self.packetHeader)
+            counts = [_convertShard(start, stop, directory) for (start, stop), directory in zip(ranges, directories)]
+        else:
+            with ProcessPoolExecutor(workers, initializer=_initWorker, initargs=(self.path, self.layout, self.packetHeader)) as executor:
+                futures = [executor.submit(_convertShard, start, stop, directory) for (start, stop), directory in zip(ranges, directories)]
+                counts = [future.result() for future in futures]
+
+        totals = self._merge(output, directories, counts)
+        shutil.rmtree(scratch, ignore_errors=True)
+        return totals
+
+    def _merge(self, output: str, directories: list, counts: list) -> dict:
+        # concatenates shard tables, parent keys are shifted by rows of the parent table in earlier shards
+        totals = {}
+        for shardCounts in counts:
+            for name, rows in shardCounts.items():
+                totals[name] = totals.get(name, 0) + rows
+
+        for name, total in totals.items():
+            tableDirectory = os.path.join(output, name)
+            os.makedirs(tableDirectory, exist_ok=True)
+            parentName = name.rsplit('.', 1)[0] if '.' in name else None
+            first = next(directory for directory, shardCounts in zip(directories, counts) if name in shardCounts)
+            for fileName in sorted(os.listdir(os.path.join(first, name))):
+                target = None
+                row = 0
+                parentRow = 0
+                for directory, shardCounts in zip(directories, counts):
+                    rows = shardCounts.get(name, 0)
+                    if rows:
+                        values = np.load(os.path.join(directory, name, fileName), mmap_mode='r')
+                        if target is None:
+                            target = np.lib.format.open_memmap(os.path.join(tableDirectory, fileName), mode='w+', dtype=values.dtype, shape=(total,) + values.shape[1:])
+                        if fileName == PARENT_COLUMN + '.npy':
+                            target[row:row + rows] = values + parentRow
+                        else:
+                            target[row:row + rows] = values
+                        row += rows
+                    if parentName is not None:
+                        parentRow += shardCounts.get(parentName, 0)
+                if target is None:
+                    # table present in shards but without rows, e.g. groups that are always empty
+                    shutil.copyfile(os.path.join(first, name, fileName), os.path.join(tableDirectory, fileName))
+                    continue
+                target.flush()
+                del target
+        return totals
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m app.convert', description='decode SBE capture into columnar .npy tables')
+    parser.add_argument('schema', help='path to SBE XML schema')
+    parser.add_argument('capture', help='path to capture file')
+    parser.add_argument('-o', '--output', required=True, help='output directory')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes, all cores if omitted')
+    parser.add_argument('--no-packet-header', action='store_true', help='capture records carry no MDP3 packet header')
+    args = parser.parse_args()
+
+    converter = Converter(args.capture, Schema.loadFromFile(args.schema), not args.no_packet_header)
+    for name, rows in sorted(converter.convert(args.output, args.workers).items()):
+        print(f'{name}: {rows}')
+
+if __name__ == '__main__':
+    main()
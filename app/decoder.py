@@ -0,0 +1,538 @@
+from __future__ import annotations
+import struct
+from typing import Callable, Optional, Union
+from app.schema import Schema, Composite, Type
+from app.layout import SchemaLayout, schemaLayout, BlockLayout, MessageLayout, GroupLayout, DataLayout, isArray, isCharArray, formatCode
+from app.lookup import LookupTables
+from app.text import TextCache, decodeText
+
+def valueGetter(index: int):
+    def get(self):
+        return self._values[index]
+    return get
+
+def arrayGetter(index: int, count: int):
+    end = index + count
+    def get(self):
+        return self._values[index:end]
+    return get
+
+def parentValueGetter(index: int):
+    def get(self):
+        return self._parent._values[index]
+    return get
+
+def parentArrayGetter(index: int, count: int):
+    end = index + count
+    def get(self):
+        return self._parent._values[index:end]
+    return get
+
+def lookupGetter(index: int, decode):
+    def get(self):
+        return decode(self._values[index])
+    return get
+
+def parentLookupGetter(index: int, decode):
+    def get(self):
+        return decode(self._parent._values[index])
+    return get
+
+def charsGetter(offset: int, length: int, convert: Optional[Callable]):
+    # char arrays are sliced from the buffer instead of being unpacked
+    def get(self):
+        buffer = self._buffer
+        if type(buffer) is not memoryview:
+            buffer = memoryview(buffer)
+        start = self._offset + offset
+        if convert is None:
+            return buffer[start:start + length]
+        return convert(buffer[start:start + length])
+    return get
+
+def parentCharsGetter(offset: int, length: int, convert: Optional[Callable]):
+    def get(self):
+        parent = self._parent
+        buffer = parent._buffer
+        if type(buffer) is not memoryview:
+            buffer = memoryview(buffer)
+        start = parent._offset + offset
+        if convert is None:
+            return buffer[start:start + length]
+        return convert(buffer[start:start + length])
+    return get
+
+def decoderFormat(block: BlockLayout) -> tuple:
+    # format of the block with char arrays skipped and value index of every other leaf by path
+    result = [block.format[0]]
+    indexes = {}
+    cursor = 0
+    index = 0
+    for leaf in block.leaves:
+        if leaf.offset > cursor:
+            result.append(f'{leaf.offset - cursor}x')
+        if isCharArray(leaf.element):
+            result.append(f'{leaf.element.length}x')
+        else:
+            result.append(formatCode(leaf.element))
+            indexes[leaf.path] = index
+            index += leaf.count
+        cursor = leaf.offset + leaf.element.encodedLength
+    return ''.join(result), indexes
+
+def isTextData(data: DataLayout) -> bool:
+    return any(isinstance(element, Type) and element.length == 0 and element.primitiveType.name == 'char' for element in data.encoding.elements)
+
+def groupGetter(position: int):
+    def get(self):
+        return self._element(position)
+    return get
+
+def dataGetter(position: int):
+    def get(self):
+        return self._element(position).value
+    return get
+
+def compileSkip(group: GroupLayout):
+    # end offset of a whole group computed from dimensions and lengths only
+    dimension = group.dimension.struct
+    dimensionLength = group.dimension.blockLength
+    blockLengthIndex = group.blockLengthIndex
+    numInGroupIndex = group.numInGroupIndex
+    nested = tuple(compileSkip(entry) for entry in group.groups if not entry.absent)
+    data = tuple((entry.header.struct, entry.headerLength, entry.lengthIndex) for entry in group.data if not entry.absent)
+
+    if not nested and not data:
+        def skip(buffer, offset: int) -> int:
+            values = dimension.unpack_from(buffer, offset)
+            return offset + dimensionLength + values[blockLengthIndex] * values[numInGroupIndex]
+        return skip
+
+    def skip(buffer, offset: int) -> int:
+        values = dimension.unpack_from(buffer, offset)
+        blockLength = values[blockLengthIndex]
+        offset += dimensionLength
+        for _ in range(values[numInGroupIndex]):
+            offset += blockLength
+            for skipGroup in nested:
+                offset = skipGroup(buffer, offset)
+            for header, headerLength, lengthIndex in data:
+                offset += headerLength + header.unpack_from(buffer, offset)[lengthIndex]
+        return offset
+    return skip
+
+def compileTail(block: BlockLayout):
+    # skips the groups and var data that follow a block
+    groups = tuple(compileSkip(group) for group in block.groups if not group.absent)
+    data = tuple((entry.header.struct, entry.headerLength, entry.lengthIndex) for entry in block.data if not entry.absent)
+
+    def skip(buffer, offset: int) -> int:
+        for skipGroup in groups:
+            offset = skipGroup(buffer, offset)
+        for header, headerLength, lengthIndex in data:
+            offset += headerLength + header.unpack_from(buffer, offset)[lengthIndex]
+        return offset
+    return skip
+
+class Flyweight:
+    # reusable view over one fixed-length block; all values are read by a single unpack_from
+    __slots__ = ('_buffer', '_offset', '_values', '_blockLength', '_chain')
+    _struct = None
+    _children = ()
+    _chainClasses = ()
+    blockLength = 0
+    actingVersion = None
+
+    def __init__(self) -> None:
+        self._buffer = None
+        self._offset = 0
+        self._values = ()
+        self._blockLength = self.blockLength
+        self._chain = tuple(cls() for cls in self._chainClasses)
+        for name, cls in self._children:
+            setattr(self, name, cls(self))
+
+    def wrap(self, buffer, offset: int = 0, blockLength: Optional[int] = None) -> Flyweight:
+        self._buffer = buffer
+        self._offset = offset
+        self._values = self._struct.unpack_from(buffer, offset)
+        self._blockLength = self.blockLength if blockLength is None else blockLength
+        for element in self._chain:
+            element._start = -1
+        return self
+
+    def _element(self, position: int):
+        # groups and var data follow each other, so their starts are resolved in order and cached until rewrap
+        element = self._chain[position]
+        if element._start < 0:
+            if position == 0:
+                start = self._offset + self._blockLength
+            else:
+                start = self._element(position - 1).end
+            element.reset(self._buffer, start)
+        return element
+
+    @property
+    def end(self) -> int:
+        if self._chain:
+            return self._element(len(self._chain) - 1).end
+        return self._offset + self._blockLength
+
+    @property
+    def buffer(self):
+        return self._buffer
+
+    @property
+    def offset(self) -> int:
+        return self._offset
+
+    def __str__(self) -> str:
+        return f'{type(self).__name__}(offset={self._offset}, blockLength={self.blockLength})'
+
+class GroupCursor:
+    # lazy iterator over group entries, the shared entry flyweight is rewrapped in place
+    __slots__ = ('_buffer', '_start', '_count', '_entryLength', '_index', '_next', '_entry')
+    _dimension = None
+    _dimensionLength = 0
+    _blockLengthIndex = 0
+    _numInGroupIndex = 0
+    _entryClass = None
+    _skip = None
+    _flat = True
+
+    def __init__(self) -> None:
+        self._buffer = None
+        self._start = -1
+        self._count = 0
+        self._entryLength = 0
+        self._index = 0
+        self._next = 0
+        self._entry = self._entryClass()
+
+    def reset(self, buffer, start: int) -> None:
+        values = self._dimension.unpack_from(buffer, start)
+        self._buffer = buffer
+        self._start = start
+        self._entryLength = values[self._blockLengthIndex]
+        self._count = values[self._numInGroupIndex]
+        self._index = 0
+        self._next = start + self._dimensionLength
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> GroupCursor:
+        self._index = 0
+        self._next = self._start + self._dimensionLength
+        return self
+
+    def __next__(self) -> Flyweight:
+        if self._index >= self._count:
+            raise StopIteration
+        entry = self._entry.wrap(self._buffer, self._next, self._entryLength)
+        self._index += 1
+        self._next = self._next + self._entryLength if self._flat else entry.end
+        return entry
+
+    def __getitem__(self, index: int) -> Flyweight:
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(f'group entry {index} out of range (group: "{type(self).__name__}")')
+        if self._flat:
+            return self._entry.wrap(self._buffer, self._start + self._dimensionLength + index * self._entryLength, self._entryLength)
+        offset = self._start + self._dimensionLength
+        for _ in range(index):
+            offset = self._entry.wrap(self._buffer, offset, self._entryLength).end
+        return self._entry.wrap(self._buffer, offset, self._entryLength)
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def end(self) -> int:
+        if self._flat:
+            return self._start + self._dimensionLength + self._count * self._entryLength
+        return self._skip(self._buffer, self._start)
+
+    def __str__(self) -> str:
+        return f'{type(self).__name__}(count={self._count}, blockLength={self._entryLength})'
+
+class AbsentGroup(GroupCursor):
+    # group newer than the sender: not on the wire, always empty
+    __slots__ = ()
+
+    def reset(self, buffer, start: int) -> None:
+        self._buffer = buffer
+        self._start = start
+        self._count = 0
+        self._index = 0
+        self._next = start
+
+    @property
+    def end(self) -> int:
+        return self._start
+
+class DataView:
+    __slots__ = ('_buffer', '_start', '_length')
+    _header = None
+    _headerLength = 0
+    _lengthIndex = 0
+    _convert = None
+
+    def __init__(self) -> None:
+        self._buffer = None
+        self._start = -1
+        self._length = 0
+
+    def reset(self, buffer, start: int) -> None:
+        self._buffer = buffer
+        self._start = start
+        self._length = self._header.unpack_from(buffer, start)[self._lengthIndex]
+
+    def __len__(self) -> int:
+        return self._length
+
+    @property
+    def value(self):
+        # memoryview slice of the wrapped buffer, or str when the decoder converts text
+        buffer = self._buffer
+        if type(buffer) is not memoryview:
+            buffer = memoryview(buffer)
+        start = self._start + self._headerLength
+        if self._convert is None:
+            return buffer[start:start + self._length]
+        return self._convert(buffer[start:start + self._length])
+
+    @property
+    def end(self) -> int:
+        return self._start + self._headerLength + self._length
+
+class AbsentData(DataView):
+    # var data newer than the sender: not on the wire, reads as empty
+    __slots__ = ()
+
+    def reset(self, buffer, start: int) -> None:
+        self._buffer = buffer
+        self._start = start
+        self._length = 0
+
+    @property
+    def value(self):
+        if self._convert is not None:
+            return ''
+        return memoryview(b'')
+
+    @property
+    def end(self) -> int:
+        return self._start
+
+class CompositeView:
+    # composite nested in a block; reads values of the owning flyweight
+    __slots__ = ('_parent',)
+    _children = ()
+
+    def __init__(self, parent: Flyweight) -> None:
+        self._parent = parent
+        for name, cls in self._children:
+            setattr(self, name, cls(parent))
+
+    def __str__(self) -> str:
+        return f'{type(self).__name__}()'
+
+class Compiler:
+    def __init__(self, layout: SchemaLayout, tables: Optional[LookupTables] = None, convert: Optional[Callable] = None) -> None:
+        self.layout = layout
+        self.tables = tables
+        self.convert = convert
+        self._compositeClasses = {}
+        self._formats = {}
+
+    def _format(self, block: BlockLayout) -> tuple:
+        entry = self._formats.get(block)
+        if entry is None:
+            format, indexes = decoderFormat(block)
+            entry = self._formats[block] = (struct.Struct(format), indexes)
+        return entry
+
+    def compileBlock(self, block: BlockLayout, base: type = Flyweight) -> type:
+        namespace = {
+            '_struct': self._format(block)[0],
+            'blockLength': block.blockLength,
+            'actingVersion': block.actingVersion
+        }
+        children = self._populate(namespace, block, (), None, False)
+        chain = []
+        for group in getattr(block, 'groups', ()):
+            namespace[group.name] = property(groupGetter(len(chain)))
+            chain.append(self.compileGroup(group))
+        for data in getattr(block, 'data', ()):
+            namespace[data.name] = property(dataGetter(len(chain)))
+            chain.append(self.compileData(data))
+        namespace['__slots__'] = tuple(name for name, _ in children)
+        namespace['_children'] = tuple(children)
+        namespace['_chainClasses'] = tuple(chain)
+        return type(block.name, (base,), namespace)
+
+    def compileGroup(self, group: GroupLayout) -> type:
+        entryClass = self.compileBlock(group)
+        if group.absent:
+            return type(group.name, (AbsentGroup,), {'__slots__': (), '_entryClass': entryClass})
+        namespace = {
+            '__slots__': (),
+            '_dimension': group.dimension.struct,
+            '_dimensionLength': group.dimension.blockLength,
+            '_blockLengthIndex': group.blockLengthIndex,
+            '_numInGroupIndex': group.numInGroupIndex,
+            '_entryClass': entryClass,
+            '_skip': staticmethod(compileSkip(group)),
+            '_flat': not group.groups and not group.data
+        }
+        return type(group.name, (GroupCursor,), namespace)
+
+    def compileData(self, data: DataLayout) -> type:
+        convert = staticmethod(self.convert) if self.convert is not None and isTextData(data) else None
+        if data.absent:
+            return type(data.name, (AbsentData,), {'__slots__': (), '_convert': convert})
+        namespace = {
+            '__slots__': (),
+            '_header': data.header.struct,
+            '_headerLength': data.headerLength,
+            '_lengthIndex': data.lengthIndex,
+            '_convert': convert
+        }
+        return type(data.name, (DataView,), namespace)
+
+    def compileMessage(self, message: MessageLayout) -> type:
+        cls = self.compileBlock(message)
+        cls.templateId = message.id
+        cls.sinceVersion = message.sinceVersion
+        cls.semanticType = message.semanticType
+        return cls
+
+    def _populate(self, namespace: dict, block: BlockLayout, prefix: tuple, composite: Optional[Composite], nested: bool) -> list:
+        children = []
+        elements = composite.elements if composite else [field.encoding for field in block.fields]
+        names = [element.name for element in composite.elements] if composite else [field.name for field in block.fields]
+        for name, element in zip(names, elements):
+            path = prefix + (name,)
+            if path in block.constants:
+                namespace[name] = block.constants[path]
+            elif isinstance(element, Composite):
+                children.append((name, self._compileComposite(block, path, element)))
+            else:
+                leaf = block.leaf(path)
+                index = self._format(block)[1].get(path)
+                table = self.tables.table(element) if self.tables is not None else None
+                if isCharArray(element):
+                    getter = (parentCharsGetter if nested else charsGetter)(leaf.offset, element.length, self.convert)
+                elif isArray(element):
+                    getter = (parentArrayGetter if nested else arrayGetter)(index, leaf.count)
+                elif table is not None:
+                    getter = (parentLookupGetter if nested else lookupGetter)(index, table.decode)
+                else:
+                    getter = (parentValueGetter if nested else valueGetter)(index)
+                namespace[name] = property(getter)
+        return children
+
+    def _compileComposite(self, block: BlockLayout, path: tuple, composite: Composite) -> type:
+        key = (block, path)
+        cls = self._compositeClasses.get(key)
+        if cls is None:
+            namespace = {}
+            children = self._populate(namespace, block, path, composite, True)
+            namespace['__slots__'] = tuple(name for name, _ in children)
+            namespace['_children'] = tuple(children)
+            cls = type(composite.name, (CompositeView,), namespace)
+            self._compositeClasses[key] = cls
+        return cls
+
+class Decoder:
+    def __init__(self, schema: Union[Schema, SchemaLayout], enums: bool = False, text: Union[bool, TextCache, None] = None) -> None:
+        # enum and set fields read raw by default, with enums they decode to members through lookup tables;
+        # char arrays and char var data read as memoryview slices, with text they decode to null-trimmed str
+        # (shared through the cache when a TextCache is given)
+        self.layout = schemaLayout(schema)
+        self.tables = LookupTables(self.layout) if enums else None
+        self.text = text
+        convert = text if isinstance(text, TextCache) else decodeText if text else None
+        compiler = Compiler(self.layout, self.tables, convert)
+
+        self.header = compiler.compileBlock(self.layout.header)()
+        self.headerLength = self.layout.header.blockLength
+        self._headerStruct = self.layout.header.struct
+        self._templateIdIndex = self.layout.header.index('templateId')
+        self._blockLengthIndex = self.layout.header.index('blockLength')
+        self._versionIndex = self.layout.header.index('version')
+        self.version = self.layout.schema.version
+        self._compiler = compiler
+
+        self.messages = {}
+        self._flyweights = {}
+        self._tails = {}
+        for templateId, message in self.layout.messages.items():
+            cls = compiler.compileMessage(message)
+            self.messages[templateId] = cls
+            self._flyweights[templateId] = cls()
+            self._tails[templateId] = compileTail(message)
+
+        # flyweights and tails of messages encoded by older senders, keyed by (templateId, actingVersion)
+        self._versionedFlyweights = {}
+        self._versionedTails = {}
+
+    def __str__(self) -> str:
+        return f'Decoder(messages={len(self.messages)}, headerLength={self.headerLength})'
+
+    def templateId(self, buffer, offset: int = 0) -> int:
+        return self._headerStruct.unpack_from(buffer, offset)[self._templateIdIndex]
+
+    def _compileVersion(self, key: tuple) -> None:
+        templateId, actingVersion = key
+        if templateId not in self.messages:
+            raise Exception(f'unknown templateId {templateId}')
+        message = self.layout.versioned(templateId, actingVersion)
+        self._versionedFlyweights[key] = self._compiler.compileMessage(message)()
+        self._versionedTails[key] = compileTail(message)
+
+    def flyweight(self, templateId: int, actingVersion: Optional[int] = None) -> Flyweight:
+        # flyweight for messages encoded with the given schema version, compiled on first use
+        if actingVersion is None or actingVersion >= self.version:
+            flyweight = self._flyweights.get(templateId)
+            if flyweight is None:
+                raise Exception(f'unknown templateId {templateId}')
+            return flyweight
+        key = (templateId, actingVersion)
+        if key not in self._versionedFlyweights:
+            self._compileVersion(key)
+        return self._versionedFlyweights[key]
+
+    def decode(self, buffer, offset: int = 0) -> Flyweight:
+        # returned flyweight is shared per (template, version) and rewrapped by the next decode call;
+        # blockLength of the header is honored so trailing fields of newer senders are skipped
+        header = self._headerStruct.unpack_from(buffer, offset)
+        version = header[self._versionIndex]
+        if version >= self.version:
+            flyweight = self._flyweights.get(header[self._templateIdIndex])
+        else:
+            flyweight = self._versionedFlyweights.get((header[self._templateIdIndex], version))
+            if flyweight is None:
+                flyweight = self.flyweight(header[self._templateIdIndex], version)
+        if flyweight is None:
+            raise Exception(f'unknown templateId {header[self._templateIdIndex]}')
+        return flyweight.wrap(buffer, offset + self.headerLength, header[self._blockLengthIndex])
+
+    def skip(self, buffer, offset: int = 0) -> int:
+        # end offset of the message at offset without decoding any block
+        header = self._headerStruct.unpack_from(buffer, offset)
+        version = header[self._versionIndex]
+        if version >= self.version:
+            tail = self._tails.get(header[self._templateIdIndex])
+        else:
+            key = (header[self._templateIdIndex], version)
+            if key not in self._versionedTails:
+                self._compileVersion(key)
+            tail = self._versionedTails[key]
+        if tail is None:
+            raise Exception(f'unknown templateId {header[self._templateIdIndex]}')
+        return tail(buffer, offset + self.headerLength + header[self._blockLengthIndex])
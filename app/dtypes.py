@@ -0,0 +1,141 @@
+from __future__ import annotations
+from typing import Union
+import numpy as np
+from app.schema import Schema, Type, Composite, Enum, Set
+from app.layout import SchemaLayout, schemaLayout, BlockLayout, byteOrderPrefix, primitiveOf, isCharArray, isArray, isConstant
+
+NUMPY_CODES = {
+    'char': 'S1',
+    'int8': 'i1',
+    'int16': 'i2',
+    'int32': 'i4',
+    'int64': 'i8',
+    'uint8': 'u1',
+    'uint16': 'u2',
+    'uint32': 'u4',
+    'uint64': 'u8',
+    'float': 'f4',
+    'double': 'f8'
+}
+
+def isFixedLayout(composite: Composite) -> bool:
+    for element in composite.elements:
+        if isinstance(element, Composite):
+            if not isFixedLayout(element):
+                return False
+        elif isinstance(element, Type) and element.length == 0:
+            return False
+    return True
+
+class Dtypes:
+    def __init__(self, schema: Union[Schema, SchemaLayout]) -> None:
+        self.layout = schemaLayout(schema)
+        self.prefix = byteOrderPrefix(self.layout.byteOrder)
+        self.headerLength = self.layout.header.blockLength
+
+        self.composites = {}
+        for name, entry in self.layout.schema.types.items():
+            if isinstance(entry, Composite) and isFixedLayout(entry):
+                self.composites[name] = self.compositeDtype(entry)
+
+        self.messages = {}
+        self.groups = {}
+        for templateId, message in self.layout.messages.items():
+            self.messages[templateId] = self.blockDtype(message)
+            self._addGroups(templateId, message, '')
+
+    def __str__(self) -> str:
+        return f'Dtypes(composites={len(self.composites)}, messages={len(self.messages)}, groups={len(self.groups)})'
+
+    def _addGroups(self, templateId: int, block: BlockLayout, prefix: str) -> None:
+        for group in block.groups:
+            path = prefix + group.name
+            self.groups[(templateId, path)] = self.blockDtype(group)
+            self._addGroups(templateId, group, path + '.')
+
+    def elementDtype(self, element: Union[Type, Composite, Enum, Set]):
+        if isinstance(element, Composite):
+            return self.compositeDtype(element)
+        primitive = primitiveOf(element)
+        if isCharArray(element):
+            return f'S{element.length}'
+        if primitive == 'char':
+            return 'S1'
+        code = self.prefix + NUMPY_CODES[primitive]
+        if isArray(element):
+            return (code, element.length)
+        return code
+
+    def compositeDtype(self, composite: Composite) -> np.dtype:
+        names, formats, offsets = [], [], []
+        cursor = 0
+        for element in composite.elements:
+            if element.offset is not None:
+                cursor = element.offset
+            if not isConstant(element) and element.encodedLength > 0:
+                names.append(element.name)
+                formats.append(self.elementDtype(element))
+                offsets.append(cursor)
+            cursor += element.encodedLength
+        return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': composite.encodedLength})
+
+    def blockDtype(self, block: BlockLayout) -> np.dtype:
+        names, formats, offsets = [], [], []
+        for field in block.fields:
+            if field.isConstant or field.encodedLength == 0:
+                continue
+            names.append(field.name)
+            formats.append(self.elementDtype(field.encoding))
+            offsets.append(field.offset)
+        return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': block.blockLength})
+
+    def message(self, key: Union[int, str]) -> np.dtype:
+        if isinstance(key, str):
+            key = self.layout.messagesByName[key].id
+        return self.messages[key]
+
+    def group(self, key: Union[int, str], path: str) -> np.dtype:
+        if isinstance(key, str):
+            key = self.layout.messagesByName[key].id
+        return self.groups[(key, path)]
+
+    def decodeMessages(self, buffer, offsets, key: Union[int, str]) -> np.ndarray:
+        # offsets point at the messageHeader of each message of the given template
+        return gather(buffer, np.asarray(offsets, dtype=np.intp) + self.headerLength, self.message(key))
+
+    def decodeGroups(self, buffer, starts, counts, key: Union[int, str], path: str) -> np.ndarray:
+        # starts point at the first entry of each group, right after its dimension
+        dtype = self.group(key, path)
+        return gather(buffer, expand(starts, counts, dtype.itemsize), dtype)
+
+def view(buffer, offset: int, count: int, dtype: np.dtype, stride: int = 0) -> np.ndarray:
+    # zero-copy view over count equally spaced records, e.g. the entries of one group
+    return np.ndarray(shape=(count,), dtype=dtype, buffer=buffer, offset=offset, strides=(stride or dtype.itemsize,))
+
+def gather(buffer, offsets, dtype: np.dtype) -> np.ndarray:
+    # every byte position is exposed as a record so one fancy index copies all requested rows
+    size = len(buffer) - dtype.itemsize + 1
+    if size <= 0:
+        return np.empty(0, dtype=dtype)
+    records = np.ndarray(shape=(size,), dtype=dtype, buffer=buffer, strides=(1,))
+    return records[np.asarray(offsets, dtype=np.intp)]
+
+def scatter(buffer, offsets, rows: np.ndarray) -> None:
+    # inverse of gather: writes each record at its byte offset of a writable buffer
+    size = len(buffer) - rows.dtype.itemsize + 1
+    if size <= 0 or not len(rows):
+        return
+    records = np.ndarray(shape=(size,), dtype=rows.dtype, buffer=buffer, strides=(1,))
+    records[np.asarray(offsets, dtype=np.intp)] = rows
+
+def expand(starts, counts, stride) -> np.ndarray:
+    # offsets of every entry of runs starting at starts with counts entries each;
+    # stride is either shared or given per run (e.g. blockLength of each group dimension)
+    starts = np.asarray(starts, dtype=np.intp)
+    counts = np.asarray(counts, dtype=np.intp)
+    total = int(counts.sum())
+    runStarts = np.repeat(starts, counts)
+    positions = np.arange(total, dtype=np.intp) - np.repeat(np.cumsum(counts) - counts, counts)
+    if np.ndim(stride):
+        stride = np.repeat(np.asarray(stride, dtype=np.intp), counts)
+    return runStarts + positions * stride
@@ -0,0 +1,247 @@
+from __future__ import annotations
+import enum
+import json
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional, Union
+from app.schema import Schema, Enum, Set, Presence
+from app.layout import SchemaLayout, schemaLayout, BlockLayout, nullValue, isCharArray, primitiveOf
+from app.lookup import LookupTables
+from app.text import decodeText
+from app.decoder import isTextData
+from app.projection import Projection
+from app.capture import CaptureReader, RECORD_HEADER, PACKET_HEADER
+from app.transport import packetOffsets
+
+FORMATS = ('json', 'text')
+DEFAULT_CHUNK_SIZE = 8192
+DEFAULT_READ_SIZE = 1 << 20
+
+def jsonDefault(value):
+    # raw bytes left after rendering: unknown char enum values and binary var data
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    return str(value)
+
+def textValue(value) -> str:
+    if value is None:
+        return 'null'
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    return str(value)
+
+class Formatter:
+    # projected records rendered for humans: enums by name, sets as lists of set choices, chars as text
+    # and optional values equal to the nullValue of their type as null
+    def __init__(self, schema: Union[Schema, SchemaLayout], fields: Iterable[str] = (), templateIds: Optional[Iterable[int]] = None,
+                 where: Optional[dict] = None, format: str = 'json', enums: bool = True, nulls: bool = True) -> None:
+        if format not in FORMATS:
+            raise Exception(f'unknown format {format}')
+        self.layout = schemaLayout(schema)
+        self.projection = Projection(self.layout, fields, templateIds, where)
+        self.format = format
+        self.enums = enums
+        self.nulls = nulls
+        self.tables = LookupTables(self.layout)
+        self.renderers = {templateId: self._renderers(self.layout.messages[templateId]) for templateId in self.projection.messages}
+        self.names = {templateId: message.name for templateId, message in self.layout.messages.items()}
+        self.width = max((len(name) for name in self.names.values()), default=0)
+
+    def __str__(self) -> str:
+        return f'Formatter(format={self.format}, templateIds={sorted(self.renderers)})'
+
+    def _renderers(self, block: BlockLayout) -> dict:
+        # record key to value conversion; groups map to the renderers of their entries
+        renderers = {}
+        for leaf in block.leaves:
+            renderer = self._renderer(leaf.element)
+            if renderer is not None:
+                renderers['.'.join(leaf.path)] = renderer
+        for group in getattr(block, 'groups', ()):
+            renderers[group.name] = self._renderers(group)
+        for data in getattr(block, 'data', ()):
+            if isTextData(data):
+                renderers[data.name] = decodeText
+        return renderers
+
+    def _renderer(self, element) -> Optional[Callable]:
+        null = nullValue(element)
+        optional = self.nulls and getattr(element, 'presence', Presence.REQUIRED) == Presence.OPTIONAL
+        if isinstance(element, Enum) and self.enums:
+            # the null value decodes to None, values unknown to the schema stay raw
+            decode = self.tables.enums[element.name].decode
+
+            def render(value):
+                member = decode(value)
+                return member.name if isinstance(member, enum.Enum) else member
+            return render
+        if isinstance(element, Set) and self.enums:
+            masks = tuple(self.tables.sets[element.name].masks.items())
+
+            def render(value):
+                return [name for name, mask in masks if value & mask]
+            return render
+        if isCharArray(element):
+            return decodeText
+        if primitiveOf(element) == 'char':
+            if optional:
+                return lambda value: None if value == null else value.decode('latin-1')
+            return lambda value: value.decode('latin-1')
+        if optional:
+            return lambda value: None if value == null else value
+        return None
+
+    def render(self, record: dict, renderers: dict) -> dict:
+        for key, value in record.items():
+            renderer = renderers.get(key)
+            if renderer is None:
+                continue
+            if isinstance(renderer, dict):
+                for entry in value:
+                    self.render(entry, renderer)
+            else:
+                record[key] = renderer(value)
+        return record
+
+    def line(self, templateId: int, record: dict, position: Optional[int] = None, sequence: Optional[int] = None, timestamp: Optional[int] = None) -> str:
+        record = self.render(record, self.renderers[templateId])
+        name = self.names[templateId]
+        if self.format == 'json':
+            head = {'position': position, 'sequence': sequence, 'timestamp': timestamp, 'templateId': templateId, 'name': name}
+            head = {key: value for key, value in head.items() if value is not None}
+            head.update(record)
+            return json.dumps(head, separators=(',', ':'), default=jsonDefault)
+        parts = [
+            '' if position is None else f'{position:>10}',
+            '' if sequence is None else f'{sequence:>10}',
+            '' if timestamp is None else f'{timestamp:>19}',
+            f'{name:<{self.width}}'
+        ]
+        parts.extend(self._pairs('', record))
+        return ' '.join(part for part in parts if part)
+
+    def _pairs(self, prefix: str, record: dict) -> Iterator[str]:
+        for key, value in record.items():
+            if isinstance(value, list) and value and isinstance(value[0], dict):
+                for number, entry in enumerate(value):
+                    yield from self._pairs(f'{prefix}{key}[{number}].', entry)
+            elif isinstance(value, list):
+                yield f'{prefix}{key}={"|".join(textValue(item) for item in value)}'
+            else:
+                yield f'{prefix}{key}={textValue(value)}'
+
+    def captureLines(self, reader: CaptureReader, start: int = 0, stop: Optional[int] = None) -> Iterator[str]:
+        index = reader.index
+        for position, templateId, record in self.projection.capture(reader, start, stop):
+            row = index[position]
+            yield self.line(templateId, record, position, int(row['sequence']), int(row['timestamp']))
+
+    def recordLines(self, data, packetHeader: bool = True) -> Iterator[str]:
+        # lines of complete capture records (uint32 length and packet) held in memory, e.g. read from a pipe
+        decode = self.projection.decode
+        templateIdOf = self.layout.header.struct.unpack_from
+        templateIdIndex = self.layout.header.index('templateId')
+        position = 0
+        while position + RECORD_HEADER.size <= len(data):
+            length, = RECORD_HEADER.unpack_from(data, position)
+            start = position + RECORD_HEADER.size
+            end = start + length
+            sequence = timestamp = None
+            if packetHeader:
+                sequence, timestamp = PACKET_HEADER.unpack_from(data, start)
+                start += PACKET_HEADER.size
+            for offset in packetOffsets(data, start, end):
+                record = decode(data, offset)
+                if record is not None:
+                    yield self.line(templateIdOf(data, offset)[templateIdIndex], record, None, sequence, timestamp)
+            position = end
+
+def readRecords(stream: BinaryIO, chunkSize: int = DEFAULT_READ_SIZE) -> Iterator[bytes]:
+    # complete capture records of a stream in blocks of about chunkSize bytes
+    pending = bytearray()
+    while True:
+        chunk = stream.read(chunkSize)
+        if not chunk:
+            break
+        pending += chunk
+        position = 0
+        while position + RECORD_HEADER.size <= len(pending):
+            length, = RECORD_HEADER.unpack_from(pending, position)
+            if position + RECORD_HEADER.size + length > len(pending):
+                break
+            position += RECORD_HEADER.size + length
+        if position:
+            yield bytes(pending[:position])
+            del pending[:position]
+    if pending:
+        raise Exception(f'stream ends inside a record ({len(pending)} bytes pending)')
+
+_formatter = None
+_reader = None
+_packetHeader = True
+
+def _initWorker(layout: SchemaLayout, options: dict, path: Optional[str], packetHeader: bool) -> None:
+    # workers of a capture map it themselves, workers of a stream get blocks of records
+    global _formatter, _reader, _packetHeader
+    _formatter = Formatter(layout, **options)
+    _reader = CaptureReader(path, layout, packetHeader) if path is not None else None
+    _packetHeader = packetHeader
+
+def _formatChunk(chunk) -> str:
+    # a (start, stop) range of the capture or a block of records from a stream
+    if isinstance(chunk, tuple):
+        lines = _formatter.captureLines(_reader, *chunk)
+    else:
+        lines = _formatter.recordLines(chunk, _packetHeader)
+    return ''.join(line + '\n' for line in lines)
+
+def ordered(executor: ProcessPoolExecutor, function: Callable, chunks: Iterable, inflight: int) -> Iterator:
+    # results in submission order with at most inflight chunks pending, so memory stays bounded
+    pending = []
+    for chunk in chunks:
+        pending.append(executor.submit(function, chunk))
+        if len(pending) >= inflight:
+            yield pending.pop(0).result()
+    for future in pending:
+        yield future.result()
+
+class Dumper:
+    # streams the formatted lines of a capture file or a record stream to an output, optionally formatted by
+    # worker processes; output order is always the capture order
+    def __init__(self, schema: Union[Schema, SchemaLayout], options: Optional[dict] = None, packetHeader: bool = True,
+                 workers: int = 1, chunkSize: int = DEFAULT_CHUNK_SIZE) -> None:
+        self.layout = schemaLayout(schema)
+        self.options = options or {}
+        self.packetHeader = packetHeader
+        self.workers = workers
+        self.chunkSize = chunkSize
+        # built up front so that invalid options fail before any output, also used when formatting serially
+        self.formatter = Formatter(self.layout, **self.options)
+
+    def __str__(self) -> str:
+        return f'Dumper(workers={self.workers}, chunkSize={self.chunkSize})'
+
+    def dumpCapture(self, path: str, output, start: int = 0, stop: Optional[int] = None) -> None:
+        with CaptureReader(path, self.layout, self.packetHeader) as reader:
+            stop = len(reader) if stop is None else min(stop, len(reader))
+            # chunks keep the index selection of a huge capture small, the first lines come out right away
+            chunks = ((position, min(position + self.chunkSize, stop)) for position in range(start, stop, self.chunkSize))
+            if self.workers <= 1:
+                formatter = self.formatter
+                for chunk in chunks:
+                    for line in formatter.captureLines(reader, *chunk):
+                        output.write(line + '\n')
+                return
+            with ProcessPoolExecutor(self.workers, initializer=_initWorker, initargs=(self.layout, self.options, path, self.packetHeader)) as executor:
+                for text in ordered(executor, _formatChunk, chunks, self.workers * 2):
+                    output.write(text)
+
+    def dumpStream(self, stream: BinaryIO, output) -> None:
+        if self.workers <= 1:
+            formatter = self.formatter
+            for data in readRecords(stream):
+                for line in formatter.recordLines(data, self.packetHeader):
+                    output.write(line + '\n')
+            return
+        with ProcessPoolExecutor(self.workers, initializer=_initWorker, initargs=(self.layout, self.options, None, self.packetHeader)) as executor:
+            for text in ordered(executor, _formatChunk, readRecords(stream), self.workers * 2):
+                output.write(text)
@@ -0,0 +1,255 @@
+from __future__ import annotations
+import struct
+from typing import Optional, Union
+from app.schema import Schema, Composite
+from app.layout import SchemaLayout, schemaLayout, BlockLayout, MessageLayout, GroupLayout, DataLayout, byteOrderPrefix, formatCode, isArray
+
+def valueSetter(packer: struct.Struct, offset: int):
+    def set(self, value):
+        packer.pack_into(self._buffer, self._offset + offset, value)
+    return set
+
+def arraySetter(packer: struct.Struct, offset: int):
+    def set(self, value):
+        packer.pack_into(self._buffer, self._offset + offset, *value)
+    return set
+
+def parentValueSetter(packer: struct.Struct, offset: int):
+    def set(self, value):
+        parent = self._parent
+        packer.pack_into(parent._buffer, parent._offset + offset, value)
+    return set
+
+def parentArraySetter(packer: struct.Struct, offset: int):
+    def set(self, value):
+        parent = self._parent
+        packer.pack_into(parent._buffer, parent._offset + offset, *value)
+    return set
+
+class BlockEncoder:
+    # reusable writer over one fixed-length block of a caller-owned buffer
+    __slots__ = ('_buffer', '_offset', '_message')
+    _struct = None
+    _children = ()
+    blockLength = 0
+
+    def __init__(self, message: Optional[MessageEncoder] = None) -> None:
+        self._buffer = None
+        self._offset = 0
+        self._message = message if message is not None else self
+        for name, cls in self._children:
+            setattr(self, name, cls(self))
+
+    def pack(self, *values) -> None:
+        # writes every non-constant value of the block in layout order with one pack_into call
+        self._struct.pack_into(self._buffer, self._offset, *values)
+
+    @property
+    def offset(self) -> int:
+        return self._offset
+
+class MessageEncoder(BlockEncoder):
+    __slots__ = ('_limit', '_start')
+    _header = b''
+    templateId = 0
+
+    def __init__(self) -> None:
+        self._limit = 0
+        self._start = 0
+        super().__init__()
+
+    def wrap(self, buffer, offset: int = 0) -> MessageEncoder:
+        headerLength = len(self._header)
+        # slice assignment would grow a short bytearray, the caller's buffer is never resized
+        if offset + headerLength + self.blockLength > len(buffer):
+            raise Exception(f'buffer of {len(buffer)} bytes too short for message at offset {offset} (message: "{type(self).__name__}")')
+        buffer[offset:offset + headerLength] = self._header
+        self._buffer = buffer
+        self._start = offset
+        self._offset = offset + headerLength
+        self._limit = self._offset + self.blockLength
+        return self
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def encodedLength(self) -> int:
+        return self._limit - self._start
+
+class GroupEncoder(BlockEncoder):
+    __slots__ = ('_count', '_index')
+    _dimension = None
+    _dimensionLength = 0
+    _dimensionOrder = ()
+
+    def __init__(self, parent: BlockEncoder) -> None:
+        self._count = 0
+        self._index = 0
+        super().__init__(parent._message)
+
+    def begin(self, count: int) -> GroupEncoder:
+        message = self._message
+        self._buffer = message._buffer
+        values = (self.blockLength, count)
+        self._dimension.pack_into(self._buffer, message._limit, *[values[index] for index in self._dimensionOrder])
+        message._limit += self._dimensionLength
+        self._count = count
+        self._index = 0
+        return self
+
+    def next(self) -> GroupEncoder:
+        if self._index >= self._count:
+            raise Exception(f'group entries exceed count {self._count} (group: "{type(self).__name__}")')
+        message = self._message
+        self._offset = message._limit
+        message._limit += self.blockLength
+        self._index += 1
+        return self
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+class DataEncoder:
+    __slots__ = ('_message',)
+    _header = None
+    _headerLength = 0
+
+    def __init__(self, parent: BlockEncoder) -> None:
+        self._message = parent._message
+
+    def put(self, value) -> None:
+        message = self._message
+        buffer = message._buffer
+        limit = message._limit
+        length = len(value)
+        if limit + self._headerLength + length > len(buffer):
+            raise Exception(f'buffer of {len(buffer)} bytes too short for {length} bytes of data at offset {limit} (data: "{type(self).__name__}")')
+        self._header.pack_into(buffer, limit, length)
+        limit += self._headerLength
+        buffer[limit:limit + length] = value
+        message._limit = limit + length
+
+class CompositeEncoder:
+    __slots__ = ('_parent',)
+    _children = ()
+
+    def __init__(self, parent: BlockEncoder) -> None:
+        self._parent = parent
+        for name, cls in self._children:
+            setattr(self, name, cls(parent))
+
+class Compiler:
+    def __init__(self, layout: SchemaLayout) -> None:
+        self.layout = layout
+        self.prefix = byteOrderPrefix(layout.byteOrder)
+        self._compositeClasses = {}
+
+    def compileMessage(self, message: MessageLayout) -> type:
+        header = self.layout.header
+        values = {
+            'blockLength': message.blockLength,
+            'templateId': message.id,
+            'schemaId': self.layout.schema.id,
+            'version': self.layout.schema.version
+        }
+        namespace = {
+            '_header': header.struct.pack(*[values.get(leaf.path[0], 0) for leaf in header.leaves]),
+            'templateId': message.id
+        }
+        return self._compileBlock(message, MessageEncoder, namespace)
+
+    def compileGroup(self, group: GroupLayout) -> type:
+        dimension = group.dimension
+        order = [0] * dimension.valueCount
+        order[group.blockLengthIndex] = 0
+        order[group.numInGroupIndex] = 1
+        namespace = {
+            '_dimension': dimension.struct,
+            '_dimensionLength': dimension.blockLength,
+            '_dimensionOrder': tuple(order)
+        }
+        return self._compileBlock(group, GroupEncoder, namespace)
+
+    def compileData(self, data: DataLayout) -> type:
+        namespace = {
+            '__slots__': (),
+            '_header': data.header.struct,
+            '_headerLength': data.headerLength
+        }
+        return type(data.name, (DataEncoder,), namespace)
+
+    def _compileBlock(self, block: BlockLayout, base: type, namespace: dict) -> type:
+        namespace['_struct'] = block.struct
+        namespace['blockLength'] = block.blockLength
+        children = self._populate(namespace, block, (), None, False)
+        for group in block.groups:
+            children.append((group.name, self.compileGroup(group)))
+        for data in block.data:
+            children.append((data.name, self.compileData(data)))
+        namespace['__slots__'] = tuple(name for name, _ in children)
+        namespace['_children'] = tuple(children)
+        return type(block.name, (base,), namespace)
+
+    def _populate(self, namespace: dict, block: BlockLayout, prefix: tuple, composite: Optional[Composite], nested: bool) -> list:
+        children = []
+        elements = composite.elements if composite else [field.encoding for field in block.fields]
+        names = [element.name for element in composite.elements] if composite else [field.name for field in block.fields]
+        for name, element in zip(names, elements):
+            path = prefix + (name,)
+            if path in block.constants:
+                namespace[name] = block.constants[path]
+            elif isinstance(element, Composite):
+                children.append((name, self._compileComposite(block, path, element)))
+            else:
+                leaf = block.leaf(path)
+                if leaf is None:
+                    continue
+                packer = struct.Struct(self.prefix + formatCode(element))
+                if isArray(element):
+                    setter = (parentArraySetter if nested else arraySetter)(packer, leaf.offset)
+                else:
+                    setter = (parentValueSetter if nested else valueSetter)(packer, leaf.offset)
+                namespace[name] = property(None, setter)
+        return children
+
+    def _compileComposite(self, block: BlockLayout, path: tuple, composite: Composite) -> type:
+        key = (block.name, path)
+        cls = self._compositeClasses.get(key)
+        if cls is None:
+            namespace = {}
+            children = self._populate(namespace, block, path, composite, True)
+            namespace['__slots__'] = tuple(name for name, _ in children)
+            namespace['_children'] = tuple(children)
+            cls = type(composite.name, (CompositeEncoder,), namespace)
+            self._compositeClasses[key] = cls
+        return cls
+
+class Encoder:
+    def __init__(self, schema: Union[Schema, SchemaLayout]) -> None:
+        self.layout = schemaLayout(schema)
+        compiler = Compiler(self.layout)
+
+        self.messages = {}
+        self._encoders = {}
+        for templateId, message in self.layout.messages.items():
+            cls = compiler.compileMessage(message)
+            encoder = cls()
+            self.messages[templateId] = cls
+            self._encoders[templateId] = encoder
+            self._encoders[message.name] = encoder
+
+    def __str__(self) -> str:
+        return f'Encoder(messages={len(self.messages)})'
+
+    def message(self, key: Union[int, str]) -> MessageEncoder:
+        # returned encoder is shared per template, wrap it over the destination buffer before use
+        encoder = self._encoders.get(key)
+        if encoder is None:
+            raise Exception(f'unknown message {key}')
+        return encoder
+
+    def wrap(self, key: Union[int, str], buffer, offset: int = 0) -> MessageEncoder:
+        return self.message(key).wrap(buffer, offset)
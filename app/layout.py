@@ -0,0 +1,349 @@
+from __future__ import annotations
+import struct
+from typing import Optional, Union
+from app.schema import Schema, Type, Composite, Enum, Set, Message, Group, Field, Data, Presence, ByteOrder
+
+FORMAT_CODES = {
+    'char': 'c',
+    'int8': 'b',
+    'int16': 'h',
+    'int32': 'i',
+    'int64': 'q',
+    'uint8': 'B',
+    'uint16': 'H',
+    'uint32': 'I',
+    'uint64': 'Q',
+    'float': 'f',
+    'double': 'd'
+}
+
+NULL_VALUES = {
+    'char': b'\x00',
+    'int8': -2 ** 7,
+    'int16': -2 ** 15,
+    'int32': -2 ** 31,
+    'int64': -2 ** 63,
+    'uint8': 2 ** 8 - 1,
+    'uint16': 2 ** 16 - 1,
+    'uint32': 2 ** 32 - 1,
+    'uint64': 2 ** 64 - 1,
+    'float': float('nan'),
+    'double': float('nan')
+}
+
+def byteOrderPrefix(byteOrder: ByteOrder) -> str:
+    if byteOrder == ByteOrder.BIG_ENDIAN:
+        return '>'
+    return '<'
+
+def isConstant(element) -> bool:
+    return getattr(element, 'presence', Presence.REQUIRED) == Presence.CONSTANT
+
+def primitiveOf(element: Union[Type, Enum, Set]) -> str:
+    if isinstance(element, Type):
+        return element.primitiveType.name
+    return element.encodingType.name
+
+def isCharArray(element) -> bool:
+    return isinstance(element, Type) and element.primitiveType.name == 'char' and element.length > 1
+
+def isArray(element) -> bool:
+    return isinstance(element, Type) and element.primitiveType.name != 'char' and element.length > 1
+
+def formatCode(element: Union[Type, Enum, Set]) -> str:
+    code = FORMAT_CODES[primitiveOf(element)]
+    if isCharArray(element):
+        return f'{element.length}s'
+    if isArray(element):
+        return f'{element.length}{code}'
+    return code
+
+def parseValue(primitive: str, value: str):
+    if primitive == 'char':
+        return value.encode()
+    if primitive in ('float', 'double'):
+        return float(value)
+    return int(value)
+
+def resolveValueRef(schema: Schema, valueRef: str):
+    name, valueName = valueRef.split('.')
+    enum = schema.types.get(name)
+    if not isinstance(enum, Enum):
+        raise Exception(f'enum {name} not found (valueRef: "{valueRef}")')
+    for entry in enum.validValues:
+        if entry['name'] == valueName:
+            return parseValue(enum.encodingType.name, entry['value'])
+    raise Exception(f'value {valueName} is not exists in enum {name} (valueRef: "{valueRef}")')
+
+def nullValue(element: Union[Type, Enum, Set]):
+    # explicit nullValue of the schema or the SBE default of the primitive type
+    if isinstance(element, Set):
+        return 0
+    primitive = element.primitiveType if isinstance(element, Type) else element.encodingType
+    if isCharArray(element):
+        return b''
+    value = element.nullValue
+    if value is None or value == primitive.nullValue:
+        value = NULL_VALUES[primitive.name]
+    else:
+        value = parseValue(primitive.name, value)
+    if isArray(element):
+        return (value,) * element.length
+    return value
+
+def present(entry, actingVersion: Optional[int]) -> bool:
+    return actingVersion is None or entry.sinceVersion <= actingVersion
+
+class Leaf:
+    # single primitive value of a block, addressed by path from the block root
+    def __init__(self, path: tuple, element: Union[Type, Enum, Set], offset: int) -> None:
+        self.path = path
+        self.element = element
+        self.offset = offset
+        self.index = None
+        self.count = element.length if isArray(element) else 1
+
+    def __str__(self) -> str:
+        return f'Leaf(path={".".join(self.path)}, offset={self.offset}, format={formatCode(self.element)})'
+
+class FieldLayout:
+    def __init__(self, field: Field, encoding: Union[Type, Composite, Enum, Set], offset: int, constValue=None) -> None:
+        self.name = field.name
+        self.id = field.id
+        self.field = field
+        self.encoding = encoding
+        self.offset = offset
+        self.sinceVersion = field.sinceVersion
+        self.constValue = constValue
+        self.absent = False
+
+    def __str__(self) -> str:
+        return f'FieldLayout(name="{self.name}", type={self.encoding.name}, offset={self.offset}, encodedLength={self.encodedLength})'
+
+    @property
+    def isConstant(self) -> bool:
+        return self.field.presence == Presence.CONSTANT or isConstant(self.encoding)
+
+    @property
+    def encodedLength(self) -> int:
+        if self.field.presence == Presence.CONSTANT:
+            return 0
+        return self.encoding.encodedLength
+
+class BlockLayout:
+    def __init__(self, schema: Schema, name: str, fields: list, blockLength: Optional[int], actingVersion: Optional[int] = None) -> None:
+        self.name = name
+        self.actingVersion = actingVersion
+        self.fields = []
+        self.leaves = []
+        self.constants = {}
+
+        cursor = 0
+        for field in fields:
+            encoding = schema.types.get(field.type)
+            if encoding is None:
+                raise Exception(f'type {field.type} not found (field: "{field.name}", block: "{name}")')
+            offset = field.offset if field.offset is not None else cursor
+            constValue = None
+            if field.presence == Presence.CONSTANT:
+                if field.valueRef is None:
+                    raise Exception(f'constant field has no valueRef (field: "{field.name}", block: "{name}")')
+                constValue = resolveValueRef(schema, field.valueRef)
+                self.constants[(field.name,)] = constValue
+            elif not present(field, actingVersion):
+                # field is newer than the sender, it is not on the wire and reads as null
+                self._collectNull(encoding, (field.name,))
+            else:
+                self._collect(encoding, (field.name,), offset)
+            entry = FieldLayout(field, encoding, offset, constValue)
+            entry.absent = not present(field, actingVersion)
+            self.fields.append(entry)
+            cursor = offset + entry.encodedLength
+
+        self.blockLength = blockLength if blockLength is not None else cursor
+        if cursor > self.blockLength:
+            raise Exception(f'fields exceed blockLength {self.blockLength} (block: "{name}")')
+
+        self.leaves.sort(key=lambda leaf: leaf.offset)
+        self.format, self.valueCount = self._buildFormat(schema.byteOrder)
+        self.struct = struct.Struct(self.format)
+
+    def __getstate__(self) -> dict:
+        # struct.Struct is not picklable, it is rebuilt from the format
+        state = self.__dict__.copy()
+        del state['struct']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.struct = struct.Struct(self.format)
+
+    def __str__(self) -> str:
+        return f'BlockLayout(name="{self.name}", fields={len(self.fields)}, blockLength={self.blockLength}, format="{self.format}")'
+
+    def _collect(self, element, path: tuple, offset: int) -> None:
+        if isinstance(element, Composite):
+            cursor = offset
+            for child in element.elements:
+                if child.offset is not None:
+                    cursor = offset + child.offset
+                self._collect(child, path + (child.name,), cursor)
+                cursor += child.encodedLength
+        elif isinstance(element, Type) and element.length == 0:
+            # variable length payload of a var data composite
+            return
+        elif isConstant(element):
+            self.constants[path] = parseValue(element.primitiveType.name, element.constValue)
+        else:
+            self.leaves.append(Leaf(path, element, offset))
+
+    def _collectNull(self, element, path: tuple) -> None:
+        if isinstance(element, Composite):
+            for child in element.elements:
+                self._collectNull(child, path + (child.name,))
+        elif isinstance(element, Type) and element.length == 0:
+            return
+        elif isConstant(element):
+            self.constants[path] = parseValue(element.primitiveType.name, element.constValue)
+        else:
+            self.constants[path] = nullValue(element)
+
+    def _buildFormat(self, byteOrder: ByteOrder) -> tuple:
+        result = [byteOrderPrefix(byteOrder)]
+        cursor = 0
+        index = 0
+        for leaf in self.leaves:
+            if leaf.offset < cursor:
+                raise Exception(f'overlapping field at offset {leaf.offset} (block: "{self.name}")')
+            if leaf.offset > cursor:
+                result.append(f'{leaf.offset - cursor}x')
+            result.append(formatCode(leaf.element))
+            leaf.index = index
+            index += leaf.count
+            cursor = leaf.offset + leaf.element.encodedLength
+        return ''.join(result), index
+
+    def leaf(self, path: tuple) -> Optional[Leaf]:
+        for leaf in self.leaves:
+            if leaf.path == path:
+                return leaf
+        return None
+
+    def field(self, name: str) -> Optional[FieldLayout]:
+        for field in self.fields:
+            if field.name == name:
+                return field
+        return None
+
+class CompositeLayout(BlockLayout):
+    # standalone composite such as messageHeader or a group dimension
+    def __init__(self, schema: Schema, composite: Composite) -> None:
+        self.name = composite.name
+        self.composite = composite
+        self.actingVersion = None
+        self.fields = []
+        self.leaves = []
+        self.constants = {}
+        self._collect(composite, (), 0)
+        self.blockLength = composite.encodedLength
+        self.leaves.sort(key=lambda leaf: leaf.offset)
+        self.format, self.valueCount = self._buildFormat(schema.byteOrder)
+        self.struct = struct.Struct(self.format)
+
+    def index(self, name: str) -> int:
+        leaf = self.leaf((name,))
+        if leaf is None:
+            raise Exception(f'element {name} not found (composite: "{self.name}")')
+        return leaf.index
+
+class DataLayout:
+    def __init__(self, schema: Schema, data: Data, actingVersion: Optional[int] = None) -> None:
+        self.name = data.name
+        self.id = data.id
+        self.data = data
+        self.sinceVersion = data.sinceVersion
+        self.absent = not present(data, actingVersion)
+        encoding = schema.types.get(data.type)
+        if not isinstance(encoding, Composite):
+            raise Exception(f'type {data.type} not found or not a composite (data: "{data.name}")')
+        self.encoding = encoding
+        self.header = CompositeLayout(schema, encoding)
+        self.headerLength = self.header.blockLength
+        self.lengthIndex = self.header.index('length')
+
+    def __str__(self) -> str:
+        return f'DataLayout(name="{self.name}", type={self.encoding.name}, headerLength={self.headerLength})'
+
+class GroupLayout(BlockLayout):
+    def __init__(self, schema: Schema, group: Group, actingVersion: Optional[int] = None) -> None:
+        self.id = group.id
+        self.group = group
+        self.sinceVersion = group.sinceVersion
+        self.absent = not present(group, actingVersion)
+        dimension = schema.types.get(group.dimensionType)
+        if not isinstance(dimension, Composite):
+            raise Exception(f'dimension type {group.dimensionType} not found (group: "{group.name}")')
+        self.dimension = CompositeLayout(schema, dimension)
+        self.blockLengthIndex = self.dimension.index('blockLength')
+        self.numInGroupIndex = self.dimension.index('numInGroup')
+        fields, self.groups, self.data = splitElements(schema, group.elements, actingVersion)
+        super().__init__(schema, group.name, fields, group.blockLength, actingVersion)
+
+class MessageLayout(BlockLayout):
+    def __init__(self, schema: Schema, message: Message, actingVersion: Optional[int] = None) -> None:
+        self.id = message.id
+        self.message = message
+        self.sinceVersion = message.sinceVersion
+        self.semanticType = message.semanticType
+        fields, self.groups, self.data = splitElements(schema, message.elements, actingVersion)
+        super().__init__(schema, message.name, fields, message.blockLength, actingVersion)
+
+def splitElements(schema: Schema, elements: list, actingVersion: Optional[int] = None) -> tuple:
+    fields, groups, data = [], [], []
+    for element in elements:
+        if isinstance(element, Group):
+            groups.append(GroupLayout(schema, element, actingVersion))
+        elif isinstance(element, Data):
+            data.append(DataLayout(schema, element, actingVersion))
+        else:
+            fields.append(element)
+    return fields, groups, data
+
+class SchemaLayout:
+    def __init__(self, schema: Schema) -> None:
+        self.schema = schema
+        self.byteOrder = schema.byteOrder
+        header = schema.types.get(schema.headerType)
+        if not isinstance(header, Composite):
+            raise Exception(f'header type {schema.headerType} not found')
+        self.header = CompositeLayout(schema, header)
+        self.messages = {}
+        self.messagesByName = {}
+        # layouts of older senders by (templateId, actingVersion), built once so that compiled caches keyed by
+        # layout stay bounded by the number of templates and versions
+        self._versioned = {}
+        for message in schema.messages:
+            entry = MessageLayout(schema, message)
+            if entry.id in self.messages:
+                raise Exception(f'duplicate message id {entry.id} (message: "{entry.name}")')
+            self.messages[entry.id] = entry
+            self.messagesByName[entry.name] = entry
+
+    def versioned(self, templateId: int, actingVersion: int) -> MessageLayout:
+        # layout of a message as encoded by a sender of the given schema version
+        message = self.messages[templateId]
+        if actingVersion >= self.schema.version:
+            return message
+        key = (templateId, actingVersion)
+        layout = self._versioned.get(key)
+        if layout is None:
+            layout = self._versioned[key] = MessageLayout(self.schema, message.message, actingVersion)
+        return layout
+
+    def __str__(self) -> str:
+        return f'SchemaLayout(messages={len(self.messages)}, header={self.header.format})'
+
+def schemaLayout(schema: Union[Schema, SchemaLayout]) -> SchemaLayout:
+    if isinstance(schema, SchemaLayout):
+        return schema
+    return SchemaLayout(schema)
@@ -0,0 +1,180 @@
+from __future__ import annotations
+import enum
+from typing import Iterable, Optional, Union
+import numpy as np
+from app.schema import Schema, Enum, Set
+from app.layout import SchemaLayout, schemaLayout, parseValue, nullValue
+
+# ranges up to this size are decoded through a dense list indexed by raw value
+DENSE_RANGE = 256
+
+class EnumTable:
+    # raw value to member of a python enum generated from the schema enum; the null value decodes to None
+    # and values unknown to the schema (e.g. added by a newer version) are returned raw
+    def __init__(self, element: Enum) -> None:
+        self.name = element.name
+        self.element = element
+        self.char = element.encodingType.name == 'char'
+        self.nullValue = nullValue(element)
+        values = [(entry['name'], parseValue(element.encodingType.name, entry['value'])) for entry in element.validValues]
+        base = enum.Enum if self.char else enum.IntEnum
+        self.members = base(element.name, values)
+        self.byValue = {member.value: member for member in self.members}
+        self.byName = {member.name: member for member in self.members}
+
+        if self.char:
+            # char encodings are keyed by the byte value of the single char
+            self.kind = 'char'
+            self.low = 0
+            self.table = [None] * 256
+            for value, member in self.byValue.items():
+                self.table[value[0]] = member
+            table = self.table
+
+            def decode(raw):
+                member = table[raw[0]]
+                return raw if member is None and raw != b'\x00' else member
+        elif self.byValue and max(self.byValue) - min(self.byValue) < DENSE_RANGE:
+            self.kind = 'dense'
+            self.low = min(self.byValue)
+            self.table = [None] * (max(self.byValue) - self.low + 1)
+            for value, member in self.byValue.items():
+                self.table[value - self.low] = member
+            table, low, size, null = self.table, self.low, len(self.table), self.nullValue
+
+            def decode(raw):
+                slot = raw - low
+                if 0 <= slot < size:
+                    member = table[slot]
+                    if member is not None:
+                        return member
+                return None if raw == null else raw
+        else:
+            self.kind = 'dict'
+            self.low = 0
+            self.table = self.byValue
+            table, null = self.table, self.nullValue
+
+            def decode(raw):
+                member = table.get(raw)
+                if member is None and raw != null:
+                    return raw
+                return member
+        self.decode = decode
+
+    def __str__(self) -> str:
+        return f'EnumTable(name="{self.name}", kind={self.kind}, values={len(self.byValue)})'
+
+    def encode(self, member: Union[str, enum.Enum, None]):
+        if member is None:
+            return self.nullValue
+        if isinstance(member, str):
+            member = self.byName[member]
+        return member.value
+
+    def _raw(self, column) -> np.ndarray:
+        column = np.asarray(column)
+        if self.char:
+            return column.view(np.uint8) if column.dtype.kind == 'S' else column.astype(np.uint8)
+        return column
+
+    def _slots(self, raw: np.ndarray) -> tuple:
+        # members in slot order and the slot of every raw value, len(members) for null and unknown values
+        if self.kind == 'dict':
+            keys = np.array(sorted(self.byValue), dtype=np.int64)
+            members = [self.byValue[key] for key in keys.tolist()]
+            if not members:
+                return members, np.zeros(raw.shape, dtype=np.intp)
+            positions = np.searchsorted(keys, raw).clip(0, len(keys) - 1)
+            return members, np.where(keys[positions] == raw, positions, len(members))
+        members = self.table
+        slots = raw.astype(np.int64) - self.low
+        slots = np.where((slots >= 0) & (slots < len(members)), slots, len(members))
+        return members, slots
+
+    def map(self, column, mapping: dict, default=None, dtype=object) -> np.ndarray:
+        # vectorized mapping of a raw column through {member: value}
+        members, slots = self._slots(self._raw(column))
+        lookup = np.array([default if member is None else mapping.get(member, default) for member in members] + [default], dtype=dtype)
+        return lookup[slots]
+
+    def names(self, column) -> np.ndarray:
+        # member names of a raw column, None for null and unknown values
+        return self.map(column, {member: member.name for member in self.members})
+
+    def codes(self, column) -> np.ndarray:
+        # position of each value in validValues, -1 for null and unknown values
+        return self.map(column, {member: code for code, member in enumerate(self.members)}, -1, np.int16)
+
+    def isin(self, column, members: Iterable[Union[str, enum.Enum]]) -> np.ndarray:
+        raw = self._raw(column)
+        selected = [self.encode(member) for member in members]
+        if self.char:
+            selected = [value[0] for value in selected]
+        return np.isin(raw, selected)
+
+class SetTable:
+    # choices compiled to bitmasks; decoded values are IntFlag members so that `Flag in value` works
+    def __init__(self, element: Set) -> None:
+        self.name = element.name
+        self.element = element
+        self.masks = {choice['name']: 1 << choice['value'] for choice in element.choices}
+        self.flags = enum.IntFlag(element.name, self.masks)
+        self.mask = sum(self.masks.values())
+        if element.encodingType.size == 1:
+            # every uint8 value is decoded once up front
+            self.table = [self.flags(value) for value in range(256)]
+            self.decode = self.table.__getitem__
+        else:
+            self.table = {}
+            self.decode = self._decodeCached
+
+    def __str__(self) -> str:
+        return f'SetTable(name="{self.name}", choices={len(self.masks)})'
+
+    def _decodeCached(self, raw: int):
+        value = self.table.get(raw)
+        if value is None:
+            value = self.flags(raw)
+            if len(self.table) < 4096:
+                self.table[raw] = value
+        return value
+
+    def has(self, raw: int, name: str) -> bool:
+        return bool(raw & self.masks[name])
+
+    def encode(self, names: Iterable[str]) -> int:
+        value = 0
+        for name in names:
+            value |= self.masks[name]
+        return value
+
+    def flag(self, column, name: str) -> np.ndarray:
+        # vectorized membership of one choice over a raw column
+        return (np.asarray(column) & self.masks[name]) != 0
+
+    def unpack(self, column) -> dict:
+        column = np.asarray(column)
+        return {name: (column & mask) != 0 for name, mask in self.masks.items()}
+
+class LookupTables:
+    # tables of every enum and set of a schema, keyed by type name
+    def __init__(self, schema: Union[Schema, SchemaLayout]) -> None:
+        self.layout = schemaLayout(schema)
+        self.enums = {}
+        self.sets = {}
+        for name, element in self.layout.schema.types.items():
+            if isinstance(element, Enum):
+                self.enums[name] = EnumTable(element)
+            elif isinstance(element, Set):
+                self.sets[name] = SetTable(element)
+
+    def __str__(self) -> str:
+        return f'LookupTables(enums={len(self.enums)}, sets={len(self.sets)})'
+
+    def table(self, element: Union[Enum, Set]) -> Optional[Union[EnumTable, SetTable]]:
+        if isinstance(element, Enum):
+            return self.enums.get(element.name)
+        if isinstance(element, Set):
+            return self.sets.get(element.name)
+        return None
@@ -0,0 +1,272 @@
+from __future__ import annotations
+import time
+from typing import Callable, Optional, Union
+from app.schema import Schema
+from app.layout import SchemaLayout, schemaLayout
+
+DEFAULT_PRECISION = 5
+DEFAULT_MAX_VALUE = 1 << 40
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+class Histogram:
+    # log-linear buckets in the manner of HdrHistogram: values below 2^precision are exact, above that each
+    # power of two is split into 2^(precision - 1) buckets, so memory is fixed and relative error bounded
+    __slots__ = ('precision', 'maxValue', 'counts', 'count', 'total', 'min', 'max', '_direct', '_half')
+
+    def __init__(self, precision: int = DEFAULT_PRECISION, maxValue: int = DEFAULT_MAX_VALUE) -> None:
+        self.precision = precision
+        self.maxValue = maxValue
+        self._direct = 1 << precision
+        self._half = 1 << (precision - 1)
+        self.counts = [0] * (self._index(maxValue) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def __str__(self) -> str:
+        return f'Histogram(count={self.count}, min={self.min}, max={self.max}, p99={self.percentile(0.99)})'
+
+    def _index(self, value: int) -> int:
+        if value < self._direct:
+            return value
+        shift = value.bit_length() - self.precision
+        return self._direct + (shift - 1) * self._half + (value >> shift) - self._half
+
+    def _lowest(self, index: int) -> int:
+        # smallest value that falls into the bucket
+        if index < self._direct:
+            return index
+        shift, sub = divmod(index - self._direct, self._half)
+        return (sub + self._half) << (shift + 1)
+
+    def record(self, value: int) -> None:
+        value = min(max(int(value), 0), self.maxValue)
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, quantile: float) -> Optional[int]:
+        if not self.count:
+            return None
+        target = max(1, int(quantile * self.count + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._lowest(index), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def merge(self, other: Histogram) -> None:
+        if other.precision != self.precision or len(other.counts) != len(self.counts):
+            raise Exception('histograms with different precision can not be merged')
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def reset(self) -> None:
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def summary(self) -> dict:
+        result = {'count': self.count, 'min': self.min, 'max': self.max, 'mean': self.mean}
+        for quantile in QUANTILES:
+            result[f'p{quantile * 100:g}'] = self.percentile(quantile)
+        return result
+
+    def buckets(self) -> list:
+        # (lowest value, count) of non-empty buckets
+        return [(self._lowest(index), count) for index, count in enumerate(self.counts) if count]
+
+class Metrics:
+    # per template counters and sampled histograms; messages are always counted, every sampleEvery-th
+    # message of a template is timed and its bytes and group sizes recorded
+    def __init__(self, schema: Union[Schema, SchemaLayout], sampleRate: float = 1.0, precision: int = DEFAULT_PRECISION) -> None:
+        if not 0 < sampleRate <= 1:
+            raise Exception(f'sample rate {sampleRate} must be in (0, 1]')
+        self.layout = schemaLayout(schema)
+        self.sampleEvery = max(1, round(1 / sampleRate))
+        self.precision = precision
+        self._headerLength = self.layout.header.blockLength
+        size = max(self.layout.messages, default=-1) + 1
+        self.messages = [0] * size
+        self.sampled = [0] * size
+        self.bytes = [0] * size
+        self.skipped = [0] * size
+        self.unknown = {}
+        self.latency = {templateId: Histogram(precision) for templateId in self.layout.messages}
+        self.groupSizes = {(templateId, group.name): Histogram(precision, 1 << 16) for templateId, message in self.layout.messages.items() for group in message.groups}
+        self._groups = {templateId: tuple(group.name for group in message.groups) for templateId, message in self.layout.messages.items()}
+        self.hooks = []
+        self.profiler = None
+
+    def __str__(self) -> str:
+        return f'Metrics(messages={sum(self.messages)}, sampled={sum(self.sampled)}, skipped={sum(self.skipped)}, unknown={sum(self.unknown.values())})'
+
+    def addHook(self, hook: Callable) -> None:
+        # hook(templateId, elapsedNs, flyweight) runs for every sampled message
+        self.hooks.append(hook)
+
+    def setProfiler(self, profiler) -> None:
+        # object with enable()/disable() (e.g. cProfile.Profile) active only around sampled messages
+        self.profiler = profiler
+
+    def miss(self, templateId: int) -> None:
+        if templateId < len(self.skipped) and templateId in self.layout.messages:
+            self.skipped[templateId] += 1
+        else:
+            self.unknown[templateId] = self.unknown.get(templateId, 0) + 1
+
+    def sample(self, templateId: int, elapsed: int, flyweight) -> None:
+        self.sampled[templateId] += 1
+        self.latency[templateId].record(elapsed)
+        self.bytes[templateId] += flyweight.end - flyweight.offset + self._headerLength
+        for name in self._groups[templateId]:
+            self.groupSizes[(templateId, name)].record(len(getattr(flyweight, name)))
+        for hook in self.hooks:
+            hook(templateId, elapsed, flyweight)
+
+    def instrument(self, templateId: int, handler: Callable) -> Callable:
+        # handler wrapper used by Router: counts every message and times the sampled ones
+        messages = self.messages
+        every = self.sampleEvery
+        sample = self.sample
+        clock = time.perf_counter_ns
+        metrics = self
+
+        def instrumented(flyweight) -> None:
+            messages[templateId] += 1
+            if messages[templateId] % every:
+                handler(flyweight)
+                return
+            profiler = metrics.profiler
+            if profiler is not None:
+                profiler.enable()
+            start = clock()
+            handler(flyweight)
+            elapsed = clock() - start
+            if profiler is not None:
+                profiler.disable()
+            sample(templateId, elapsed, flyweight)
+        return instrumented
+
+    def instrumentBatch(self, templateId: int, handler: Callable) -> Callable:
+        # batch handler wrapper: every message is counted, sampled batches record their time per message
+        messages = self.messages
+        sampled = self.sampled
+        latency = self.latency[templateId]
+        every = self.sampleEvery
+        clock = time.perf_counter_ns
+        metrics = self
+
+        def instrumented(buffer, offsets) -> None:
+            count = len(offsets)
+            before = messages[templateId]
+            messages[templateId] = before + count
+            if before // every == (before + count) // every:
+                handler(buffer, offsets)
+                return
+            profiler = metrics.profiler
+            if profiler is not None:
+                profiler.enable()
+            start = clock()
+            handler(buffer, offsets)
+            elapsed = clock() - start
+            if profiler is not None:
+                profiler.disable()
+            sampled[templateId] += 1
+            latency.record(elapsed // count)
+            for hook in metrics.hooks:
+                hook(templateId, elapsed, None)
+        return instrumented
+
+    def reset(self) -> None:
+        for counters in (self.messages, self.sampled, self.bytes, self.skipped):
+            counters[:] = [0] * len(counters)
+        self.unknown.clear()
+        for histogram in list(self.latency.values()) + list(self.groupSizes.values()):
+            histogram.reset()
+
+    def snapshot(self) -> dict:
+        templates = {}
+        for templateId, message in sorted(self.layout.messages.items()):
+            if not self.messages[templateId] and not self.skipped[templateId]:
+                continue
+            templates[message.name] = {
+                'templateId': templateId,
+                'messages': self.messages[templateId],
+                'sampled': self.sampled[templateId],
+                'sampledBytes': self.bytes[templateId],
+                'skipped': self.skipped[templateId],
+                'latencyNs': self.latency[templateId].summary(),
+                'groupSizes': {name: self.groupSizes[(templateId, name)].summary() for name in self._groups[templateId]}
+            }
+        return {'sampleEvery': self.sampleEvery, 'templates': templates, 'unknown': dict(self.unknown)}
+
+    def exposition(self, prefix: str = 'sbe') -> str:
+        # text exposition in the Prometheus format
+        lines = []
+        snapshot = self.snapshot()
+        for name, entry in snapshot['templates'].items():
+            label = f'template="{name}",templateId="{entry["templateId"]}"'
+            lines.append(f'{prefix}_messages_total{{{label}}} {entry["messages"]}')
+            lines.append(f'{prefix}_skipped_total{{{label}}} {entry["skipped"]}')
+            lines.append(f'{prefix}_sampled_total{{{label}}} {entry["sampled"]}')
+            lines.append(f'{prefix}_sampled_bytes_total{{{label}}} {entry["sampledBytes"]}')
+            for key, value in entry['latencyNs'].items():
+                if key.startswith('p') and value is not None:
+                    lines.append(f'{prefix}_latency_ns{{{label},quantile="{float(key[1:]) / 100:g}"}} {value}')
+            for group, sizes in entry['groupSizes'].items():
+                for key, value in sizes.items():
+                    if key.startswith('p') and value is not None:
+                        lines.append(f'{prefix}_group_size{{{label},group="{group}",quantile="{float(key[1:]) / 100:g}"}} {value}')
+        for templateId, count in sorted(snapshot['unknown'].items()):
+            lines.append(f'{prefix}_unknown_total{{templateId="{templateId}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+class InstrumentedDecoder:
+    # Decoder wrapper with the same decode/skip interface that feeds Metrics
+    def __init__(self, decoder, metrics: Metrics) -> None:
+        self.decoder = decoder
+        self.metrics = metrics
+        self.layout = decoder.layout
+        self.headerLength = decoder.headerLength
+        self._decode = decoder.decode
+        self._templateId = decoder.templateId
+
+    def __str__(self) -> str:
+        return f'InstrumentedDecoder({self.decoder}, {self.metrics})'
+
+    def __getattr__(self, name: str):
+        return getattr(self.decoder, name)
+
+    def decode(self, buffer, offset: int = 0):
+        metrics = self.metrics
+        templateId = self._templateId(buffer, offset)
+        if templateId >= len(metrics.messages) or templateId not in metrics.latency:
+            metrics.miss(templateId)
+            return self._decode(buffer, offset)
+        metrics.messages[templateId] += 1
+        if metrics.messages[templateId] % metrics.sampleEvery:
+            return self._decode(buffer, offset)
+        start = time.perf_counter_ns()
+        flyweight = self._decode(buffer, offset)
+        metrics.sample(templateId, time.perf_counter_ns() - start, flyweight)
+        return flyweight
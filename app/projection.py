@@ -0,0 +1,346 @@
+from __future__ import annotations
+import enum
+import functools
+import operator
+import struct
+from typing import Callable, Iterable, Iterator, Optional, Union
+import numpy as np
+from app.schema import Schema, Enum
+from app.layout import SchemaLayout, schemaLayout, BlockLayout, GroupLayout, Leaf, byteOrderPrefix, formatCode, primitiveOf, isCharArray, FORMAT_CODES
+from app.lookup import LookupTables
+from app.decoder import compileSkip
+
+def rawValue(leaf: Leaf, value, tables: Optional[LookupTables] = None):
+    # test value in the raw encoding of the leaf: enum members and names by their value, text of chars as
+    # null padded bytes and numeric text parsed; values that can not be encoded are rejected
+    element = leaf.element
+    primitive = primitiveOf(element)
+    test = value
+    table = tables.table(element) if tables is not None and isinstance(element, Enum) else None
+    if isinstance(value, enum.Enum):
+        value = value.value
+    elif table is not None and isinstance(value, str) and value in table.byName:
+        value = table.byName[value].value
+    if primitive == 'char':
+        if isinstance(value, str):
+            try:
+                value = value.encode('latin-1')
+            except UnicodeEncodeError:
+                value = None
+        length = element.length if isCharArray(element) else 1
+        if isinstance(value, (bytes, bytearray)) and len(value) <= length:
+            return bytes(value).ljust(length, b'\x00')
+    elif not isinstance(value, (bool, bytes, bytearray)):
+        if isinstance(value, str):
+            try:
+                value = float(value) if primitive in ('float', 'double') else int(value, 0)
+            except ValueError:
+                value = None
+        try:
+            struct.pack(FORMAT_CODES[primitive], value)
+            return value
+        except struct.error:
+            pass
+    raise Exception(f'value {test!r} can not be encoded as {primitive} of field {".".join(leaf.path)}')
+
+def predicate(test) -> Callable:
+    # raw value test: a collection means membership, a callable is used as is, anything else is equality
+    if callable(test):
+        return test
+    if isinstance(test, (set, frozenset, list, tuple)):
+        return frozenset(test).__contains__
+    return functools.partial(operator.eq, test)
+
+class Request:
+    # what has to be read from one block: output leaves, tested leaves, groups and data
+    __slots__ = ('all', 'paths', 'tests', 'data', 'groups')
+
+    def __init__(self) -> None:
+        self.all = False
+        self.paths = []
+        self.tests = []
+        self.data = set()
+        self.groups = {}
+
+    def group(self, name: str) -> Request:
+        return self.groups.setdefault(name, Request())
+
+    @property
+    def output(self) -> bool:
+        return self.all or bool(self.paths) or bool(self.data) or any(group.output for group in self.groups.values())
+
+    @property
+    def filtering(self) -> bool:
+        return bool(self.tests) or any(group.filtering for group in self.groups.values())
+
+class BlockProjection:
+    # reads selected leaves of a block with a struct that skips everything else
+    def __init__(self, block: BlockLayout, request: Request, prefix: str) -> None:
+        self.name = block.name
+        outputs = block.leaves if request.all else [leaf for leaf in block.leaves if any(leaf.path[:len(path)] == path for path in request.paths)]
+        tested = [(block.leaf(path), test) for path, test in request.tests]
+        leaves = sorted({id(leaf): leaf for leaf in outputs + [leaf for leaf, _ in tested]}.values(), key=lambda leaf: leaf.offset)
+
+        format = [prefix]
+        cursor = 0
+        index = 0
+        positions = {}
+        for leaf in leaves:
+            if leaf.offset > cursor:
+                format.append(f'{leaf.offset - cursor}x')
+            format.append(formatCode(leaf.element))
+            positions[id(leaf)] = index
+            index += leaf.count
+            cursor = leaf.offset + leaf.element.encodedLength
+        self.format = ''.join(format)
+        self.struct = struct.Struct(self.format)
+        self.outputs = tuple(('.'.join(leaf.path), positions[id(leaf)], leaf.count) for leaf in outputs)
+        self.tests = tuple((positions[id(leaf)], predicate(test)) for leaf, test in tested)
+
+        # groups then var data, in wire order; each step returns the next position, or its bitwise
+        # inversion when the owner has to be rejected so that walking can continue past it
+        self.chain = []
+        self.needed = 0
+        for group in getattr(block, 'groups', ()):
+            child = request.groups.get(group.name)
+            if request.all:
+                # a group that is only tested is still output whole when its owner is
+                child = child or Request()
+                child.all = True
+            if child is None:
+                self.chain.append(skipStep(compileSkip(group)))
+            else:
+                self.chain.append(GroupProjection(group, child, prefix).read)
+                self.needed = len(self.chain)
+        for data in getattr(block, 'data', ()):
+            selected = request.all or data.name in request.data
+            self.chain.append(dataStep(data, selected))
+            if selected:
+                self.needed = len(self.chain)
+
+    def __str__(self) -> str:
+        return f'BlockProjection(name="{self.name}", outputs={len(self.outputs)}, tests={len(self.tests)}, format="{self.format}")'
+
+    def read(self, buffer, offset: int) -> Optional[dict]:
+        values = self.struct.unpack_from(buffer, offset)
+        for index, test in self.tests:
+            if not test(values[index]):
+                return None
+        record = {}
+        for name, index, count in self.outputs:
+            record[name] = values[index] if count == 1 else values[index:index + count]
+        return record
+
+def skipStep(skip: Callable) -> Callable:
+    def step(buffer, position: int, record: dict) -> int:
+        return skip(buffer, position)
+    return step
+
+def dataStep(data, selected: bool) -> Callable:
+    header = data.header.struct
+    headerLength = data.headerLength
+    lengthIndex = data.lengthIndex
+    name = data.name
+
+    def step(buffer, position: int, record: dict) -> int:
+        start = position + headerLength
+        end = start + header.unpack_from(buffer, position)[lengthIndex]
+        if selected:
+            record[name] = bytes(buffer[start:end])
+        return end
+    return step
+
+class GroupProjection:
+    def __init__(self, group: GroupLayout, request: Request, prefix: str) -> None:
+        self.name = group.name
+        self.entry = BlockProjection(group, request, prefix)
+        self.output = request.output
+        self.filtering = request.filtering
+        self._dimension = group.dimension.struct
+        self._dimensionLength = group.dimension.blockLength
+        self._blockLengthIndex = group.blockLengthIndex
+        self._numInGroupIndex = group.numInGroupIndex
+
+    def read(self, buffer, position: int, record: dict) -> int:
+        # matching entries go to the record; a filtering group without matches rejects its owner
+        values = self._dimension.unpack_from(buffer, position)
+        blockLength = values[self._blockLengthIndex]
+        count = values[self._numInGroupIndex]
+        position += self._dimensionLength
+        read = self.entry.read
+        chain = self.entry.chain
+        entries = []
+        if not chain:
+            for offset in range(position, position + count * blockLength, blockLength):
+                entry = read(buffer, offset)
+                if entry is not None:
+                    entries.append(entry)
+            position += count * blockLength
+        else:
+            for _ in range(count):
+                entry = read(buffer, position)
+                position += blockLength
+                nested = {} if entry is None else entry
+                for step in chain:
+                    position = step(buffer, position, nested)
+                    if position < 0:
+                        position = ~position
+                        entry = None
+                if entry is not None:
+                    entries.append(entry)
+        if self.filtering and not entries:
+            return ~position
+        if self.output:
+            record[self.name] = entries
+        return position
+
+class Projection:
+    # selective decode: only the named templates and fields are read, predicates are tested on raw values
+    # and messages that do not match are dropped before the rest of them is read
+    def __init__(self, schema: Union[Schema, SchemaLayout], fields: Iterable[str] = (), templateIds: Optional[Iterable[int]] = None, where: Optional[dict] = None) -> None:
+        self.layout = schemaLayout(schema)
+        self.prefix = byteOrderPrefix(self.layout.byteOrder)
+        header = self.layout.header
+        self.headerLength = header.blockLength
+        self._headerStruct = header.struct
+        self._templateIdIndex = header.index('templateId')
+        self._blockLengthIndex = header.index('blockLength')
+
+        requests = {}
+        for templateId in templateIds or ():
+            if templateId not in self.layout.messages:
+                raise Exception(f'unknown templateId {templateId}')
+            requests[templateId] = Request()
+        for path in fields:
+            messageName, rest = self._split(path)
+            message = self.layout.messagesByName[messageName]
+            request = requests.setdefault(message.id, Request())
+            if not self._select(message, request, rest):
+                raise Exception(f'field {path} not found')
+        if not requests:
+            requests = {templateId: Request() for templateId in self.layout.messages}
+        for request in requests.values():
+            if not request.output:
+                request.all = True
+
+        self.tables = LookupTables(self.layout) if where else None
+        for path, test in (where or {}).items():
+            # a predicate qualified by a message name constrains that message only, a bare field name
+            # keeps just the templates whose field can hold the value
+            messageName, rest = self._split(path)
+            found = False
+            errors = []
+            for templateId, request in list(requests.items()):
+                message = self.layout.messages[templateId]
+                if messageName is not None and message.name != messageName:
+                    continue
+                try:
+                    applies = self._condition(message, request, rest, test)
+                except Exception as error:
+                    # e.g. an enum name that only the enum of another template's field knows
+                    errors.append(error)
+                    applies = False
+                if applies:
+                    found = True
+                elif messageName is None:
+                    del requests[templateId]
+            if not found:
+                if errors:
+                    raise errors[0]
+                raise Exception(f'predicate field {path} not found in selected templates')
+
+        self.messages = {templateId: BlockProjection(self.layout.messages[templateId], request, self.prefix) for templateId, request in requests.items()}
+        self.templateIds = np.array(sorted(self.messages), dtype=np.uint16)
+
+    def __str__(self) -> str:
+        return f'Projection(templateIds={self.templateIds.tolist()})'
+
+    def _split(self, path: str) -> tuple:
+        parts = path.split('.')
+        if parts[0] in self.layout.messagesByName:
+            return parts[0], parts[1:]
+        return None, parts
+
+    def _select(self, block: BlockLayout, request: Request, parts: list) -> bool:
+        if not parts:
+            request.all = True
+            return True
+        name = parts[0]
+        for group in getattr(block, 'groups', ()):
+            if group.name == name:
+                return self._select(group, request.group(name), parts[1:])
+        for data in getattr(block, 'data', ()):
+            if data.name == name and len(parts) == 1:
+                request.data.add(name)
+                return True
+        field = block.field(name)
+        if field is None:
+            return False
+        if not field.isConstant:
+            request.paths.append(tuple(parts))
+        return True
+
+    def _condition(self, block: BlockLayout, request: Request, parts: list, test) -> bool:
+        # qualified paths descend through groups, a bare field name is looked up in the block then its groups
+        leaf = block.leaf(tuple(parts))
+        if leaf is not None:
+            request.tests.append((leaf.path, self._test(leaf, test)))
+            return True
+        for group in getattr(block, 'groups', ()):
+            if group.name == parts[0] and len(parts) > 1:
+                return self._condition(group, request.group(group.name), parts[1:], test)
+        if len(parts) == 1:
+            for group in getattr(block, 'groups', ()):
+                if self._find(group, parts[0]):
+                    return self._condition(group, request.group(group.name), parts, test)
+        return False
+
+    def _test(self, leaf: Leaf, test):
+        # test values are coerced per leaf since a bare field name may resolve to fields of different types
+        if callable(test):
+            return test
+        if isinstance(test, (set, frozenset, list, tuple)):
+            return frozenset(rawValue(leaf, value, self.tables) for value in test)
+        return rawValue(leaf, test, self.tables)
+
+    def _find(self, block: BlockLayout, name: str) -> bool:
+        return block.leaf((name,)) is not None or any(self._find(group, name) for group in block.groups)
+
+    def decode(self, buffer, offset: int = 0) -> Optional[dict]:
+        # projected record of the message at offset, None when it is not selected or does not match
+        header = self._headerStruct.unpack_from(buffer, offset)
+        projection = self.messages.get(header[self._templateIdIndex])
+        if projection is None:
+            return None
+        start = offset + self.headerLength
+        record = projection.read(buffer, start)
+        if record is None:
+            return None
+        if projection.needed:
+            position = start + header[self._blockLengthIndex]
+            for step in projection.chain[:projection.needed]:
+                position = step(buffer, position, record)
+                if position < 0:
+                    return None
+        return record
+
+    def scan(self, buffer, offsets: Iterable[int]) -> Iterator[tuple]:
+        # (offset, record) of every matching message at the given header offsets
+        decode = self.decode
+        for offset in offsets:
+            record = decode(buffer, offset)
+            if record is not None:
+                yield offset, record
+
+    def capture(self, reader, start: int = 0, stop: Optional[int] = None) -> Iterator[tuple]:
+        # (position, templateId, record) of matching messages of a capture; other templates are
+        # dropped by the frame index without touching the mapped file
+        index = reader.index[start:stop]
+        positions = np.flatnonzero(np.isin(index['templateId'], self.templateIds))
+        buffer = reader.buffer
+        decode = self.decode
+        templateIds = index['templateId'][positions].tolist()
+        for position, templateId, offset in zip(positions.tolist(), templateIds, index['offset'][positions].tolist()):
+            record = decode(buffer, offset)
+            if record is not None:
+                yield start + position, templateId, record
@@ -0,0 +1,137 @@
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Union
+from app.schema import Schema
+from app.layout import SchemaLayout, schemaLayout
+from app.lookup import LookupTables
+from app.text import TextCache, decodeText
+from app.decoder import Compiler, Flyweight, compileTail
+from app import artifact
+
+DEFAULT_CACHE_SIZE = 1024
+
+class SchemaRegistry:
+    # schemas keyed by (schemaId, version), messages are dispatched by the schemaId and version of their header;
+    # flyweights are compiled per template on first use into one LRU cache shared by all schemas, so
+    # templates that are never received cost nothing
+    def __init__(self, maxsize: int = DEFAULT_CACHE_SIZE, enums: bool = False, text: Union[bool, TextCache, None] = None) -> None:
+        self.maxsize = maxsize
+        self.enums = enums
+        self.text = text
+        self.schemas = {}
+        self._versions = {}
+        self._compilers = {}
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.header = None
+        self.headerLength = 0
+        self._headerStruct = None
+
+    def __str__(self) -> str:
+        return f'SchemaRegistry(schemas={len(self.schemas)}, cached={len(self._cache)}, maxsize={self.maxsize}, hits={self.hits}, misses={self.misses}, evictions={self.evictions})'
+
+    def register(self, schema: Union[Schema, SchemaLayout, str]) -> SchemaLayout:
+        # a path is loaded through the compiled artifact cache
+        layout = artifact.load(schema) if isinstance(schema, str) else schemaLayout(schema)
+        key = (layout.schema.id, layout.schema.version)
+        if key in self.schemas:
+            raise Exception(f'schema {key[0]} version {key[1]} already registered')
+        if self.header is None:
+            self.header = layout.header
+            self.headerLength = layout.header.blockLength
+            self._headerStruct = layout.header.struct
+            self._templateIdIndex = layout.header.index('templateId')
+            self._schemaIdIndex = layout.header.index('schemaId')
+            self._versionIndex = layout.header.index('version')
+            self._blockLengthIndex = layout.header.index('blockLength')
+        elif layout.header.format != self.header.format:
+            # dispatch reads the header before the schema is known, so all schemas share its layout
+            raise Exception(f'header of schema {key[0]} version {key[1]} differs from the registered schemas')
+        self.schemas[key] = layout
+        self._versions[key[0]] = sorted(self._versions.get(key[0], []) + [key[1]])
+        # acting versions cached so far may resolve to the new schema now
+        self._invalidate(key[0])
+        return layout
+
+    def unregister(self, schemaId: int, version: int) -> None:
+        self.schemas.pop((schemaId, version))
+        self._compilers.pop((schemaId, version), None)
+        self._versions[schemaId].remove(version)
+        self._invalidate(schemaId)
+        if not self.schemas:
+            # the next registered schema may bring another header
+            self.header = None
+            self.headerLength = 0
+            self._headerStruct = None
+
+    def _invalidate(self, schemaId: int) -> None:
+        # cache keys are acting versions: entries that no longer resolve to the schema they were compiled
+        # from are dropped
+        versions = self._versions.get(schemaId)
+        for key, entry in list(self._cache.items()):
+            if key[0] != schemaId:
+                continue
+            if not versions or entry[2] != (schemaId, self.resolve(schemaId, key[1]).schema.version):
+                del self._cache[key]
+
+    def resolve(self, schemaId: int, version: int) -> SchemaLayout:
+        # registered schema for messages of the given acting version: the same version, else the oldest newer one
+        # (older messages decode through versioned layouts), else the newest (newer blocks are skipped by blockLength)
+        versions = self._versions.get(schemaId)
+        if not versions:
+            raise Exception(f'unknown schemaId {schemaId}')
+        for candidate in versions:
+            if candidate >= version:
+                return self.schemas[(schemaId, candidate)]
+        return self.schemas[(schemaId, versions[-1])]
+
+    def _compiler(self, layout: SchemaLayout) -> Compiler:
+        key = (layout.schema.id, layout.schema.version)
+        compiler = self._compilers.get(key)
+        if compiler is None:
+            tables = LookupTables(layout) if self.enums else None
+            convert = self.text if isinstance(self.text, TextCache) else decodeText if self.text else None
+            compiler = self._compilers[key] = Compiler(layout, tables, convert)
+        return compiler
+
+    def _entry(self, schemaId: int, version: int, templateId: int) -> tuple:
+        key = (schemaId, version, templateId)
+        entry = self._cache.get(key)
+        if entry is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        layout = self.resolve(schemaId, version)
+        if templateId not in layout.messages:
+            raise Exception(f'unknown templateId {templateId} (schemaId: {schemaId}, version: {version})')
+        message = layout.messages[templateId] if version >= layout.schema.version else layout.versioned(templateId, version)
+        entry = self._compiler(layout).compileMessage(message)(), compileTail(message), (schemaId, layout.schema.version)
+        self._cache[key] = entry
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def flyweight(self, schemaId: int, version: int, templateId: int) -> Flyweight:
+        return self._entry(schemaId, version, templateId)[0]
+
+    def decode(self, buffer, offset: int = 0) -> Flyweight:
+        # flyweights are shared per (schemaId, version, templateId) and rewrapped by the next decode call
+        header = self._headerStruct.unpack_from(buffer, offset)
+        flyweight = self._entry(header[self._schemaIdIndex], header[self._versionIndex], header[self._templateIdIndex])[0]
+        return flyweight.wrap(buffer, offset + self.headerLength, header[self._blockLengthIndex])
+
+    def skip(self, buffer, offset: int = 0) -> int:
+        header = self._headerStruct.unpack_from(buffer, offset)
+        tail = self._entry(header[self._schemaIdIndex], header[self._versionIndex], header[self._templateIdIndex])[1]
+        return tail(buffer, offset + self.headerLength + header[self._blockLengthIndex])
+
+    def schema(self, buffer, offset: int = 0) -> SchemaLayout:
+        header = self._headerStruct.unpack_from(buffer, offset)
+        return self.resolve(header[self._schemaIdIndex], header[self._versionIndex])
+
+    def clear(self) -> None:
+        self._cache.clear()
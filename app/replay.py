@@ -0,0 +1,220 @@
+from __future__ import annotations
+import argparse
+import bisect
+import json
+import os
+import socket
+import time
+from typing import Callable, Optional
+import numpy as np
+from app.schema import Schema
+from app.capture import CaptureReader, PACKET_HEADER, MESSAGE_HEADER
+from app.transport import SOFH, sofhEncodingType, packetOffsets
+from app.metrics import Histogram
+
+# packets whose send times fall within the batch window go out together; the last part of every wait
+# is spent spinning on the clock since sleep overshoots by tens of microseconds
+DEFAULT_BATCH_WINDOW = 50000
+DEFAULT_MAX_BATCH = 64
+DEFAULT_SPIN = 200000
+DEFAULT_SEND_BUFFER = 1 << 22
+DEFAULT_IOV_MAX = 1024
+
+def packetRanges(index: np.ndarray, packetHeader: bool = True) -> tuple:
+    # byte ranges of the captured packets: consecutive index rows belong to one packet while their frames
+    # are contiguous; returns starts, ends, timestamps and message counts
+    offsets = index['offset'].astype(np.int64)
+    ends = offsets + index['length'].astype(np.int64)
+    first = np.ones(len(offsets), dtype=bool)
+    first[1:] = offsets[1:] != ends[:-1] + MESSAGE_HEADER.size
+    firsts = np.flatnonzero(first)
+    lasts = np.append(firsts[1:], len(offsets)) - 1
+    starts = offsets[firsts] - MESSAGE_HEADER.size - (PACKET_HEADER.size if packetHeader else 0)
+    return starts, ends[lasts], index['timestamp'][firsts].astype(np.int64), lasts - firsts + 1
+
+def iovMax() -> int:
+    try:
+        value = os.sysconf('SC_IOV_MAX')
+    except (AttributeError, ValueError, OSError):
+        value = -1
+    return value if value > 0 else DEFAULT_IOV_MAX
+
+class CallbackSink:
+    # in process consumer: callback(packet) for every packet, e.g. Router.dispatchPacket
+    def __init__(self, callback: Callable) -> None:
+        self.callback = callback
+
+    def __str__(self) -> str:
+        return f'CallbackSink({self.callback})'
+
+    def send(self, packets: list) -> None:
+        callback = self.callback
+        for packet in packets:
+            callback(packet)
+
+    def close(self) -> None:
+        pass
+
+class DatagramSink:
+    # one datagram per packet as captured (packet header and size prefixed messages); Python has no
+    # sendmmsg, so a batch is a tight loop of send calls on a connected socket
+    def __init__(self, host: str, port: int, sendBuffer: int = DEFAULT_SEND_BUFFER, ttl: int = 1) -> None:
+        self.address = (host, port)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sendBuffer)
+        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.socket.connect(self.address)
+
+    def __str__(self) -> str:
+        return f'DatagramSink(address={self.address[0]}:{self.address[1]})'
+
+    def send(self, packets: list) -> None:
+        send = self.socket.send
+        for packet in packets:
+            send(packet)
+
+    def close(self) -> None:
+        self.socket.close()
+
+class StreamSink:
+    # every message of the batch SOFH framed and written with one gathering sendmsg call
+    def __init__(self, host: str, port: int, encodingType: int, packetHeader: bool = True) -> None:
+        self.address = (host, port)
+        self.encodingType = encodingType
+        self.skip = PACKET_HEADER.size if packetHeader else 0
+        # one sendmsg takes at most IOV_MAX buffers, a batch of many messages goes out in several calls
+        self.maxParts = iovMax()
+        self.socket = socket.create_connection(self.address)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def __str__(self) -> str:
+        return f'StreamSink(address={self.address[0]}:{self.address[1]})'
+
+    def send(self, packets: list) -> None:
+        parts = []
+        pack = SOFH.pack
+        for packet in packets:
+            for offset in packetOffsets(packet, self.skip, len(packet)):
+                size, = MESSAGE_HEADER.unpack_from(packet, offset - MESSAGE_HEADER.size)
+                message = packet[offset:offset + size - MESSAGE_HEADER.size]
+                parts.append(pack(len(message) + SOFH.size, self.encodingType))
+                parts.append(message)
+        sendmsg = self.socket.sendmsg
+        maxParts = self.maxParts
+        position = 0
+        while position < len(parts):
+            sent = sendmsg(parts[position:position + maxParts])
+            # skip what went out, a partially sent part is resumed from its remainder
+            while sent and sent >= len(parts[position]):
+                sent -= len(parts[position])
+                position += 1
+            if sent:
+                parts[position] = memoryview(parts[position])[sent:]
+
+    def close(self) -> None:
+        self.socket.close()
+
+class Replayer:
+    # re-emits captured packets paced by their timestamps (SendingTime of the packet header, else the
+    # timeField of the reader) divided by speed; speed None sends as fast as possible
+    def __init__(self, reader: CaptureReader, sink, speed: Optional[float] = 1.0, start: int = 0, stop: Optional[int] = None,
+                 batchWindow: int = DEFAULT_BATCH_WINDOW, maxBatch: int = DEFAULT_MAX_BATCH, spin: int = DEFAULT_SPIN) -> None:
+        if speed is not None and speed <= 0:
+            raise Exception(f'speed {speed} must be positive')
+        self.reader = reader
+        self.sink = sink
+        self.speed = speed
+        self.batchWindow = batchWindow
+        self.maxBatch = maxBatch
+        self.spin = spin
+        self.starts, self.ends, self.timestamps, self.counts = packetRanges(reader.index[start:stop], reader.packetHeader)
+        self.lateness = Histogram()
+
+    def __str__(self) -> str:
+        return f'Replayer(packets={len(self.starts)}, speed={self.speed}, sink={self.sink})'
+
+    def deadlines(self) -> Optional[list]:
+        # send time of every packet in ns from the start of the replay
+        if self.speed is None or not len(self.timestamps):
+            return None
+        return ((self.timestamps - self.timestamps[0]) / self.speed).astype(np.int64).tolist()
+
+    def run(self) -> dict:
+        buffer = self.reader.buffer
+        starts = self.starts.tolist()
+        ends = self.ends.tolist()
+        deadlines = self.deadlines()
+        send = self.sink.send
+        record = self.lateness.record
+        clock = time.perf_counter_ns
+        sleep = time.sleep
+        window = self.batchWindow
+        maxBatch = self.maxBatch
+        spin = self.spin
+        count = len(starts)
+        batches = 0
+        position = 0
+        begin = clock()
+
+        while position < count:
+            stop = min(position + maxBatch, count)
+            if deadlines is not None:
+                deadline = deadlines[position]
+                stop = bisect.bisect_right(deadlines, deadline + window, position + 1, stop)
+                wait = deadline - (clock() - begin)
+                if wait > spin:
+                    sleep((wait - spin) / 1e9)
+                while clock() - begin < deadline:
+                    pass
+                record(clock() - begin - deadline)
+            send([buffer[start:end] for start, end in zip(starts[position:stop], ends[position:stop])])
+            batches += 1
+            position = stop
+        elapsed = (clock() - begin) / 1e9
+        return self.report(elapsed, batches)
+
+    def report(self, elapsed: float, batches: int) -> dict:
+        packets = len(self.starts)
+        messages = int(self.counts.sum())
+        target = None
+        if self.speed is not None and packets:
+            target = float(self.timestamps[-1] - self.timestamps[0]) / self.speed / 1e9
+        return {
+            'packets': packets,
+            'messages': messages,
+            'bytes': int((self.ends - self.starts).sum()),
+            'batches': batches,
+            'elapsed': elapsed,
+            'targetDuration': target,
+            'rate': {'packets': packets / elapsed if elapsed else None, 'messages': messages / elapsed if elapsed else None},
+            'targetRate': {'packets': packets / target, 'messages': messages / target} if target else None,
+            'latenessNs': self.lateness.summary()
+        }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m app.replay', description='replay an SBE capture to a UDP or TCP endpoint')
+    parser.add_argument('schema', help='path to SBE XML schema')
+    parser.add_argument('capture', help='path to capture file')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--udp', metavar='HOST:PORT', help='send every packet as one datagram')
+    target.add_argument('--tcp', metavar='HOST:PORT', help='send SOFH framed messages over one connection')
+    parser.add_argument('--speed', type=float, default=1.0, help='multiplier of the captured pace')
+    parser.add_argument('--fast', action='store_true', help='send as fast as possible')
+    parser.add_argument('--no-packet-header', action='store_true', help='capture records carry no MDP3 packet header')
+    args = parser.parse_args()
+
+    schema = Schema.loadFromFile(args.schema)
+    with CaptureReader(args.capture, schema, not args.no_packet_header) as reader:
+        host, _, port = (args.udp or args.tcp).rpartition(':')
+        if args.udp:
+            sink = DatagramSink(host, int(port))
+        else:
+            sink = StreamSink(host, int(port), sofhEncodingType(schema.byteOrder), reader.packetHeader)
+        try:
+            report = Replayer(reader, sink, None if args.fast else args.speed).run()
+        finally:
+            sink.close()
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
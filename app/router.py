@@ -0,0 +1,172 @@
+from __future__ import annotations
+from typing import Callable, Iterable, Optional, Union
+from app.schema import Schema
+from app.layout import SchemaLayout
+from app.decoder import Decoder
+from app.metrics import Metrics
+from app.capture import PACKET_HEADER, MESSAGE_HEADER
+
+class Router:
+    # dispatches messages to handlers through lists indexed by templateId; handlers get the shared
+    # flyweight of the template, batch handlers get the buffer and header offsets of a run of
+    # consecutive messages of their template (e.g. for Dtypes.decodeMessages); with metrics the handlers
+    # are wrapped when registered, so an uninstrumented router pays nothing
+    def __init__(self, schema: Union[Schema, SchemaLayout, None] = None, decoder: Optional[Decoder] = None, metrics: Optional[Metrics] = None) -> None:
+        if decoder is None:
+            if schema is None:
+                raise Exception('schema or decoder is required')
+            decoder = Decoder(schema)
+        self.decoder = decoder
+        self.layout = decoder.layout
+        self.metrics = metrics
+        size = max(self.layout.messages, default=-1) + 1
+        # entries are (flyweight, handler) so dispatch does a single list lookup
+        self._handlers = [None] * size
+        self._batchHandlers = [None] * size
+        self._size = size
+        header = self.layout.header
+        self._headerStruct = header.struct
+        self._headerLength = header.blockLength
+        self._templateIdIndex = header.index('templateId')
+        self._blockLengthIndex = header.index('blockLength')
+        self._versionIndex = header.index('version')
+        self._version = decoder.version
+        self.dispatched = 0
+        self.skipped = 0
+        self.unknown = 0
+
+    def __str__(self) -> str:
+        handled = sum(entry is not None for entry in self._handlers) + sum(entry is not None for entry in self._batchHandlers)
+        return f'Router(handlers={handled}, dispatched={self.dispatched}, skipped={self.skipped}, unknown={self.unknown})'
+
+    def _templateId(self, key: Union[int, str]) -> int:
+        if isinstance(key, str):
+            message = self.layout.messagesByName.get(key)
+            if message is None:
+                raise Exception(f'unknown message {key}')
+            return message.id
+        if key not in self.layout.messages:
+            raise Exception(f'unknown templateId {key}')
+        return key
+
+    def register(self, key: Union[int, str], handler: Callable, batch: bool = False) -> None:
+        # a template has either a message handler or a batch handler
+        templateId = self._templateId(key)
+        if self.metrics is not None:
+            handler = (self.metrics.instrumentBatch if batch else self.metrics.instrument)(templateId, handler)
+        if batch:
+            self._handlers[templateId] = None
+            self._batchHandlers[templateId] = handler
+        else:
+            self._batchHandlers[templateId] = None
+            self._handlers[templateId] = (self.decoder.flyweight(templateId), handler)
+
+    def unregister(self, key: Union[int, str]) -> None:
+        templateId = self._templateId(key)
+        self._handlers[templateId] = None
+        self._batchHandlers[templateId] = None
+
+    def handler(self, key: Union[int, str], batch: bool = False) -> Callable:
+        def register(function: Callable) -> Callable:
+            self.register(key, function, batch)
+            return function
+        return register
+
+    def dispatch(self, buffer, offset: int = 0) -> bool:
+        # calls the handler of the message at offset; True when it was handled
+        header = self._headerStruct.unpack_from(buffer, offset)
+        templateId = header[self._templateIdIndex]
+        entry = self._handlers[templateId] if templateId < self._size else None
+        if entry is None:
+            batchHandler = self._batchHandlers[templateId] if templateId < self._size else None
+            if batchHandler is not None:
+                self.dispatched += 1
+                batchHandler(buffer, [offset])
+                return True
+            self._miss(templateId)
+            return False
+        flyweight, handler = entry
+        if header[self._versionIndex] < self._version:
+            flyweight = self.decoder.flyweight(templateId, header[self._versionIndex])
+        self.dispatched += 1
+        handler(flyweight.wrap(buffer, offset + self._headerLength, header[self._blockLengthIndex]))
+        return True
+
+    def _miss(self, templateId: int) -> None:
+        if templateId in self.layout.messages:
+            self.skipped += 1
+        else:
+            self.unknown += 1
+        if self.metrics is not None:
+            self.metrics.miss(templateId)
+
+    def dispatchAll(self, buffer, offsets: Iterable[int]) -> int:
+        # dispatches messages at header offsets, runs of one template with a batch handler go in one call;
+        # returns the number of handled messages
+        headerStruct = self._headerStruct
+        headerLength = self._headerLength
+        templateIdIndex = self._templateIdIndex
+        blockLengthIndex = self._blockLengthIndex
+        versionIndex = self._versionIndex
+        version = self._version
+        handlers = self._handlers
+        batchHandlers = self._batchHandlers
+        size = self._size
+        handled = 0
+        runTemplateId = -1
+        run = []
+
+        for offset in offsets:
+            header = headerStruct.unpack_from(buffer, offset)
+            templateId = header[templateIdIndex]
+            if run and templateId != runTemplateId:
+                batchHandlers[runTemplateId](buffer, run)
+                handled += len(run)
+                run = []
+            if templateId >= size:
+                self._miss(templateId)
+                continue
+            entry = handlers[templateId]
+            if entry is not None:
+                flyweight, handler = entry
+                if header[versionIndex] < version:
+                    flyweight = self.decoder.flyweight(templateId, header[versionIndex])
+                handler(flyweight.wrap(buffer, offset + headerLength, header[blockLengthIndex]))
+                handled += 1
+            elif batchHandlers[templateId] is not None:
+                runTemplateId = templateId
+                run.append(offset)
+            else:
+                self._miss(templateId)
+        if run:
+            batchHandlers[runTemplateId](buffer, run)
+            handled += len(run)
+        self.dispatched += handled
+        return handled
+
+    def dispatchPacket(self, buffer, start: int = 0, end: Optional[int] = None, packetHeader: bool = True) -> int:
+        # MDP3 packet: optional packet header then messages prefixed with their uint16 size,
+        # so unhandled messages are stepped over without reading their header
+        end = len(buffer) if end is None else end
+        if packetHeader:
+            start += PACKET_HEADER.size
+        offsets = []
+        unpack = MESSAGE_HEADER.unpack_from
+        while start < end:
+            size, = unpack(buffer, start)
+            if size <= MESSAGE_HEADER.size:
+                raise Exception(f'invalid message size {size} at offset {start}')
+            offsets.append(start + MESSAGE_HEADER.size)
+            start += size
+        return self.dispatchAll(buffer, offsets)
+
+    def dispatchStream(self, buffer, offset: int = 0, end: Optional[int] = None) -> int:
+        # back to back messages without framing: message ends come from blockLength and group dimensions;
+        # returns the number of handled messages
+        end = len(buffer) if end is None else end
+        skip = self.decoder.skip
+        offsets = []
+        while offset < end:
+            offsets.append(offset)
+            offset = skip(buffer, offset)
+        return self.dispatchAll(buffer, offsets)
@@ -1,25 +1,10 @@
 from __future__ import annotations
 from enum import Enum
 from typing import Optional
+import time
 import xml.etree.ElementTree as ElementTree
 
-def openXMLAndStripNs(path: str) -> ElementTree.Element:
-    file = open(path, 'r', encoding='utf-8')
-    it = ElementTree.iterparse(file)
-
-    # strip namespace
-    for _, el in it:
-        _, _, el.tag = el.tag.rpartition('}')
-
-    return it.root
-
-def injectRootAttr(node: ElementTree.Element, root: ElementTree.Element):
-    for child in node:
-        child.attrib['__root__'] = root
-        injectRootAttr(child, root)
-
-def getDocumentRoot(node: ElementTree.Element) -> ElementTree.Element:
-    return node.attrib.get('__root__')
+HEADER_TYPE = 'messageHeader'
 
 class Presence(Enum):
     REQUIRED = 'required'
@@ -28,7 +13,7 @@ class Presence(Enum):
 
 class ByteOrder(Enum):
     LITTLE_ENDIAN = 'littleEndian'
-    BIG_ENDIAN = 'bitEndian'
+    BIG_ENDIAN = 'bigEndian'
 
 def cast(value: Optional[str], type) -> Optional[dest]:
     if value:
@@ -88,13 +73,6 @@ class Type:
             if self.valueRef is None:
                 if self._constValue is None:
                     raise Exception(f'type presence is "constant" but XML node has no data (type: "{self.name}")')
-            else:
-                name, value = self.valueRef.split('.')
-                node = getDocumentRoot(root).find(f'.//types/enum[@name="{name}"]')
-                if node is None:
-                    raise Exception(f'type {name} not found (type: "{self.name}")')
-                if Enum(node).hasValue(value) is None:
-                    raise Exception(f'value {value} is not exists in enum {name} (type: "{self.name}")')
 
         if self.nullValue is None:
             self.nullValue = self.primitiveType.nullValue
@@ -105,6 +83,15 @@ class Type:
         if self.maxValue is None:
             self.maxValue = self.primitiveType.maxValue
 
+    def resolve(self, types: dict) -> None:
+        if self.valueRef:
+            name, value = self.valueRef.split('.')
+            enum = types.get(name)
+            if not isinstance(enum, Enum):
+                raise Exception(f'type {name} not found (type: "{self.name}")')
+            if not enum.hasValue(value):
+                raise Exception(f'value {value} is not exists in enum {name} (type: "{self.name}")')
+
     def __str__(self) -> str:
         return f'Type(name="{self.name}", primitiveType={self.primitiveType.name}, encodedLength={self.encodedLength}, constValue={self._constValue})'
 
@@ -130,6 +117,10 @@ class Composite:
         self.deprecated = cast(root.attrib.get('deprecated', None), int)
         self.elements = Composite.loadElements(root)
 
+    def resolve(self, types: dict) -> None:
+        for element in self.elements:
+            element.resolve(types)
+
         # check valid offset
         offset = 0
         for element in self.elements:
@@ -162,10 +153,9 @@ class Composite:
         length = 0
 
         for element in self.elements:
-            if element.offset:
+            if element.offset is not None:
                 length = element.offset
-            if element.presence != Presence.CONSTANT:
-                length += element.encodedLength
+            length += element.encodedLength
 
         return length
 
@@ -177,20 +167,27 @@ class Enum:
         self.deprecated = cast(root.attrib.get('deprecated', None), int)
         self.offset = cast(root.attrib.get('offset', None), int)
         self.validValues = self.loadValidValues(root)
+        self._valuesByName = { entry['name']: entry for entry in self.validValues }
+        self.encodingTypeName = root.attrib.get('encodingType')
+        self.encodingType = None
+        self.nullValue = root.attrib.get('nullValue')
 
-        encodingTypeStr = root.attrib.get('encodingType')
-        if encodingTypeStr in [ 'char', 'int8', 'int16', 'int32', 'int64', 'uint8', 'uint16', 'uint32', 'uint64' ]:
-            self.encodingType = PrimitiveType.get(encodingTypeStr)
-        else:
-            node = getDocumentRoot(root).find(f'.//types/type[@name="{encodingTypeStr}"]')
-            if node is None:
-                raise Exception(f'type {encodingTypeStr} not found (enum: "{self.name}")')
-            type = Type(node)
-            if type.length != 1:
-                raise Exception(f'illegal encodingType "{encodingTypeStr}" (enum: "{self.name}")')
-            self.encodingType = type.primitiveType
-
-        self.nullValue =  root.attrib.get('nullValue', self.encodingType.nullValue)
+        if self.encodingTypeName in [ 'char', 'int8', 'int16', 'int32', 'int64', 'uint8', 'uint16', 'uint32', 'uint64' ]:
+            self.encodingType = PrimitiveType.get(self.encodingTypeName)
+            if self.nullValue is None:
+                self.nullValue = self.encodingType.nullValue
+
+    def resolve(self, types: dict) -> None:
+        if self.encodingType is not None:
+            return
+        type = types.get(self.encodingTypeName)
+        if not isinstance(type, Type):
+            raise Exception(f'type {self.encodingTypeName} not found (enum: "{self.name}")')
+        if type.length != 1:
+            raise Exception(f'illegal encodingType "{self.encodingTypeName}" (enum: "{self.name}")')
+        self.encodingType = type.primitiveType
+        if self.nullValue is None:
+            self.nullValue = self.encodingType.nullValue
 
     def __str__(self) -> str:
         return f'Enum(name="{self.name}", encodingType={self.encodingType.name}, encodedLength={self.encodedLength})'
@@ -209,7 +206,7 @@ class Enum:
         return result
 
     def hasValue(self, name: str) -> bool:
-        return len([entry for entry in self.validValues if entry['name'] == name]) > 0
+        return name in self._valuesByName
 
     @property
     def encodedLength(self) -> int:
@@ -223,18 +220,21 @@ class Set:
         self.deprecated = cast(root.attrib.get('deprecated', None), int)
         self.offset = cast(root.attrib.get('offset', None), int)
         self.choices = self.loadChoices(root)
-
-        encodingTypeStr = root.attrib.get('encodingType')
-        if encodingTypeStr in [ 'uint8', 'uint16', 'uint32', 'uint64' ]:
-            self.encodingType = PrimitiveType.get(encodingTypeStr)
-        else:
-            node = getDocumentRoot(root).find(f'.//types/type[@name="{encodingTypeStr}"]')
-            if node is None:
-                raise Exception(f'type {encodingTypeStr} not found (enum: "{self.name}")')
-            type = Type(node)
-            if type.length != 1:
-                raise Exception(f'illegal encodingType "{encodingTypeStr}" (enum: "{self.name}")')
-            self.encodingType = type.primitiveType
+        self.encodingTypeName = root.attrib.get('encodingType')
+        self.encodingType = None
+
+        if self.encodingTypeName in [ 'uint8', 'uint16', 'uint32', 'uint64' ]:
+            self.encodingType = PrimitiveType.get(self.encodingTypeName)
+
+    def resolve(self, types: dict) -> None:
+        if self.encodingType is not None:
+            return
+        type = types.get(self.encodingTypeName)
+        if not isinstance(type, Type):
+            raise Exception(f'type {self.encodingTypeName} not found (set: "{self.name}")')
+        if type.length != 1:
+            raise Exception(f'illegal encodingType "{self.encodingTypeName}" (set: "{self.name}")')
+        self.encodingType = type.primitiveType
 
     def __str__(self) -> str:
         return f'Set(name="{self.name}", encodingType={self.encodingType.name}, encodedLength={self.encodedLength})'
@@ -274,14 +274,20 @@ class Message:
     def loadElements(root: ElementTree.Element) -> list:
         result = []
         groupEncountered = False
+        dataEncountered = False
         for node in root:
             if node.tag == 'field':
-                if groupEncountered:
-                    raise Exception('field node specified after group node')
+                if groupEncountered or dataEncountered:
+                    raise Exception('field node specified after group or data node')
                 result.append(Field(node))
             elif node.tag == 'group':
+                if dataEncountered:
+                    raise Exception('group node specified after data node')
                 result.append(Group(node))
                 groupEncountered = True
+            elif node.tag == 'data':
+                result.append(Data(node))
+                dataEncountered = True
 
         uniqueNames = { element.name for element in result }
         if len(uniqueNames) != len(result):
@@ -308,12 +314,28 @@ class Field:
     def __str__(self) -> str:
         return f'Field(name="{self.name}", id={self.id}, type={self.type})'
 
+class Data:
+    def __init__(self, root: ElementTree.Element) -> None:
+        self.name = root.attrib.get('name')
+        self.id = int(root.attrib.get('id'))
+        self.description = root.attrib.get('description', None)
+        self.type = root.attrib.get('type')
+        self.semanticType = root.attrib.get('semanticType', None)
+        self.sinceVersion = int(root.attrib.get('sinceVersion', '0'))
+        self.deprecated = cast(root.attrib.get('deprecated', None), int)
+
+    def __str__(self) -> str:
+        return f'Data(name="{self.name}", id={self.id}, type={self.type})'
+
 class Group:
     def __init__(self, root: ElementTree.Element) -> None:
         self.name = root.attrib.get('name')
         self.id = int(root.attrib.get('id'))
         self.description = root.attrib.get('description', None)
         self.dimensionType = root.attrib.get('dimensionType', 'groupSizeEncoding')
+        self.blockLength = cast(root.attrib.get('blockLength', None), int)
+        self.sinceVersion = int(root.attrib.get('sinceVersion', '0'))
+        self.deprecated = cast(root.attrib.get('deprecated', None), int)
         self.elements = self.loadElements(root)
 
     def __str__(self) -> str:
@@ -323,14 +345,20 @@ class Group:
     def loadElements(root: ElementTree.Element) -> list:
         result = []
         groupEncountered = False
+        dataEncountered = False
         for node in root:
             if node.tag == 'field':
-                if groupEncountered:
-                    raise Exception('field node specified after group node')
+                if groupEncountered or dataEncountered:
+                    raise Exception('field node specified after group or data node')
                 result.append(Field(node))
             elif node.tag == 'group':
+                if dataEncountered:
+                    raise Exception('group node specified after data node')
                 result.append(Group(node))
                 groupEncountered = True
+            elif node.tag == 'data':
+                result.append(Data(node))
+                dataEncountered = True
 
         uniqueNames = { element.name for element in result }
         if len(uniqueNames) != len(result):
@@ -343,62 +371,93 @@ class Group:
         return result
 
 class Schema:
-    def __init__(self, root: ElementTree.Element) -> None:
-        # inject reference to root for each element in doc
-        injectRootAttr(root, root)
+    def __init__(self, attrib: dict) -> None:
+        self.package = attrib.get('package', None)
+        self.id = int(attrib.get('id', '0'))
+        self.version = int(attrib.get('version', '0'))
+        self.semanticVersion = attrib.get('semanticVersion', None)
+        self.description = attrib.get('description', None)
+        self.byteOrder = ByteOrder(attrib.get('byteOrder', 'littleEndian'))
+        self.headerType = attrib.get('headerType', HEADER_TYPE)
+        self.types = {}
+        self.messages = []
+        self.loadTimes = {}
 
-        self.types = self.loadTypes(root)
-        self.messages = self.loadMessages(root)
+    def __str__(self) -> str:
+        return f'Schema(package={self.package}, id={self.id}, version={self.version}, types={len(self.types)}, messages={len(self.messages)})'
 
     @staticmethod
     def loadFromFile(path: str) -> Schema:
-        root = openXMLAndStripNs(path)
-        return Schema(root)
+        with open(path, 'rb') as file:
+            return SchemaLoader(file).load()
+
+class SchemaLoader:
+    # parse phase: one streaming pass building the name -> definition symbol table
+    # resolve phase: cross references are looked up in that table
+    def __init__(self, source) -> None:
+        self.source = source
+
+    def load(self) -> Schema:
+        started = time.perf_counter()
+        schema = self.parse()
+        parsed = time.perf_counter()
+        self.resolve(schema)
+        resolved = time.perf_counter()
+        schema.loadTimes = {
+            'parse': parsed - started,
+            'resolve': resolved - parsed,
+            'total': resolved - started
+        }
+        return schema
+
+    def parse(self) -> Schema:
+        schema = None
+        messageNames = set()
+        path = []
+
+        for event, node in ElementTree.iterparse(self.source, events=('start', 'end')):
+            if event == 'start':
+                # strip namespace
+                _, _, node.tag = node.tag.rpartition('}')
+                if not path:
+                    schema = Schema(node.attrib)
+                path.append(node.tag)
+                continue
+
+            path.pop()
+            depth = len(path)
+            if depth == 2 and path[1] == 'types':
+                entry = self.parseType(node)
+                if entry is not None:
+                    if entry.name in schema.types:
+                        raise Exception(f'type {entry.name} already exists')
+                    schema.types[entry.name] = entry
+                node.clear()
+            elif depth == 1 and node.tag == 'message':
+                entry = Message(node)
+                if entry.name in messageNames:
+                    raise Exception(f'message {entry.name} already exists')
+                messageNames.add(entry.name)
+                schema.messages.append(entry)
+                node.clear()
+
+        if schema is None:
+            raise Exception('empty schema document')
+        return schema
 
     @staticmethod
-    def loadTypes(root: ElementTree.Element) -> dict:
-        result = {}
-
-        def insert(entry):
-            if entry.name in result:
-                raise Exception(f'type {entry.name} already exists')
-            result[entry.name] = entry
-
-
-        for node in root.findall('./types/type'):
-            entry = Type(node)
-            print(entry)
-            insert(entry)
-
-        for node in root.findall('./types/composite'):
-            entry = Composite(node)
-            print(entry)
-            insert(entry)
-
-        for node in root.findall('./types/enum'):
-            entry = Enum(node)
-            print(entry)
-            insert(entry)
-
-        for node in root.findall('./types/set'):
-            entry = Set(node)
-            print(entry)
-            insert(entry)
-
-        return result
+    def parseType(node: ElementTree.Element):
+        if node.tag == 'type':
+            return Type(node)
+        elif node.tag == 'composite':
+            return Composite(node)
+        elif node.tag == 'enum':
+            return Enum(node)
+        elif node.tag == 'set':
+            return Set(node)
+        return None
 
     @staticmethod
-    def loadMessages(root: ElementTree.Element) -> list:
-        result = {}
-
-        def insert(entry):
-            if entry.name in result:
-                raise Exception(f'message {entry.name} already exists')
-            result[entry.name] = entry
-
-        for node in root.findall('./message'):
-            entry = Message(node)
-            print(entry)
-            insert(entry)
-
-        return [*result.values()]
+    def resolve(schema: Schema) -> None:
+        for entry in schema.types.values():
+            entry.resolve(schema.types)
@@ -0,0 +1,146 @@
+from __future__ import annotations
+from typing import Callable, Optional
+from app.capture import PACKET_HEADER
+
+# packets of the MDP3 incremental feed start with the packet header (sequence number and sending time);
+# the sequencer delivers them in sequence order once, whichever of the A and B feeds brings them first
+DEFAULT_CAPACITY = 1024
+DEFAULT_SLOT_SIZE = 1500
+FEED_A, FEED_B = 0, 1
+
+class Sequencer:
+    # in sequence packets go to the handler straight from the caller's buffer; packets ahead of a gap are
+    # copied into slots of one preallocated ring until the gap is filled by the other feed, or declared
+    # lost once more than maxPending packets wait, which sets recoveryNeeded (snapshot recovery)
+    def __init__(self, handler: Callable, capacity: int = DEFAULT_CAPACITY, slotSize: int = DEFAULT_SLOT_SIZE,
+                 maxPending: Optional[int] = None, onRecovery: Optional[Callable] = None) -> None:
+        # handler(packet, sequence, sendingTime) gets a memoryview only valid during the call;
+        # onRecovery(first, last) gets the range of lost sequence numbers
+        self.handler = handler
+        self.onRecovery = onRecovery
+        self.capacity = capacity
+        self.slotSize = slotSize
+        self.maxPending = capacity - 1 if maxPending is None else min(maxPending, capacity - 1)
+        self._buffer = bytearray(capacity * slotSize)
+        self._view = memoryview(self._buffer)
+        self._sequences = [-1] * capacity
+        self._lengths = [0] * capacity
+        self.expected = None
+        self.pending = 0
+        self.recoveryNeeded = False
+        self.received = [0, 0]
+        self.delivered = 0
+        self.duplicates = 0
+        self.outOfOrder = 0
+        self.lost = 0
+        self.recoveries = 0
+
+    def __str__(self) -> str:
+        return f'Sequencer(expected={self.expected}, pending={self.pending}, delivered={self.delivered}, duplicates={self.duplicates}, lost={self.lost})'
+
+    def reset(self, sequence: Optional[int] = None) -> None:
+        # drops buffered packets; the next packet (or the given sequence) becomes the expected one
+        self._sequences = [-1] * self.capacity
+        self.pending = 0
+        self.expected = sequence
+
+    def recovered(self, sequence: Optional[int] = None) -> None:
+        # called once the snapshot recovery is done, optionally with the first incremental sequence to apply
+        self.recoveryNeeded = False
+        if sequence is not None and (self.expected is None or sequence > self.expected):
+            self._skipTo(sequence)
+
+    def push(self, packet, feed: int = FEED_A) -> None:
+        self.received[feed] += 1
+        sequence, sendingTime = PACKET_HEADER.unpack_from(packet, 0)
+        expected = self.expected
+        if expected is None:
+            expected = self.expected = sequence
+        if sequence < expected:
+            self.duplicates += 1
+            return
+        while sequence - self.expected >= self.capacity:
+            # too far ahead for the ring: open gaps are given up one at a time so that buffered packets are
+            # still delivered, what remains out of reach of the ring is skipped once nothing is buffered
+            if self.pending:
+                self._declareLost()
+            else:
+                self._declareLost(sequence - self.capacity + 1)
+        if sequence == self.expected:
+            self._deliver(packet, sequence, sendingTime)
+            return
+        self._store(packet, sequence)
+        if self.pending > self.maxPending:
+            self._declareLost()
+
+    def _deliver(self, packet, sequence: int, sendingTime: int) -> None:
+        self.handler(packet if isinstance(packet, memoryview) else memoryview(packet), sequence, sendingTime)
+        self.delivered += 1
+        self.expected = sequence + 1
+        if self.pending:
+            self._drain()
+
+    def _store(self, packet, sequence: int) -> None:
+        slot = sequence % self.capacity
+        if self._sequences[slot] == sequence:
+            self.duplicates += 1
+            return
+        length = len(packet)
+        if length > self.slotSize:
+            raise Exception(f'packet size {length} exceeds slot size {self.slotSize} (sequence: {sequence})')
+        start = slot * self.slotSize
+        self._buffer[start:start + length] = packet
+        self._sequences[slot] = sequence
+        self._lengths[slot] = length
+        self.pending += 1
+        self.outOfOrder += 1
+
+    def _drain(self) -> None:
+        # delivers buffered packets that follow on from the expected sequence
+        sequences = self._sequences
+        capacity = self.capacity
+        slotSize = self.slotSize
+        view = self._view
+        while self.pending:
+            slot = self.expected % capacity
+            if sequences[slot] != self.expected:
+                return
+            start = slot * slotSize
+            packet = view[start:start + self._lengths[slot]]
+            sequence, sendingTime = PACKET_HEADER.unpack_from(packet, 0)
+            sequences[slot] = -1
+            self.pending -= 1
+            self.expected = sequence + 1
+            self.handler(packet, sequence, sendingTime)
+            self.delivered += 1
+
+    def _skipTo(self, sequence: int) -> None:
+        # moves expected forward, buffered packets below sequence are dropped
+        for slot, buffered in enumerate(self._sequences):
+            if 0 <= buffered < sequence:
+                self._sequences[slot] = -1
+                self.pending -= 1
+        self.expected = sequence
+        self._drain()
+
+    def _declareLost(self, until: Optional[int] = None) -> None:
+        # the gap at expected is given up: lost sequence numbers are skipped up to the next buffered packet
+        # (or until), the remaining buffered packets are delivered and recovery is requested
+        if until is None:
+            buffered = [sequence for sequence in self._sequences if sequence >= self.expected]
+            until = min(buffered) if buffered else self.expected
+        first = self.expected
+        lost = until - first
+        if lost <= 0:
+            return
+        self.lost += lost
+        self.recoveries += 1
+        self.recoveryNeeded = True
+        if self.onRecovery is not None:
+            self.onRecovery(first, until - 1)
+        self._skipTo(until)
+
+    def flush(self) -> None:
+        # gives up every open gap, e.g. from a timer when the other feed can not fill it any more
+        while self.pending:
+            self._declareLost()
@@ -0,0 +1,36 @@
+from __future__ import annotations
+import functools
+
+DEFAULT_CACHE_SIZE = 4096
+
+def decodeText(raw) -> str:
+    # char arrays are padded with nulls, the value ends at the first one
+    raw = bytes(raw)
+    end = raw.find(0)
+    if end >= 0:
+        raw = raw[:end]
+    return raw.decode('latin-1')
+
+class TextCache:
+    # bounded LRU from raw bytes to a shared str, repeated symbols decode to the same object
+    def __init__(self, maxsize: int = DEFAULT_CACHE_SIZE) -> None:
+        self.maxsize = maxsize
+        self._decode = functools.lru_cache(maxsize)(decodeText)
+
+    def __call__(self, raw) -> str:
+        return self._decode(bytes(raw))
+
+    def __str__(self) -> str:
+        info = self._decode.cache_info()
+        return f'TextCache(size={info.currsize}, maxsize={self.maxsize}, hits={info.hits}, misses={info.misses})'
+
+    @property
+    def hits(self) -> int:
+        return self._decode.cache_info().hits
+
+    @property
+    def misses(self) -> int:
+        return self._decode.cache_info().misses
+
+    def clear(self) -> None:
+        self._decode.cache_clear()
@@ -0,0 +1,224 @@
+from __future__ import annotations
+import asyncio
+import socket
+import struct
+from typing import Iterator, Optional
+from app.schema import ByteOrder
+from app.capture import PACKET_HEADER, MESSAGE_HEADER
+
+# Simple Open Framing Header: big endian uint32 frame length (including the header itself)
+# and uint16 encoding type, followed by one SBE message
+SOFH = struct.Struct('>IH')
+SOFH_SBE_LITTLE_ENDIAN = 0xEB50
+SOFH_SBE_BIG_ENDIAN = 0x5BE0
+
+DEFAULT_QUEUE_SIZE = 1024
+DEFAULT_READ_SIZE = 1 << 16
+
+def sofhEncodingType(byteOrder: ByteOrder) -> int:
+    return SOFH_SBE_BIG_ENDIAN if byteOrder == ByteOrder.BIG_ENDIAN else SOFH_SBE_LITTLE_ENDIAN
+
+def frame(message, encodingType: int = SOFH_SBE_LITTLE_ENDIAN) -> bytes:
+    # one SBE message (header and body) framed for a stream transport
+    return SOFH.pack(len(message) + SOFH.size, encodingType) + bytes(message)
+
+class Batch:
+    # messages received together (one datagram or one stream read), decoded lazily on iteration;
+    # yielded flyweights are shared per template so each is valid until the next one is decoded
+    __slots__ = ('buffer', 'offsets', 'sequence', 'sendingTime', '_decode')
+
+    def __init__(self, buffer, offsets: list, decoder, sequence: int = 0, sendingTime: int = 0) -> None:
+        self.buffer = buffer
+        self.offsets = offsets
+        self.sequence = sequence
+        self.sendingTime = sendingTime
+        self._decode = decoder.decode
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __iter__(self) -> Iterator:
+        decode = self._decode
+        buffer = self.buffer
+        for offset in self.offsets:
+            yield decode(buffer, offset)
+
+    def __str__(self) -> str:
+        return f'Batch(sequence={self.sequence}, messages={len(self.offsets)}, size={len(self.buffer)})'
+
+def packetOffsets(data, start: int, end: int) -> list:
+    # offsets of the SBE headers of messages prefixed with uint16 size that includes the size field
+    offsets = []
+    unpack = MESSAGE_HEADER.unpack_from
+    while start < end:
+        size, = unpack(data, start)
+        if size <= MESSAGE_HEADER.size or start + size > end:
+            raise Exception(f'invalid message size {size} at offset {start}')
+        offsets.append(start + MESSAGE_HEADER.size)
+        start += size
+    return offsets
+
+class _Receiver:
+    # bounded queue of batches consumed with async for; None marks the end of the stream
+    def __init__(self, decoder, maxsize: int) -> None:
+        self.decoder = decoder
+        self.queue = asyncio.Queue(maxsize)
+        self.received = 0
+        self.messages = 0
+        self.exception = None
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Batch:
+        if self._closed and self.queue.empty():
+            raise StopAsyncIteration
+        batch = await self.queue.get()
+        if batch is None:
+            self._closed = True
+            if self.exception is not None:
+                raise self.exception
+            raise StopAsyncIteration
+        return batch
+
+    def _finish(self, exception: Optional[BaseException]) -> None:
+        if exception is not None and self.exception is None:
+            self.exception = exception
+        # the end marker must not be lost even when consumers are behind
+        while True:
+            try:
+                self.queue.put_nowait(None)
+                return
+            except asyncio.QueueFull:
+                self.queue.get_nowait()
+
+class DatagramReceiver(_Receiver, asyncio.DatagramProtocol):
+    # UDP can not push back on the sender, so packets arriving to a full queue are dropped and counted;
+    # the packet sequence numbers let consumers detect the loss
+    def __init__(self, decoder, maxsize: int = DEFAULT_QUEUE_SIZE, packetHeader: bool = True) -> None:
+        super().__init__(decoder, maxsize)
+        self.packetHeader = packetHeader
+        self.dropped = 0
+        self.invalid = 0
+        self.transport = None
+
+    def __str__(self) -> str:
+        return f'DatagramReceiver(received={self.received}, messages={self.messages}, dropped={self.dropped}, invalid={self.invalid}, queued={self.queue.qsize()})'
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self.received += 1
+        if self.queue.full():
+            self.dropped += 1
+            return
+        sequence = sendingTime = 0
+        start = 0
+        try:
+            # a datagram shorter than the packet header is as invalid as one with broken message sizes
+            if self.packetHeader:
+                sequence, sendingTime = PACKET_HEADER.unpack_from(data, 0)
+                start = PACKET_HEADER.size
+            offsets = packetOffsets(data, start, len(data))
+        except Exception:
+            self.invalid += 1
+            return
+        self.messages += len(offsets)
+        self.queue.put_nowait(Batch(data, offsets, self.decoder, sequence, sendingTime))
+
+    def error_received(self, exception: Exception) -> None:
+        self.exception = exception
+
+    def connection_lost(self, exception: Optional[Exception]) -> None:
+        self._finish(exception)
+
+    def close(self) -> None:
+        if self.transport is not None:
+            self.transport.close()
+
+class StreamReceiver(_Receiver):
+    # reads SOFH framed messages; everything complete in one read becomes one batch, and a full queue
+    # stops reading so TCP flow control slows the sender down
+    def __init__(self, reader: asyncio.StreamReader, decoder, maxsize: int = DEFAULT_QUEUE_SIZE, readSize: int = DEFAULT_READ_SIZE) -> None:
+        super().__init__(decoder, maxsize)
+        self.reader = reader
+        self.readSize = readSize
+        self.encodingType = sofhEncodingType(decoder.layout.byteOrder)
+        self._task = None
+
+    def __str__(self) -> str:
+        return f'StreamReceiver(received={self.received}, messages={self.messages}, queued={self.queue.qsize()})'
+
+    def start(self) -> StreamReceiver:
+        self._task = asyncio.ensure_future(self.run())
+        return self
+
+    async def run(self) -> None:
+        pending = bytearray()
+        try:
+            while True:
+                chunk = await self.reader.read(self.readSize)
+                if not chunk:
+                    if pending:
+                        raise Exception(f'stream closed inside a frame ({len(pending)} bytes pending)')
+                    break
+                self.received += len(chunk)
+                pending += chunk
+                consumed, offsets = self._split(pending)
+                if offsets:
+                    self.messages += len(offsets)
+                    await self.queue.put(Batch(bytes(pending[:consumed]), offsets, self.decoder))
+                    del pending[:consumed]
+        except asyncio.CancelledError:
+            self._finish(None)
+            raise
+        except Exception as error:
+            self.exception = error
+        # batches already queued are delivered before the end marker
+        await self.queue.put(None)
+
+    def _split(self, pending: bytearray) -> tuple:
+        # offsets of complete frames' SBE headers and the length of the complete part
+        offsets = []
+        position = 0
+        size = len(pending)
+        unpack = SOFH.unpack_from
+        while position + SOFH.size <= size:
+            length, encodingType = unpack(pending, position)
+            if length <= SOFH.size or encodingType != self.encodingType:
+                raise Exception(f'invalid SOFH frame (length: {length}, encodingType: {encodingType:#x})')
+            if position + length > size:
+                break
+            offsets.append(position + SOFH.size)
+            position += length
+        return position, offsets
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+async def openDatagramReceiver(decoder, host: str, port: int, group: Optional[str] = None, interface: str = '0.0.0.0', maxsize: int = DEFAULT_QUEUE_SIZE, packetHeader: bool = True, receiveBuffer: Optional[int] = None) -> DatagramReceiver:
+    # binds a UDP socket, joining the multicast group when one is given
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if receiveBuffer is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receiveBuffer)
+    sock.bind((group or host, port))
+    if group is not None:
+        membership = socket.inet_aton(group) + socket.inet_aton(interface)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+    sock.setblocking(False)
+    loop = asyncio.get_running_loop()
+    _, protocol = await loop.create_datagram_endpoint(lambda: DatagramReceiver(decoder, maxsize, packetHeader), sock=sock)
+    return protocol
+
+async def openStreamReceiver(decoder, host: str, port: int, maxsize: int = DEFAULT_QUEUE_SIZE, readSize: int = DEFAULT_READ_SIZE) -> tuple:
+    # connects to a SOFH stream and starts reading; returns the receiver and the writer of the connection
+    reader, writer = await asyncio.open_connection(host, port)
+    return StreamReceiver(reader, decoder, maxsize, readSize).start(), writer
@@ -0,0 +1,38 @@
+from __future__ import annotations
+import os
+import pytest
+from app import artifact
+from app.artifact import ARTIFACT_HEADER
+
+SCHEMA = 'resources/FixBinary.xml'
+
+def artifactOf(cacheDir: str) -> str:
+    return artifact.artifactPath(SCHEMA, artifact.sourceDigest(SCHEMA), cacheDir)
+
+def testLoadWritesAndReusesArtifact(tmp_path) -> None:
+    layout = artifact.load(SCHEMA, cacheDir=str(tmp_path))
+    path = artifactOf(str(tmp_path))
+    assert os.path.exists(path)
+    cached = artifact.load(SCHEMA, cacheDir=str(tmp_path))
+    assert sorted(cached.messages) == sorted(layout.messages)
+    assert cached.messages[46].format == layout.messages[46].format
+
+@pytest.mark.parametrize('size', [0, ARTIFACT_HEADER.size - 1, ARTIFACT_HEADER.size, ARTIFACT_HEADER.size + 100, -1])
+def testDamagedArtifactIsRebuilt(tmp_path, size: int) -> None:
+    artifact.load(SCHEMA, cacheDir=str(tmp_path))
+    path = artifactOf(str(tmp_path))
+    with open(path, 'r+b') as file:
+        file.truncate(size if size >= 0 else os.path.getsize(path) - 1)
+    assert artifact.read(path) is None
+    layout = artifact.load(SCHEMA, cacheDir=str(tmp_path))
+    assert 46 in layout.messages
+    assert artifact.read(path) is not None
+
+def testCorruptPayloadIsRebuilt(tmp_path) -> None:
+    artifact.load(SCHEMA, cacheDir=str(tmp_path))
+    path = artifactOf(str(tmp_path))
+    with open(path, 'r+b') as file:
+        file.seek(ARTIFACT_HEADER.size)
+        file.write(b'\x00garbage')
+    assert artifact.read(path) is None
+    assert 46 in artifact.load(SCHEMA, cacheDir=str(tmp_path)).messages
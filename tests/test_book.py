@@ -0,0 +1,57 @@
+from __future__ import annotations
+from app.schema import Schema
+from app.encoder import Encoder
+from app.book import BookBuilder, BID, OFFER
+
+SCHEMA = Schema.loadFromFile('resources/FixBinary.xml')
+END_OF_EVENT = 0x80
+
+def incremental(entries: list, matchEventIndicator: int = END_OF_EVENT) -> bytes:
+    # entries of (price, size, securityId, rptSeq, orders, level, action, type)
+    buffer = bytearray(1024)
+    message = Encoder(SCHEMA).wrap(46, buffer)
+    message.TransactTime = 1
+    message.MatchEventIndicator = matchEventIndicator
+    group = message.NoMDEntries.begin(len(entries))
+    for entry in entries:
+        group.next().pack(*entry)
+    message.NoOrderIDEntries.begin(0)
+    return bytes(buffer[:message.encodedLength])
+
+def snapshot(securityId: int, rptSeq: int, entries: list) -> bytes:
+    # entries of (price, size, orders, level, type)
+    buffer = bytearray(1024)
+    message = Encoder(SCHEMA).wrap(52, buffer)
+    message.LastMsgSeqNumProcessed = 1
+    message.TotNumReports = 1
+    message.SecurityID = securityId
+    message.RptSeq = rptSeq
+    group = message.NoMDEntries.begin(len(entries))
+    for price, size, orders, level, type in entries:
+        group.next().pack(price, size, orders, level, 0, 255, 0, type)
+    return bytes(buffer[:message.encodedLength])
+
+def build() -> tuple:
+    builder = BookBuilder(SCHEMA, depth=5)
+    events = []
+    builder.addListener(lambda books: events.append([book.securityId for book in books]))
+    return builder, events
+
+def testEventsPublishOnEndOfEvent() -> None:
+    builder, events = build()
+    builder.apply(incremental([(100, 5, 1, 1, 1, 1, 0, b'0')], 0))
+    assert events == []
+    builder.apply(incremental([(101, 6, 1, 2, 1, 1, 0, b'1')]))
+    assert len(events) == 1
+    book = builder.books[1]
+    assert book.side(BID)[0].tolist()[0] == 100
+    assert book.side(OFFER)[0].tolist()[0] == 101
+
+def testSnapshotMidEventPublishesOnlyItsBook() -> None:
+    builder, events = build()
+    # an event for security 2 is under way when the snapshot of security 1 arrives
+    builder.apply(incremental([(200, 1, 2, 1, 1, 1, 0, b'0')], 0))
+    builder.apply(snapshot(1, 10, [(90, 1, 1, 1, b'0')]))
+    assert events == [[1]]
+    builder.apply(incremental([(201, 1, 2, 2, 1, 2, 0, b'0')]))
+    assert events == [[1], [2]]
@@ -0,0 +1,86 @@
+from __future__ import annotations
+import os
+import pytest
+from app.schema import Schema
+from app.encoder import Encoder
+from app.decoder import Decoder
+from app.capture import CaptureWriter, CaptureReader
+
+SCHEMA = Schema.loadFromFile('resources/FixBinary.xml')
+
+def book(transactTime: int) -> bytes:
+    buffer = bytearray(256)
+    message = Encoder(SCHEMA).wrap(46, buffer)
+    message.TransactTime = transactTime
+    message.NoMDEntries.begin(0)
+    message.NoOrderIDEntries.begin(0)
+    return bytes(buffer[:message.encodedLength])
+
+def heartbeat() -> bytes:
+    buffer = bytearray(64)
+    return bytes(buffer[:Encoder(SCHEMA).wrap(12, buffer).encodedLength])
+
+def write(path: str, packets: list, packetHeader: bool = True, append: bool = False) -> None:
+    # packets of (sequence, sendingTime, messages)
+    with CaptureWriter(path, packetHeader, append) as writer:
+        for sequence, sendingTime, messages in packets:
+            writer.writePacket(messages, sequence, sendingTime)
+
+def testIndexAndFrames(tmp_path) -> None:
+    path = str(tmp_path / 'capture.bin')
+    write(path, [(1, 10, [book(1), heartbeat()]), (2, 20, [book(2)])])
+    with CaptureReader(path, SCHEMA) as reader:
+        assert len(reader) == 3
+        assert reader.index['templateId'].tolist() == [46, 12, 46]
+        assert reader.index['sequence'].tolist() == [1, 1, 2]
+        assert reader.index['timestamp'].tolist() == [10, 10, 20]
+        assert bytes(reader.frame(2)) == book(2)
+        assert [message.TransactTime for message in reader.messages(Decoder(SCHEMA), 0, 1)] == [1]
+        assert reader.seekSequence(2) == 2
+        assert reader.seekSequence(3) == -1
+        assert reader.seekTime(15) == 2
+    assert os.path.exists(path + '.idx')
+
+def testAppendedTailIsIndexed(tmp_path) -> None:
+    path = str(tmp_path / 'capture.bin')
+    write(path, [(1, 10, [book(1)])])
+    with CaptureReader(path, SCHEMA) as reader:
+        assert len(reader) == 1
+    write(path, [(2, 20, [book(2)])], append=True)
+    with CaptureReader(path, SCHEMA) as reader:
+        assert reader.index['sequence'].tolist() == [1, 2]
+
+def testReplacedCaptureIsIndexedAgain(tmp_path) -> None:
+    path = str(tmp_path / 'capture.bin')
+    write(path, [(1, 10, [book(1)])])
+    with CaptureReader(path, SCHEMA) as reader:
+        assert len(reader) == 1
+    write(path, [(7, 70, [book(7), heartbeat()]), (8, 80, [book(8)])])
+    with CaptureReader(path, SCHEMA) as reader:
+        assert reader.index['sequence'].tolist() == [7, 7, 8]
+
+@pytest.mark.parametrize('sequences', [
+    [1, 2, 5, 6, 9],
+    [1, 3, 2, 4, 3, 5],
+    [10, 11, 12, 1, 2, 3]
+])
+def testSeekSequenceOnGappedCaptures(tmp_path, sequences: list) -> None:
+    # gaps, interleaved A/B packets arriving out of order and a sequence reset
+    path = str(tmp_path / 'capture.bin')
+    write(path, [(sequence, position, [book(position)]) for position, sequence in enumerate(sequences)])
+    with CaptureReader(path, SCHEMA) as reader:
+        for sequence in range(max(sequences) + 2):
+            expected = sequences.index(sequence) if sequence in sequences else -1
+            assert reader.seekSequence(sequence) == expected
+
+def testTimestampsWithoutPacketHeader(tmp_path) -> None:
+    # templates without the time field carry the previous timestamp, also across an appended tail
+    path = str(tmp_path / 'capture.bin')
+    write(path, [(0, 0, [book(100), heartbeat(), book(200)]), (0, 0, [heartbeat()])], packetHeader=False)
+    with CaptureReader(path, SCHEMA, packetHeader=False) as reader:
+        assert reader.index['timestamp'].tolist() == [100, 100, 200, 200]
+        assert reader.index['sequence'].tolist() == [0, 1, 2, 3]
+    write(path, [(0, 0, [heartbeat(), book(300)])], packetHeader=False, append=True)
+    with CaptureReader(path, SCHEMA, packetHeader=False) as reader:
+        assert reader.index['timestamp'].tolist() == [100, 100, 200, 200, 200, 300]
+        assert reader.seekTime(250) == 5
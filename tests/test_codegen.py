@@ -0,0 +1,43 @@
+from __future__ import annotations
+import os
+import shutil
+import pytest
+from app.schema import Schema
+from app.layout import SchemaLayout
+from app.bench.generator import Generator
+from app import codegen
+
+SCHEMA = 'resources/FixBinary.xml'
+LAYOUT = SchemaLayout(Schema.loadFromFile(SCHEMA))
+
+@pytest.fixture(scope='module')
+def module(tmp_path_factory):
+    return codegen.load(SCHEMA, str(tmp_path_factory.mktemp('codegen')))
+
+@pytest.mark.parametrize('templateId', sorted(LAYOUT.messages))
+def testRoundTrip(module, templateId: int) -> None:
+    # generated decode then encode reproduces the wire bytes of every template
+    generator = Generator(LAYOUT, seed=templateId, maxGroupSize=3)
+    for _ in range(10):
+        buffer = bytearray(1 << 14)
+        length = generator.encode(generator.sample(templateId), buffer)
+        message, end = module.decode(buffer)
+        assert end == length
+        output = bytearray(1 << 14)
+        assert module.encode(message, output) == length
+        assert output[:length] == buffer[:length]
+
+def testModuleIsCachedPerSchemaDigest(tmp_path) -> None:
+    cacheDir = str(tmp_path / 'cache')
+    first = codegen.load(SCHEMA, cacheDir)
+    files = os.listdir(cacheDir)
+    assert codegen.load(SCHEMA, cacheDir) is first
+    assert os.listdir(cacheDir) == files
+
+    # another schema text gets another module
+    changed = str(tmp_path / 'changed.xml')
+    shutil.copy(SCHEMA, changed)
+    with open(changed, 'a') as file:
+        file.write('\n')
+    assert codegen.load(changed, cacheDir) is not first
+    assert len(os.listdir(cacheDir)) == len(files) + 1
@@ -0,0 +1,77 @@
+from __future__ import annotations
+import numpy as np
+import pytest
+from app.schema import Schema
+from app.decoder import Decoder
+from app.columnar import ColumnEncoder
+from app.capture import MESSAGE_HEADER
+from app.transport import SOFH, SOFH_SBE_LITTLE_ENDIAN
+
+SCHEMA = Schema.loadFromFile('tests/resources/versioned.xml')
+FIX_BINARY = Schema.loadFromFile('resources/FixBinary.xml')
+INT64_NULL = -2**63
+UINT32_NULL = 2**32 - 1
+
+COLUMNS = {'Id': np.array([1, 2, 3]), 'Px.mantissa': np.array([100, 200, 300]), 'Note': [b'first', b'', b'third']}
+GROUPS = {'Order.Legs': {'_parent': [0, 0, 2], 'LegId': [10, 11, 12], 'LegPx.mantissa': [5, 6, 7]}}
+
+def messages(buffer, offsets, schema: Schema = SCHEMA):
+    # the decoder reuses its flyweight, so each message is read before the next one is decoded
+    decoder = Decoder(schema)
+    for offset in offsets:
+        yield decoder.decode(buffer, int(offset))
+
+def values(buffer, offsets) -> list:
+    return [(message.Id, message.Px.mantissa, [(leg.LegId, leg.LegPx.mantissa) for leg in message.Legs], bytes(message.Note)) for message in messages(buffer, offsets)]
+
+def testRoundTripThroughDecoder() -> None:
+    buffer, offsets = ColumnEncoder(SCHEMA).encode('Order', COLUMNS, GROUPS)
+    assert values(buffer, offsets) == [(1, 100, [(10, 5), (11, 6)], b'first'), (2, 200, [], b''), (3, 300, [(12, 7)], b'third')]
+
+def testSizeFraming() -> None:
+    buffer, offsets = ColumnEncoder(SCHEMA).encode('Order', COLUMNS, GROUPS)
+    decoder = Decoder(SCHEMA)
+    ends = [int(offset) for offset in offsets[1:]] + [len(buffer) + MESSAGE_HEADER.size]
+    for offset, end in zip(offsets, ends):
+        size, = MESSAGE_HEADER.unpack_from(buffer, int(offset) - MESSAGE_HEADER.size)
+        assert size == end - int(offset)
+        assert decoder.skip(buffer, int(offset)) == end - MESSAGE_HEADER.size
+
+def testSofhFraming() -> None:
+    buffer, offsets = ColumnEncoder(SCHEMA).encode('Order', COLUMNS, GROUPS, framing='sofh')
+    position = 0
+    for offset in offsets:
+        length, encodingType = SOFH.unpack_from(buffer, position)
+        assert encodingType == SOFH_SBE_LITTLE_ENDIAN
+        assert int(offset) == position + SOFH.size
+        position += length
+    assert position == len(buffer)
+
+def testNoFraming() -> None:
+    buffer, offsets = ColumnEncoder(SCHEMA).encode('Order', COLUMNS, GROUPS, framing='none')
+    decoder = Decoder(SCHEMA)
+    assert offsets[0] == 0
+    assert [decoder.skip(buffer, int(offset)) for offset in offsets] == [int(offset) for offset in offsets[1:]] + [len(buffer)]
+
+def testMissingColumnsAreNull() -> None:
+    buffer, offsets = ColumnEncoder(SCHEMA).encode('Order', {'Id': [4, 5]})
+    assert values(buffer, offsets) == [(4, INT64_NULL, [], b''), (5, INT64_NULL, [], b'')]
+
+def testCountWithoutColumns() -> None:
+    buffer, offsets = ColumnEncoder(SCHEMA).encode('Order', {}, count=2)
+    assert values(buffer, offsets) == [(UINT32_NULL, INT64_NULL, [], b'')] * 2
+
+def testFixBinaryGroups() -> None:
+    entries = {'_parent': [0, 0, 1], 'MDEntryPx.mantissa': [10, 20, 30], 'MDEntrySize': [1, 2, 3], 'SecurityID': [5, 5, 6], 'RptSeq': [1, 2, 3], 'MDEntryType': [b'0', b'1', b'0']}
+    buffer, offsets = ColumnEncoder(FIX_BINARY).encode(46, {'TransactTime': [7, 8], 'MatchEventIndicator': [128, 128]}, {'NoMDEntries': entries})
+    decoded = [(message.TransactTime, [(entry.MDEntryPx.mantissa, entry.SecurityID, entry.RptSeq) for entry in message.NoMDEntries], len(message.NoOrderIDEntries)) for message in messages(buffer, offsets, FIX_BINARY)]
+    assert decoded == [(7, [(10, 5, 1), (20, 5, 2)], 0), (8, [(30, 6, 3)], 0)]
+
+def testErrors() -> None:
+    encoder = ColumnEncoder(SCHEMA)
+    with pytest.raises(Exception, match='unknown framing'):
+        encoder.encode('Order', COLUMNS, framing='fix')
+    with pytest.raises(Exception, match='unknown message'):
+        encoder.encode('Missing', COLUMNS)
+    with pytest.raises(Exception, match='different lengths'):
+        encoder.encode('Order', {'Id': [1, 2], 'Note': [b'']})
@@ -0,0 +1,105 @@
+from __future__ import annotations
+import math
+import struct
+import pytest
+from app.schema import Schema
+from app.layout import SchemaLayout, BlockLayout, isCharArray, primitiveOf
+from app.decoder import Decoder
+from app.bench.generator import Generator
+
+LAYOUT = SchemaLayout(Schema.loadFromFile('resources/FixBinary.xml'))
+FLOAT = struct.Struct('<f')
+
+def expectedValues(block: BlockLayout, values: tuple) -> list:
+    # sample values as the decoder reads them: padded char arrays, tuples for arrays, float32 precision
+    result = []
+    position = 0
+    for leaf in block.leaves:
+        if isCharArray(leaf.element):
+            result.append(values[position].ljust(leaf.element.length, b'\x00'))
+            position += 1
+            continue
+        items = list(values[position:position + leaf.count])
+        position += leaf.count
+        if primitiveOf(leaf.element) == 'float':
+            items = [FLOAT.unpack(FLOAT.pack(item))[0] for item in items]
+        result.append(items[0] if leaf.count == 1 else tuple(items))
+    return result
+
+def decodedValues(flyweight, block: BlockLayout) -> list:
+    result = []
+    for leaf in block.leaves:
+        value = flyweight
+        for name in leaf.path:
+            value = getattr(value, name)
+        result.append(bytes(value) if isinstance(value, memoryview) else value)
+    return result
+
+def same(left, right) -> bool:
+    if isinstance(left, float) and isinstance(right, float):
+        return left == right or math.isnan(left) and math.isnan(right)
+    if isinstance(left, tuple):
+        return len(left) == len(right) and all(same(a, b) for a, b in zip(left, right))
+    return left == right
+
+def checkEntry(flyweight, block: BlockLayout, entry: tuple) -> None:
+    values, groups, data = entry
+    for expected, decoded, leaf in zip(expectedValues(block, values), decodedValues(flyweight, block), block.leaves):
+        assert same(expected, decoded), (block.name, leaf.path, expected, decoded)
+    for group, entries in zip(block.groups, groups):
+        cursor = getattr(flyweight, group.name)
+        assert len(cursor) == len(entries)
+        for decoded, expected in zip(cursor, entries):
+            checkEntry(decoded, group, expected)
+    for item, expected in zip(block.data, data):
+        assert bytes(getattr(flyweight, item.name)) == expected
+
+@pytest.mark.parametrize('templateId', sorted(LAYOUT.messages))
+def testRoundTrip(templateId: int) -> None:
+    generator = Generator(LAYOUT, seed=templateId, maxGroupSize=3)
+    decoder = Decoder(LAYOUT)
+    buffer = bytearray(1 << 16)
+    for _ in range(20):
+        sample = generator.sample(templateId)
+        length = generator.encode(sample, buffer)
+        flyweight = decoder.decode(buffer)
+        assert type(flyweight).templateId == templateId
+        checkEntry(flyweight, LAYOUT.messages[templateId], (sample.values, sample.groups, sample.data))
+        assert flyweight.end == length
+        assert decoder.skip(buffer) == length
+
+def testSkipsConsecutiveMessages() -> None:
+    generator = Generator(LAYOUT, seed=1)
+    decoder = Decoder(LAYOUT)
+    buffer = bytearray(1 << 18)
+    ends = []
+    offset = 0
+    for sample in generator.samples(50):
+        offset += generator.encode(sample, buffer, offset)
+        ends.append(offset)
+    offset = 0
+    for end in ends:
+        offset = decoder.skip(buffer, offset)
+        assert offset == end
+
+def testUnknownTemplate() -> None:
+    buffer = bytearray(64)
+    struct.pack_into('<HHHH', buffer, 0, 0, 999, 1, 9)
+    with pytest.raises(Exception):
+        Decoder(LAYOUT).decode(buffer)
+
+def testNewerSenderBlockIsSkipped() -> None:
+    # a newer sender appends fields to the root block, the header blockLength covers them
+    generator = Generator(LAYOUT, seed=2)
+    decoder = Decoder(LAYOUT)
+    message = LAYOUT.messages[46]
+    sample = generator.sample(46)
+    buffer = bytearray(4096)
+    length = generator.encode(sample, buffer)
+    headerLength = LAYOUT.header.blockLength
+    split = headerLength + message.blockLength
+    newer = bytearray(buffer[:split] + b'\xff' * 4 + buffer[split:length])
+    struct.pack_into('<HHHH', newer, 0, message.blockLength + 4, 46, 1, LAYOUT.schema.version + 1)
+    flyweight = decoder.decode(newer)
+    checkEntry(flyweight, message, (sample.values, sample.groups, sample.data))
+    assert decoder.skip(newer) == len(newer)
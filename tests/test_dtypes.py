@@ -0,0 +1,90 @@
+from __future__ import annotations
+import math
+import numpy as np
+import pytest
+from app.schema import Schema
+from app.layout import SchemaLayout, BlockLayout
+from app.decoder import Decoder
+from app.dtypes import Dtypes, view, gather, scatter, expand
+from app.bench.generator import Generator
+
+LAYOUT = SchemaLayout(Schema.loadFromFile('resources/FixBinary.xml'))
+DTYPES = Dtypes(LAYOUT)
+
+def normalize(value):
+    # numpy drops trailing NULs of bytes and returns arrays, the decoder returns raw slices and tuples
+    if isinstance(value, memoryview):
+        value = bytes(value)
+    if isinstance(value, (bytes, np.bytes_)):
+        return bytes(value).rstrip(b'\x00')
+    if isinstance(value, (tuple, np.ndarray)):
+        return tuple(normalize(item) for item in value)
+    if isinstance(value, (float, np.floating)) and math.isnan(value):
+        return 'nan'
+    return value.item() if isinstance(value, np.generic) else value
+
+def compare(row, flyweight, block: BlockLayout) -> None:
+    for leaf in block.leaves:
+        record = row
+        value = flyweight
+        for name in leaf.path:
+            record = record[name]
+            value = getattr(value, name)
+        assert normalize(record) == normalize(value), (block.name, leaf.path)
+
+def encode(templateId: int, count: int) -> tuple:
+    generator = Generator(LAYOUT, seed=templateId, maxGroupSize=3)
+    buffer = bytearray(1 << 18)
+    offsets = []
+    position = 0
+    for _ in range(count):
+        offsets.append(position)
+        position += generator.encode(generator.sample(templateId), buffer, position)
+    return buffer, offsets
+
+@pytest.mark.parametrize('templateId', sorted(LAYOUT.messages))
+def testDecodeMessagesMatchesDecoder(templateId: int) -> None:
+    buffer, offsets = encode(templateId, 16)
+    rows = DTYPES.decodeMessages(buffer, offsets, templateId)
+    assert len(rows) == len(offsets)
+    assert rows.dtype.itemsize == LAYOUT.messages[templateId].blockLength
+    decoder = Decoder(LAYOUT)
+    for row, offset in zip(rows, offsets):
+        compare(row, decoder.decode(buffer, offset), LAYOUT.messages[templateId])
+
+def testDecodeGroupsMatchesDecoder() -> None:
+    message = LAYOUT.messages[46]
+    group = message.groups[0]
+    buffer, offsets = encode(46, 16)
+    decoder = Decoder(LAYOUT)
+    starts, counts, entries = [], [], []
+    for offset in offsets:
+        cursor = getattr(decoder.decode(buffer, offset), group.name)
+        starts.append(offset + LAYOUT.header.blockLength + message.blockLength + group.dimension.blockLength)
+        counts.append(len(cursor))
+        entries.extend([normalize(getattr(entry, leaf.path[0])) for leaf in group.leaves if len(leaf.path) == 1] for entry in cursor)
+    rows = DTYPES.decodeGroups(buffer, starts, counts, 46, group.name)
+    assert len(rows) == sum(counts)
+    assert [[normalize(row[leaf.path[0]]) for leaf in group.leaves if len(leaf.path) == 1] for row in rows] == entries
+
+def testViewAndExpand() -> None:
+    dtype = np.dtype('<u4')
+    buffer = np.arange(8, dtype=dtype).tobytes()
+    assert view(buffer, 4, 3, dtype).tolist() == [1, 2, 3]
+    assert view(buffer, 0, 4, dtype, 8).tolist() == [0, 2, 4, 6]
+    assert expand([0, 100], [2, 3], 4).tolist() == [0, 4, 100, 104, 108]
+    assert expand([0, 100], [2, 1], [4, 8]).tolist() == [0, 4, 100]
+
+def testByName() -> None:
+    assert DTYPES.message('MDIncrementalRefreshBook46') is DTYPES.message(46)
+    assert DTYPES.group('MDIncrementalRefreshBook46', 'NoMDEntries') is DTYPES.group(46, 'NoMDEntries')
+
+def testScatterGatherRoundTrip() -> None:
+    buffer, offsets = encode(46, 8)
+    starts = [offset + LAYOUT.header.blockLength for offset in offsets]
+    rows = gather(buffer, starts, DTYPES.message(46))
+    copy = bytearray(len(buffer))
+    scatter(copy, starts, rows)
+    assert np.array_equal(gather(copy, starts, DTYPES.message(46)), rows)
+    for start in starts:
+        assert copy[start:start + rows.dtype.itemsize] == buffer[start:start + rows.dtype.itemsize]
@@ -0,0 +1,48 @@
+from __future__ import annotations
+import pytest
+from app.schema import Schema
+from app.encoder import Encoder
+from app.decoder import Decoder
+
+SCHEMA = Schema.loadFromFile('resources/FixBinary.xml')
+
+def testFieldsGroupsAndData() -> None:
+    buffer = bytearray(512)
+    message = Encoder(SCHEMA).wrap(46, buffer, 8)
+    message.TransactTime = 123
+    entries = message.NoMDEntries.begin(2)
+    for number in range(2):
+        entry = entries.next()
+        entry.MDEntryPx.mantissa = 100 + number
+        entry.SecurityID = 7
+        entry.RptSeq = number
+        entry.MDEntryType = b'0'
+    message.NoOrderIDEntries.begin(0)
+    decoded = Decoder(SCHEMA).decode(buffer, 8)
+    assert decoded.TransactTime == 123
+    assert [(entry.MDEntryPx.mantissa, entry.SecurityID, entry.RptSeq, entry.MDEntryType) for entry in decoded.NoMDEntries] == [(100, 7, 0, b'0'), (101, 7, 1, b'0')]
+    assert len(decoded.NoOrderIDEntries) == 0
+    assert decoded.end == 8 + message.encodedLength
+
+def testGroupEntriesBeyondCount() -> None:
+    message = Encoder(SCHEMA).wrap(46, bytearray(512))
+    entries = message.NoMDEntries.begin(1)
+    entries.next()
+    with pytest.raises(Exception):
+        entries.next()
+
+@pytest.mark.parametrize('buffer', [bytearray(4), bytearray(7), memoryview(bytearray(4))])
+def testShortBufferIsNotResized(buffer) -> None:
+    size = len(buffer)
+    with pytest.raises(Exception):
+        Encoder(SCHEMA).wrap(12, buffer, 0)
+    assert len(buffer) == size
+
+def testShortBufferForData() -> None:
+    schema = Schema.loadFromFile('tests/resources/versioned.xml')
+    buffer = bytearray(32)
+    message = Encoder(schema).wrap(1, buffer)
+    message.Legs.begin(0)
+    with pytest.raises(Exception):
+        message.Note.put(b'x' * 32)
+    assert len(buffer) == 32
@@ -0,0 +1,63 @@
+from __future__ import annotations
+import pytest
+from app.schema import Schema
+from app.encoder import Encoder
+from app.projection import Projection
+
+SCHEMA = Schema.loadFromFile('resources/FixBinary.xml')
+
+def definition(securityGroup: bytes, matchAlgorithm: bytes, securityId: int) -> bytearray:
+    buffer = bytearray(1024)
+    message = Encoder(SCHEMA).wrap(27, buffer)
+    message.SecurityGroup = securityGroup
+    message.MatchAlgorithm = matchAlgorithm
+    message.SecurityID = securityId
+    message.SecurityUpdateAction = b'A'
+    for group in ('NoEvents', 'NoMDFeedTypes', 'NoInstAttrib', 'NoLotTypeRules'):
+        getattr(message, group).begin(0)
+    return buffer
+
+def matches(buffer, where: dict) -> bool:
+    return Projection(SCHEMA, ['MDInstrumentDefinitionFuture27.SecurityID'], where=where).decode(buffer) is not None
+
+@pytest.mark.parametrize('where, expected', [
+    ({'SecurityGroup': 'ES'}, True),
+    ({'SecurityGroup': b'ES'}, True),
+    ({'SecurityGroup': 'NQ'}, False),
+    ({'SecurityGroup': {'NQ', b'ES'}}, True),
+    ({'MatchAlgorithm': 'F'}, True),
+    ({'MatchAlgorithm': b'F'}, True),
+    ({'MatchAlgorithm': 'K'}, False),
+    ({'SecurityID': 7}, True),
+    ({'SecurityID': '7'}, True),
+    ({'SecurityID': 8}, False),
+    ({'SecurityUpdateAction': 'Add'}, True),
+    ({'SecurityUpdateAction': 'Delete'}, False)
+])
+def testEquality(where: dict, expected: bool) -> None:
+    assert matches(definition(b'ES', b'F', 7), where) is expected
+
+@pytest.mark.parametrize('where', [
+    {'SecurityGroup': 'ESESESE'},
+    {'SecurityGroup': 7},
+    {'MatchAlgorithm': 70},
+    {'MatchAlgorithm': 'FF'},
+    {'SecurityID': 'ES'},
+    {'SecurityID': b'7'},
+    {'SecurityID': 2 ** 40}
+])
+def testRejectsValuesOfOtherTypes(where: dict) -> None:
+    with pytest.raises(Exception):
+        Projection(SCHEMA, templateIds=[27], where=where)
+
+def testBareFieldDropsTemplatesWithoutIt() -> None:
+    projection = Projection(SCHEMA, where={'SecurityGroup': 'ES'})
+    assert 27 in projection.messages
+    assert 46 not in projection.messages
+
+def testEnumNameKnownToSomeTemplates() -> None:
+    # only some MDEntryType enums have a SettlementPrice member
+    projection = Projection(SCHEMA, where={'MDEntryType': 'SettlementPrice'})
+    assert projection.messages
+    with pytest.raises(Exception):
+        Projection(SCHEMA, where={'MDEntryType': 'Unknown'})
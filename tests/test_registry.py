@@ -0,0 +1,56 @@
+from __future__ import annotations
+import struct
+from app.schema import Schema
+from app.encoder import Encoder
+from app.registry import SchemaRegistry
+
+def fixBinary(version: int) -> Schema:
+    schema = Schema.loadFromFile('resources/FixBinary.xml')
+    schema.version = version
+    return schema
+
+def book(actingVersion: int) -> bytes:
+    buffer = bytearray(256)
+    message = Encoder(fixBinary(9)).wrap(46, buffer)
+    message.TransactTime = 42
+    message.NoMDEntries.begin(0)
+    message.NoOrderIDEntries.begin(0)
+    struct.pack_into('<H', buffer, 6, actingVersion)
+    return bytes(buffer[:message.encodedLength])
+
+def testResolve() -> None:
+    registry = SchemaRegistry()
+    for version in (7, 9):
+        registry.register(fixBinary(version))
+    assert registry.resolve(1, 5).schema.version == 7
+    assert registry.resolve(1, 8).schema.version == 9
+    assert registry.resolve(1, 12).schema.version == 9
+    assert registry.decode(book(9)).TransactTime == 42
+    assert registry.skip(book(9)) == len(book(9))
+
+def testRegisterInvalidatesResolvedEntries() -> None:
+    registry = SchemaRegistry()
+    registry.register(fixBinary(9))
+    buffer = book(10)
+    assert registry.decode(buffer).TransactTime == 42
+    registry.unregister(1, 9)
+    assert registry.header is None
+    registry.register(fixBinary(8))
+    registry.decode(buffer)
+    assert registry.misses == 2
+    assert registry.schema(buffer).schema.version == 8
+
+def testCompilerStateBoundedUnderEviction() -> None:
+    # every miss of an older acting version used to build new layouts that the compiler cached forever
+    registry = SchemaRegistry(maxsize=2)
+    registry.register(fixBinary(9))
+    buffers = [book(version) for version in range(3, 8)]
+    for buffer in buffers:
+        registry.decode(buffer)
+    compiler = registry._compilers[(1, 9)]
+    sizes = len(compiler._formats), len(compiler._compositeClasses)
+    for _ in range(100):
+        for buffer in buffers:
+            assert registry.decode(buffer).TransactTime == 42
+    assert registry.evictions >= 400
+    assert (len(compiler._formats), len(compiler._compositeClasses)) == sizes
@@ -0,0 +1,50 @@
+from __future__ import annotations
+import socket
+import threading
+from app.capture import PACKET_HEADER, MESSAGE_HEADER
+from app.transport import SOFH
+from app.replay import StreamSink, CallbackSink
+
+ENCODING_TYPE = 0xEB50
+
+def packet(sequence: int, messages: list) -> bytes:
+    parts = [PACKET_HEADER.pack(sequence, sequence * 1000)]
+    for message in messages:
+        parts.append(MESSAGE_HEADER.pack(len(message) + MESSAGE_HEADER.size) + message)
+    return b''.join(parts)
+
+def framed(messages: list) -> bytes:
+    return b''.join(SOFH.pack(len(message) + SOFH.size, ENCODING_TYPE) + message for message in messages)
+
+def receiveAll(server: socket.socket, received: list) -> None:
+    connection, _ = server.accept()
+    with connection:
+        while True:
+            chunk = connection.recv(1 << 16)
+            if not chunk:
+                break
+            received.append(chunk)
+
+def testStreamSinkSendsBatchesBeyondIovMax() -> None:
+    # 64 packets of 20 messages need 2560 buffers, more than one sendmsg takes
+    messages = [[bytes([sequence % 256, index]) * 40 for index in range(20)] for sequence in range(64)]
+    packets = [packet(sequence, entries) for sequence, entries in enumerate(messages)]
+    server = socket.create_server(('127.0.0.1', 0))
+    received = []
+    thread = threading.Thread(target=receiveAll, args=(server, received))
+    thread.start()
+    sink = StreamSink('127.0.0.1', server.getsockname()[1], ENCODING_TYPE)
+    try:
+        sink.send(packets)
+        sink.send(packets[:1])
+    finally:
+        sink.close()
+    thread.join(5)
+    server.close()
+    expected = framed([message for entries in messages for message in entries]) + framed(messages[0])
+    assert b''.join(received) == expected
+
+def testCallbackSink() -> None:
+    received = []
+    CallbackSink(received.append).send([b'a', b'b'])
+    assert received == [b'a', b'b']
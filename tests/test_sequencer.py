@@ -0,0 +1,54 @@
+from __future__ import annotations
+from app.capture import PACKET_HEADER
+from app.sequencer import Sequencer, FEED_A, FEED_B
+
+def packet(sequence: int) -> bytes:
+    return PACKET_HEADER.pack(sequence, sequence * 10) + b'payload'
+
+class Recorder:
+    def __init__(self) -> None:
+        self.sequences = []
+        self.recoveries = []
+
+    def handle(self, data, sequence: int, sendingTime: int) -> None:
+        assert bytes(data) == packet(sequence)
+        self.sequences.append(sequence)
+
+    def recover(self, first: int, last: int) -> None:
+        self.recoveries.append((first, last))
+
+def build(capacity: int = 8) -> tuple:
+    recorder = Recorder()
+    return Sequencer(recorder.handle, capacity, 64, onRecovery=recorder.recover), recorder
+
+def testArbitration() -> None:
+    sequencer, recorder = build()
+    for sequence in (1, 2, 4, 5):
+        sequencer.push(packet(sequence), FEED_A)
+    for sequence in (1, 2, 3, 4, 5, 6):
+        sequencer.push(packet(sequence), FEED_B)
+    assert recorder.sequences == [1, 2, 3, 4, 5, 6]
+    assert sequencer.duplicates == 4
+    assert sequencer.lost == 0
+
+def testFarAheadKeepsBufferedPackets() -> None:
+    # 6 is missing and 7-9 are buffered when 20 arrives beyond the ring
+    sequencer, recorder = build(8)
+    for sequence in (1, 2, 3, 4, 5, 7, 8, 9, 20):
+        sequencer.push(packet(sequence))
+    assert recorder.sequences == [1, 2, 3, 4, 5, 7, 8, 9]
+    assert recorder.recoveries == [(6, 6), (10, 12)]
+    assert sequencer.lost == 4
+    assert sequencer.recoveryNeeded
+    for sequence in range(13, 20):
+        sequencer.push(packet(sequence))
+    assert recorder.sequences[-8:] == list(range(13, 21))
+    assert sequencer.pending == 0
+
+def testFarAheadWithSeveralGaps() -> None:
+    sequencer, recorder = build(8)
+    for sequence in (1, 3, 5, 30):
+        sequencer.push(packet(sequence))
+    assert recorder.sequences == [1, 3, 5]
+    assert recorder.recoveries == [(2, 2), (4, 4), (6, 22)]
+    assert sequencer.lost == 19
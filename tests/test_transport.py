@@ -0,0 +1,116 @@
+from __future__ import annotations
+import asyncio
+import socket
+import pytest
+from app.schema import Schema
+from app.encoder import Encoder
+from app.decoder import Decoder
+from app.capture import PACKET_HEADER, MESSAGE_HEADER
+from app.transport import frame, openDatagramReceiver, openStreamReceiver
+
+SCHEMA = Schema.loadFromFile('resources/FixBinary.xml')
+DECODER = Decoder(SCHEMA)
+
+def book(transactTime: int) -> bytes:
+    buffer = bytearray(256)
+    message = Encoder(SCHEMA).wrap(46, buffer)
+    message.TransactTime = transactTime
+    message.NoMDEntries.begin(0)
+    message.NoOrderIDEntries.begin(0)
+    return bytes(buffer[:message.encodedLength])
+
+def packet(sequence: int, messages: list) -> bytes:
+    return PACKET_HEADER.pack(sequence, sequence * 1000) + b''.join(MESSAGE_HEADER.pack(len(message) + MESSAGE_HEADER.size) + message for message in messages)
+
+async def waitFor(condition, timeout: float = 5.0) -> None:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        if loop.time() > deadline:
+            raise TimeoutError
+        await asyncio.sleep(0.001)
+
+def testDatagramRoundTrip() -> None:
+    async def run() -> tuple:
+        receiver = await openDatagramReceiver(DECODER, '127.0.0.1', 0)
+        address = receiver.transport.get_extra_info('sockname')
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+            sender.sendto(packet(1, [book(10), book(11), book(12)]), address)
+            sender.sendto(b'\x01\x00\x00', address)
+            sender.sendto(packet(2, [book(20)])[:-3], address)
+            sender.sendto(packet(3, [book(30)]), address)
+            await waitFor(lambda: receiver.received == 4)
+        batches = []
+        for _ in range(receiver.queue.qsize()):
+            batch = await receiver.__anext__()
+            batches.append((batch.sequence, batch.sendingTime, [message.TransactTime for message in batch]))
+        receiver.close()
+        return receiver, batches
+
+    receiver, batches = asyncio.run(run())
+    assert batches == [(1, 1000, [10, 11, 12]), (3, 3000, [30])]
+    assert receiver.invalid == 2
+    assert receiver.messages == 4
+
+def testDatagramFullQueueIsDropped() -> None:
+    async def run():
+        receiver = await openDatagramReceiver(DECODER, '127.0.0.1', 0, maxsize=2)
+        address = receiver.transport.get_extra_info('sockname')
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+            for sequence in range(5):
+                sender.sendto(packet(sequence, [book(sequence)]), address)
+            await waitFor(lambda: receiver.received == 5)
+        receiver.close()
+        return receiver
+
+    receiver = asyncio.run(run())
+    assert receiver.queue.qsize() == 2
+    assert receiver.dropped == 3
+
+async def serve(chunks: list) -> tuple:
+    # loopback server writing the chunks with a pause between them, then closing the connection
+    async def handle(reader, writer) -> None:
+        for chunk in chunks:
+            writer.write(chunk)
+            await writer.drain()
+            await asyncio.sleep(0.01)
+        writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    return server, server.sockets[0].getsockname()[1]
+
+def testStreamFramesSplitAcrossReads() -> None:
+    data = b''.join(frame(book(time)) for time in range(6))
+    # cuts inside the SOFH header, inside a message and between frames
+    chunks = [data[:3], data[3:40], data[40:41], data[41:150], data[150:]]
+
+    async def run() -> tuple:
+        server, port = await serve(chunks)
+        receiver, writer = await openStreamReceiver(DECODER, '127.0.0.1', port, readSize=32)
+        times = []
+        async for batch in receiver:
+            times.extend(message.TransactTime for message in batch)
+        writer.close()
+        server.close()
+        return receiver, times
+
+    receiver, times = asyncio.run(run())
+    assert times == list(range(6))
+    assert receiver.received == len(data)
+    assert receiver.exception is None
+
+def testStreamEndingInsideFrame() -> None:
+    data = frame(book(1)) + frame(book(2))[:-5]
+
+    async def run() -> list:
+        server, port = await serve([data])
+        receiver, writer = await openStreamReceiver(DECODER, '127.0.0.1', port)
+        times = []
+        with pytest.raises(Exception, match='inside a frame'):
+            async for batch in receiver:
+                times.extend(message.TransactTime for message in batch)
+        writer.close()
+        server.close()
+        return times
+
+    assert asyncio.run(run()) == [1]
@@ -0,0 +1,56 @@
+from __future__ import annotations
+import struct
+import pytest
+from app.schema import Schema
+from app.encoder import Encoder
+from app.decoder import Decoder
+
+SCHEMA = Schema.loadFromFile('tests/resources/versioned.xml')
+HEADER = struct.Struct('<HHHH')
+INT64_NULL = -2 ** 63
+
+def current() -> bytes:
+    # version 2 sender: Px and LegPx present
+    buffer = bytearray(256)
+    message = Encoder(SCHEMA).wrap(1, buffer)
+    message.Id = 5
+    message.Px.mantissa = 12345
+    leg = message.Legs.begin(1).next()
+    leg.LegId = 9
+    leg.LegPx.mantissa = 77
+    message.Note.put(b'hi')
+    return bytes(buffer[:message.encodedLength])
+
+def older() -> bytes:
+    # version 1 sender: blocks end before the fields added in version 2
+    return b''.join([
+        HEADER.pack(4, 1, 8, 1),
+        struct.pack('<I', 6),
+        struct.pack('<HH', 4, 1),
+        struct.pack('<I', 10),
+        struct.pack('<H', 2) + b'ok'
+    ])
+
+def check(decoder: Decoder, buffer: bytes) -> None:
+    message = decoder.decode(buffer)
+    leg = next(iter(message.Legs))
+    if HEADER.unpack_from(buffer)[3] == 1:
+        assert (message.Id, message.Px.mantissa, leg.LegId, leg.LegPx.mantissa) == (6, INT64_NULL, 10, INT64_NULL)
+        assert bytes(message.Note) == b'ok'
+    else:
+        assert (message.Id, message.Px.mantissa, leg.LegId, leg.LegPx.mantissa) == (5, 12345, 9, 77)
+        assert bytes(message.Note) == b'hi'
+    assert message.Px.exponent == -2
+
+@pytest.mark.parametrize('order', [(current, older), (older, current)])
+def testCompositesOfBothVersions(order: tuple) -> None:
+    # composite views are compiled per version layout, a view of one version must not serve the other
+    decoder = Decoder(SCHEMA)
+    for build in order + order:
+        check(decoder, build())
+
+def testSkipOlderVersion() -> None:
+    decoder = Decoder(SCHEMA)
+    buffer = older() + current()
+    assert decoder.skip(buffer, 0) == len(older())
+    assert decoder.skip(buffer, len(older())) == len(buffer)